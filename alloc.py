@@ -1,62 +1,181 @@
 import argparse
-import re
 import heapq
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
+import sys
 import time
-from collections import Counter, defaultdict
+import tracemalloc
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
 from typing import List, NamedTuple
-from functools import cmp_to_key
+from functools import cmp_to_key, wraps
 from alloc_utils import *
+from iloc_ir import *
+import iloc_sim
+import iloc_sched
 
 
 
 NUM_FEASIBLE = 2
+BP = 0  # physical register number of the base pointer r0
+REMAT = 1   # spilled to no slot, reloaded with the loadI defining it
+#operands and targets of the branches, e.g. 'cbr r1 -> L1, L2'
+BRANCH_OPERANDS = {'jumpI': (0, 1), 'jump': (0, 1), 'cbr': (1, 2)}
+
+def analysis(init):
+    """Records the time an allocator's __init__ spends on the k independent
+    analysis of its block as self.analysis_ms.
+    """
+    @wraps(init)
+    def wrapper(self, instructions, *args, **kwargs):
+        tic = time.perf_counter()
+        init(self, instructions, *args, **kwargs)
+        self.analysis_ms = (time.perf_counter() - tic) * 1000
+    return wrapper
 
-def timer(fun):
-    def wrapper(*args):
-        tic = time.time()
-        res = fun(*args)
-        toc = time.time()
-        duration = (toc - tic) * 1000
-        print(f"{fun.__name__} ran in {duration} ms. using {args[1]} registers")
-        return res
+
+def instrumented(allocate):
+    """Attaches an AllocStats describing every allocate(k) call to
+    self.stats. If tracemalloc is tracing, the peak memory allocated on top
+    of what was in use before the call is measured too.
+    """
+    @wraps(allocate)
+    def wrapper(self, k):
+        self.stats = stats = AllocStats(type(self).__name__, k, self.instructions)
+        stats.phases['analysis'] = self.analysis_ms
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+
+        tic = time.perf_counter()
+        stats.result = allocate(self, k)
+        stats.ms = (time.perf_counter() - tic) * 1000
+        if tracing:
+            peak = tracemalloc.get_traced_memory()[1]
+            stats.peak_kib = (peak - before) // 1024
+        return stats.result
     return wrapper
 
 
-class Instruction(NamedTuple):
-    opcode: str     # instruction name
-    op1: str        # first operand: virtual register or integer constant
-    op2: str = None # second operand: virtual register/None/integer constant
-    dst: str = None # destination register
+class Sweep(NamedTuple):
+    k: int
+    result: Block
+    stats: AllocStats
 
-    @property
-    def operands(self):
-        return (self.op1, self.op2)
 
+class BaseAlloc:
+    """Behaviour shared by every allocator. Subclasses analyze their block
+    once in __init__ and implement allocate(k).
+    """
 
-    def __str__(self) -> str:
-        if self.opcode == 'storeAI':
-            return f'{self.opcode}\t{self.op1}\t=> {self.op2}, {self.dst}'
-        
-        if self.opcode == 'store':
-            return f'{self.opcode}\t{self.op1}\t=> {self.op2}'
+    def _finish(self, result) -> Block:
+        """Removes redundant spill code from result and lets spilled values
+        that are never live together share their spill slots, recording
+        what was removed and the frame size before in stats.
+        """
+        with self.stats.phase('rewrite'):
+            self.stats.spill_code_removed = remove_redundant_spill_code(result)
+            self.stats.unshared_frame = color_slots(self.instructions, result)
+        return result
+
+
+    def _rewrite_spilled(self, k, register, location, constants={}) -> Block:
+        """Rewrites self.instructions with kept registers in register[vr] and
+        spilled ones in memory at location[vr], reloading constants with
+        their loadI instead. Spill code goes through whichever registers
+        hold no live value at that instruction, as fit_spill_code ensures
+        there are enough of.
+        """
+        block = self.instructions
+        last = Liveness.of(block).last
+        vbp = block.bp
+        owner = [None] * (k + 1) # virtual register each physical one holds
+        def free(j, taken):
+            # first register whose value is dead before instruction j
+            for reg in range(1, k + 1):
+                vr = owner[reg]
+                if (vr is None or last[vr] < j) and reg not in taken:
+                    owner[reg] = None
+                    return reg
+
+        result = Block(physical_names(k))
+        for j, (opcode, op1, op2, dst, const) in enumerate(block.rows()):
+            ops = [op1, op2]
+            srcs = []
+            for field, bit in enumerate((OP1_CONST, OP2_CONST)):
+                vr = ops[field]
+                if vr == NONE or const & bit:
+                    continue
+                if vr == vbp:
+                    ops[field] = BP
+                else:
+                    srcs.append(field)
+                    if location[vr] is None:
+                        owner[register[vr]] = vr
+            loaded = {}
+            for field in srcs:
+                vr = ops[field]
+                if location[vr] is None:
+                    ops[field] = register[vr]
+                    continue
+                if vr not in loaded:
+                    reg = loaded[vr] = free(j, loaded.values())
+                    if vr in constants:
+                        result.append(LOADI, constants[vr], NONE, reg, OP1_CONST)
+                    else:
+                        result.append(LOADAI, BP, location[vr], reg, OP2_CONST)
+                ops[field] = loaded[vr]
+
+            store = None
+            if dst == NONE or const & DST_CONST:
+                pass
+            elif dst == vbp:
+                dst = BP
+            elif location[dst] is None:
+                owner[register[dst]] = dst
+                dst = register[dst]
+            elif dst in constants:
+                continue # rematerialized at every use instead
+            else:
+                reg = free(j + 1, ())
+                store = (STOREAI, reg, BP, location[dst], DST_CONST)
+                dst = reg
+
+            result.append(opcode, *ops, dst, const)
+            if store:
+                result.append(*store)
 
-        if self.opcode == 'output':
-            return f'{self.opcode}\t{self.op1}'
+        return result
 
-        if self.opcode == 'outputAI':
-            return f'{self.opcode} {self.op1}, {self.dst}'
 
-        if self.op2 is None: #regular 2 argument instruction
-            return f'{self.opcode}\t{self.op1}\t=> {self.dst}'
-        #regular 3 argument instructions
-        return f'{self.opcode}\t{self.op1}, {self.op2}\t=> {self.dst}'
+    def allocate_many(self, ks) -> List[Sweep]:
+        """Allocates the block for every number of registers in ks, reusing
+        the k independent analysis.
+        """
+        sweep = []
+        for k in ks:
+            result = self.allocate(k)
+            sweep.append(Sweep(k, result, self.stats))
+        
+        return sweep
 
 
-class BottomUpAlloc:
+class BottomUpAlloc(BaseAlloc):
+    """Values defined by a loadI are rematerialized rather than spilled:
+    evicting them stores nothing and they are reloaded with the same loadI,
+    unless rematerialize is False.
+    """
+    rematerialize = True
 
+    @analysis
     def __init__(self, instructions) -> None:
-        self.instructions = instructions
-        self.bp = self.Register('r0')
+        self.instructions = Block.encode(instructions)
+        self.bp = self.Register(BP)
 
 
     def _alloc(self, vr):
@@ -65,19 +184,20 @@ class BottomUpAlloc:
         time.
         """
         reg = None
-        if vr == self.bp.phy_name: # avoid reassigning r0
+        if vr == self.vbp: # avoid reassigning r0
             return self.bp
             
         if len(self.available) > 0:
             reg = self.available.pop()
         else:
             #find the register that we won't need for the longest time
-            reg = max(self.regs, key= lambda x: x.next)
+            reg = self.farthest.top()
             self._spill(reg)
         
         self.location[vr] = reg
         reg.vr_name = vr
-        reg.next = -1 #avoids reusing this register for the next operand
+        #avoids reusing this register for the next operand
+        self._set_next(reg, -1)
 
         return reg
 
@@ -88,46 +208,58 @@ class BottomUpAlloc:
         and a physical is made available to hold vr. Otherwise a new physical
         register is mapped.
         """
-        reg = None        
-
-        if vr in self.location and vr not in self.spilled:
-            reg = self.location[vr]
-        
-        elif vr in self.spilled:
-            pos = self.spilled[vr]
+        pos = self.spilled[vr]
+        if pos is not None:
             reg = self._alloc(vr)
-            self.result.append(
-                Instruction("loadAI", self.bp.phy_name, pos, reg.phy_name)
-            )
-            del self.spilled[vr]
+            if pos == REMAT:
+                self.result.append(LOADI, self.constant[vr], NONE, reg.phy_name, OP1_CONST)
+            else:
+                self.result.append(LOADAI, BP, pos, reg.phy_name, OP2_CONST)
+                self.home[vr] = pos # clean until redefined
+            self.spilled[vr] = None
         else:
-            reg = self._alloc(vr)
+            reg = self.location[vr]
+            if reg is None:
+                reg = self._alloc(vr)
         
         return reg    
 
     
     def _spill(self, reg):
-        """Restore register to default values and generate store instruction"""
+        """Restore register to default values and generate store instruction,
+        unless the value can be rematerialized or is clean, still in the
+        slot it was reloaded from."""
         vr = reg.vr_name
-        self.spilled[vr] = self.offset
-        self.result.append(
-            Instruction("storeAI", reg.phy_name, self.bp.phy_name, self.offset)
-        )
+        if self.rematerialize and self.constant[vr] is not None:
+            self.spilled[vr] = REMAT
+        elif self.home[vr] is not None:
+            self.spilled[vr] = self.home[vr]
+        else:
+            self.spilled[vr] = self.offset
+            self.result.append(STOREAI, reg.phy_name, BP, self.offset, DST_CONST)
+            self.offset -= 4
         reg.vr_name = None
-        reg.next = float('inf')
-        self.offset -= 4
+        self._set_next(reg, float('inf'))
     
 
     def _free(self, reg):
         if reg == self.bp:
             return
-        if reg.vr_name:
-            del self.location[reg.vr_name]
+        if reg.vr_name is not None:
+            self.location[reg.vr_name] = None
         reg.vr_name = None
-        reg.next = float('inf')
+        self._set_next(reg, float('inf'))
         self.available.append(reg)
 
-    @timer
+
+    def _set_next(self, reg, next):
+        """Updates the next usage of reg, keeping the heap of registers in
+        sync."""
+        reg.next = next
+        if reg != self.bp:
+            self.farthest.update(reg.phy_name - 1)
+
+    @instrumented
     def allocate(self, num_regs):
         """Returns resulting list of instructions after performing register
         reallocation and assignment.
@@ -135,52 +267,76 @@ class BottomUpAlloc:
         if num_regs < 2:
             raise ValueError("Number of registers must be 2 or greater.")
         
-        self.regs = [self.Register(f"r{j}") for j in range(1, num_regs + 1)]
+        block = self.instructions
+        self.regs = [self.Register(j) for j in range(1, num_regs + 1)]
         self.offset = -4
         self.available = [r for r in self.regs]
-        self.location = {'r0': self.bp} #set r0 aside from allocation
-        self.spilled = {}
-        self.result = []
+        self.farthest = NextUseHeap(self.regs)
+        self.location = [None] * len(block.names)
+        self.spilled = [None] * len(block.names)
+        self.constant = [None] * len(block.names)  # loadI of the current value
+        self.home = [None] * len(block.names)   # slot holding the current value
+        self.vbp = block.bp
+        if self.vbp != NONE:
+            self.location[self.vbp] = self.bp #set r0 aside from allocation
+        self.result = Block(physical_names(num_regs))
     
-        next_use = get_vr_usage(self.instructions)
-        for i in self.instructions:
-            new_instr = [i.opcode]
-            # ensure both operands are in physical registers 
-            for vr in i.operands:
-                name = vr
-                if isregister(vr):
-                    reg = self._ensure(vr)
-                    name = reg.phy_name
-                new_instr.append(name)
-            # check if we can reuse any operand as destination
-            for vr in i.operands:
-                if isregister(vr):
-                    reg = self.location[vr]
-                    if not next_use[vr]:
-                        self._free(reg)
-                    else: # we couldn't reuse so update its next usage
-                        reg.next = next_use[vr].pop() 
-            # allocate register for destination
-            dst = vr = i.dst
-            if isregister(vr):
-                reg = self._alloc(vr)
-                dst = reg.phy_name
-                try:
-                    next_use[vr].pop() # discard current use 
-                    reg.next = next_use[vr].pop()
-                except:
-                    self._free(reg)
-                    
-            self.result.append(Instruction(*new_instr, dst))
+        with self.stats.phase('analysis'):
+            next_use = Liveness.of(block).next_use
+        #registers are assigned while the block is rewritten, in one pass
+        with self.stats.phase('assign'):
+            step = self._step
+            for j, row in enumerate(block.rows()):
+                step(row, next_use, 3 * j)
         
-        return self.result
+        return self._finish(self.result)
+
+
+    def _step(self, row, next_use, slot):
+        """Rewrites one instruction into self.result. next_use[slot + field]
+        is the next use of the register in each field, NEVER if it is dead.
+        """
+        opcode, op1, op2, dst, const = row
+        location = self.location
+        # ensure both operands are in physical registers 
+        srcs = []
+        if op1 != NONE and not const & OP1_CONST:
+            srcs.append((op1, slot))
+            op1 = self._ensure(op1).phy_name
+        if op2 != NONE and not const & OP2_CONST:
+            srcs.append((op2, slot + 1))
+            op2 = self._ensure(op2).phy_name
+        # check if we can reuse any operand as destination
+        for vr, operand in srcs:
+            reg = location[vr]
+            if next_use[operand] == NEVER:
+                self._free(reg)
+            else: # we couldn't reuse so update its next usage
+                self._set_next(reg, next_use[operand])
+        # allocate register for destination
+        if dst != NONE and not const & DST_CONST:
+            # a redefined register's previous value is dead
+            self.spilled[dst] = None
+            self.constant[dst] = op1 if opcode == LOADI else None
+            self.home[dst] = None
+            reg = location[dst]
+            if reg is not None and reg.vr_name == dst:
+                self._free(reg)
+            reg = self._alloc(dst)
+            dst = reg.phy_name
+            if next_use[slot + 2] == NEVER:
+                self._free(reg)
+            else:
+                self._set_next(reg, next_use[slot + 2])
+            
+        self.result.append(opcode, op1, op2, dst, const)
 
 
     class Register:
         """Physical register representation.
 
-        phy_name: physical name
-        vr_name: name of the virtual register it is representing
+        phy_name: physical register number
+        vr_name: id of the virtual register it is representing
         next: index of the next usage of its virtual register.
         """  
         def __init__(self, phy_name, vr_name=None, next=float('inf')):
@@ -193,213 +349,184 @@ class BottomUpAlloc:
             return f"Register{self.phy_name, self.vr_name, self.next}"
 
 
-class SimpleAlloc:
+class SimpleAlloc(BaseAlloc):
+    @analysis
     def __init__(self, instructions) -> None:
-        self.instructions = instructions
-        self.count = get_reg_count(instructions)
-        self.used = [False] * NUM_FEASIBLE
-        self.bp = 'r0'  # base pointer
-    
-
-    def spill(self, instr, param, offset):
-        """Inserts instructions to store/load a virtual register into an available
-        space in memory.
-        """
-        i = 0
-        for used_reg in self.used:
-            if not used_reg: break
-            i += 1
-        
-        i %= len(self.used)  # if all feasibles register are used then reuse r1.
-        self.used[i] = True
-        feasible_reg = f'r{i + 1}'
-        vr = instr[param]
-        self.loc[vr] = instr[param] = feasible_reg
-        
-        store = None
-        if param == 'dst':
-            # save this value to memory AFTER executing previous instruction
-            store = Instruction('storeAI', feasible_reg, self.bp, offset)
-        else:
-            # load value from memory into source register
-            self.result.append(
-                Instruction('loadAI', self.bp, offset, feasible_reg)
-            )
-
-        return store
+        self.instructions = Block.encode(instructions)
+        self.count = Liveness.of(self.instructions).count
+        self.most_common = sorted(
+            range(len(self.count)), key=self.count.__getitem__, reverse=True
+        )
+        self.bp = BP  # base pointer
     
 
     def assign(self, k) -> tuple:
-        """Assigns the most used k - F virtual registers to physical registers.
-        The remaining ones are assigned to a memory location. 
-        F physical registers are reserved handle spill. Where F is the number of
-        feasible registers.
+        """Assigns the most used k virtual registers to physical registers.
+        The remaining ones are assigned to a memory location, and so are the
+        least used of those live where the spill code would not fit in the
+        registers free there.
         """
-        allocd, memory = {'r0': self.bp}, {}
+        vbp = self.instructions.bp
+        allocd, memory = [None] * len(self.count), [None] * len(self.count)
+        if vbp != NONE:
+            allocd[vbp] = self.bp
         offset = -4
-        total_vars = len(self.count) - (self.bp in self.count)
-        # if we have enough registers do not reserve feasible registers.
-        j = NUM_FEASIBLE + 1 if total_vars > k else 1
-        for p in self.count.most_common():
-            reg, _ = p
-            if reg == self.bp: continue
+        j = 1
+        for reg in self.most_common:
+            if reg == vbp: continue
             if j <= k:
-                allocd[reg] = f'r{j}'
+                allocd[reg] = j
                 j += 1
             else:
                 memory[reg] = offset
                 offset -= 4
+
+        spilled = [pos is not None for pos in memory]
+        rank = [0] * len(self.count)
+        for i, reg in enumerate(self.most_common):
+            rank[reg] = -i
+        for reg in fit_spill_code(self.instructions, spilled, k, rank):
+            allocd[reg], memory[reg] = None, offset
+            offset -= 4
         
         return allocd, memory
 
-    @timer
+    @instrumented
     def allocate(self, num_registers):
         if num_registers < NUM_FEASIBLE:
             raise ValueError(f"number of register must be at least {NUM_FEASIBLE}.")
 
-        self.result = []
-        allocd, memory = self.assign(num_registers)
-        self.loc = {}  # keeps track of vr assigned to feasible registers
-
-        for instr in self.instructions:
-            new_inst = instr._asdict()
-            store_inst = None
-            #check which of the registers needs to be spilled
-            for i, param in enumerate(new_inst):
-                if i == 0: #skip instruction name
-                    continue
-                reg = new_inst[param]
+        with self.stats.phase('assign'):
+            allocd, memory = self.assign(num_registers)
 
-                if reg in self.loc: # reuse the same feasible register
-                    new_inst[param] = self.loc[reg]
-                else:
-                    if reg in memory:
-                        #generate spill code
-                        pos = memory[reg]
-                        store_inst = self.spill(new_inst, param, pos)
-                    elif reg in allocd:
-                        # just assign a physical register  
-                        new_inst[param] = allocd[reg]
-            
-            self.result.append(Instruction(**new_inst))
-            if store_inst:
-                self.result.append(store_inst)
+        with self.stats.phase('rewrite'):
+            self.result = self._rewrite_spilled(num_registers, allocd, memory)
             
-            self.loc.clear()
-            self.used[0] = self.used[1] = False
-            
-        return self.result
+        return self._finish(self.result)
 
 
-class TopDownAlloc:
+class TopDownAlloc(BaseAlloc):
     
+    @analysis
     def __init__(self, instructions) -> None:
-        self.instructions = instructions
-        self.count = get_reg_count(instructions)
-        self.live_ranges = get_live_ranges(instructions)
-        self.r1_free = True
-        self.feasible = [f'r{j}' for j in range(1, NUM_FEASIBLE + 1)]
+        self.instructions = Block.encode(instructions)
+        self.liveness = live = Liveness.of(self.instructions)
+        # the order in which registers get spilled does not depend on k.
+        tmp = [
+            [vr, count, start, float('inf') if end == NEVER else end]
+            for vr, (count, start, end) in enumerate(
+                zip(live.count, live.start, live.end)
+            )
+        ]
+        self.spill_order = [e[0] for e in sorted(tmp, key=cmp_to_key(range_cmp))]
 
 
     def _alloc(self, vr):
-        if len(self.free) > 0:
-            reg = self.free.pop()
-            self.loc[vr] = reg
-            return reg
-        
-        if vr not in self.mem:
-            #create a new entry in memory for this value
-            self.mem[vr] = self.pos
-            self.pos -= 4
-        
-        reg = 'r1' if self.r1_free else 'r2'
-        self.r1_free = not self.r1_free
+        reg = self.loc[vr] = self.free.pop()
         return reg
         
 
-    def _ensure(self, vr):
-        if vr in self.loc:
+    def _ensure(self, vr, loaded):
+        if self.loc[vr] is not None:
             reg = self.loc[vr]
         
-        elif vr in self.mem:
-            pos = self.mem[vr]
-            reg = 'r1' if self.r1_free else 'r2'
-            self.r1_free = not self.r1_free 
-            self.result.append(Instruction("loadAI", 'r0', pos, reg))
+        elif self.mem[vr] is not None:
+            if vr not in loaded:
+                loaded[vr] = self.free.pop()
+                self.result.append(LOADAI, BP, self.mem[vr], loaded[vr], OP2_CONST)
+            reg = loaded[vr]
         else:
-            reg = self._alloc()
+            reg = self._alloc(vr)
         
         return reg
     
 
-    def get_reg(self, inst, curr_pos):
+    def get_reg(self, curr_pos, op1, op2, dst, const):
+        last = self.liveness.last
         regs = []
         src_regs = []
-        for vr in inst.operands:
-            if not isregister(vr) or vr == 'r0':
+        loaded = {} # spilled operands -> register they were loaded into
+        for vr, bit in ((op1, OP1_CONST), (op2, OP2_CONST)):
+            if vr == NONE or const & bit:
                 regs.append(vr)
+            elif vr == self.vbp:
+                regs.append(BP)
             else:
-                reg = self._ensure(vr)
+                reg = self._ensure(vr, loaded)
                 regs.append(reg)
                 src_regs.append(vr)
 
-        for vr in src_regs:
-            live = self.live_ranges[vr]
-            if curr_pos > live.end and vr in self.loc:
+        for vr in set(src_regs):
+            if curr_pos == last[vr] and self.loc[vr] is not None:
                 reg = self.loc[vr]
                 # we do not need this register anymore
                 self.free.append(reg)
-                del self.loc[vr]
-        
-        reg = vr = inst.dst
-        if vr != 'r0' and isregister(vr): #disregard r0 for allocation
-            # use r1 as destination  if vr was spilled 
-            reg = self.feasible[0] if vr in self.mem else self._alloc(vr)
+                self.loc[vr] = None
+        self.free.extend(loaded.values())
         
+        reg = vr = dst
         spill = None
-        if reg in self.feasible:
-            pos = self.mem[vr]
-            spill = Instruction("storeAI", reg, 'r0', pos)
+        if vr == NONE or const & DST_CONST:
+            pass
+        elif vr == self.vbp: #disregard r0 for allocation
+            reg = BP
+        else:
+            if self.mem[vr] is not None:
+                # stored from any register free after this instruction
+                reg = self.free[-1]
+                spill = (STOREAI, reg, BP, self.mem[vr], DST_CONST)
+            else:
+                reg = self.loc[vr] if self.loc[vr] is not None else self._alloc(vr)
+                if curr_pos == last[vr]:
+                    self.free.append(reg)
+                    self.loc[vr] = None
         
         regs.append(reg)
 
         return regs, spill
 
-    @timer
+    @instrumented
     def allocate(self, k):
-        self.mem = {}
-        self.loc = {}
-        
-        self.free = [f'r{j}' for j in range(NUM_FEASIBLE + 1, k + 1)]
-        reg_count = self.count.items()
-        live_ranges = self.live_ranges.values()
-        max_live = get_max_live(live_ranges)       
-        tmp = [[*reg, *lr] for reg, lr in zip(reg_count, live_ranges)]
+        if k < 2:
+            raise ValueError("Number of registers must be 2 or greater.")
+
+        block = self.instructions
+        self.mem = [None] * len(block.names)
+        self.loc = [None] * len(block.names)
+        self.free = [j for j in range(1, k + 1)]
 
         self.pos = -4
-        for e in sorted(tmp, key=cmp_to_key(range_cmp)):
-            if max_live <= k - NUM_FEASIBLE:
-                break
-            vr = e[0]
-            self.mem[vr] = self.pos
-            self.pos -= 4
-            max_live -= 1
+        with self.stats.phase('assign'):
+            # spill where the values live plus spill code exceed k registers
+            rank = [0] * len(block.names)
+            for i, vr in enumerate(self.spill_order):
+                rank[vr] = i
+            spilled = [False] * len(block.names)
+            for vr in fit_spill_code(block, spilled, k, rank):
+                self.mem[vr] = self.pos
+                self.pos -= 4
         
-        self.result = []
-        for j, inst in enumerate(self.instructions):
-            regs, spill = self.get_reg(inst, j)
-            self.result.append(Instruction(inst.opcode, *regs))
-
-            if spill is not None:
-                self.result.append(spill)
+        self.result = Block(physical_names(k))
+        self.vbp = block.bp
+        with self.stats.phase('rewrite'):
+            for j, (opcode, *fields) in enumerate(block.rows()):
+                regs, spill = self.get_reg(j, *fields)
+                self.result.append(opcode, *regs, fields[-1])
+
+                if spill is not None:
+                    self.result.append(*spill)
         
-        return self.result
+        return self._finish(self.result)
 
 
-class LinearScanAlloc:
-    
+class LinearScanAlloc(BaseAlloc):
+    """Spilled values whose only definition is a loadI are rematerialized,
+    as in BottomUpAlloc.
+    """
+    rematerialize = True
+
     class LiveInterval(NamedTuple):
-        name: str
+        name: int
         start: int
         end: int
 
@@ -411,160 +538,1154 @@ class LinearScanAlloc:
             return self.end > x.end
 
 
+    @analysis
     def __init__(self, instructions) -> None:
-        self.instructions = instructions
-        self.live_ranges = get_live_ranges(self.instructions)
+        self.instructions = Block.encode(instructions)
+        live = Liveness.of(self.instructions)
+        bp = self.instructions.bp
+        self.live_ranges = [
+            self.LiveInterval(vr, start, end)
+            for vr, (start, end) in enumerate(zip(live.start, live.end))
+            if vr != bp
+        ]
+        #spilled, these are reloaded with their loadI and never stored
+        self.constants = constants(self.instructions)
         self.active = None
         self.free_reg = None
         self.vr_to_reg = None
         self.sp = None
-        self.bp = 'r0'
-
-        try:
-            del self.live_ranges['r0']
-        except KeyError:
-            pass
+        self.bp = BP
 
-
-    def make_interval(self, key):
-        return self.LiveInterval(key, *self.live_ranges[key])
-    
-    @timer
+    @instrumented
     def allocate(self, k):
-        self.vr_to_reg = {}
-        self.location = {}
-        self.active = []
-        self.sp = -4
-        start, end = 1, k + 1
-        
-        if len(self.live_ranges) > k:
-            # reserve feasible registers
-            start = NUM_FEASIBLE + 1
-            k -= NUM_FEASIBLE
-        
         if k < 2:
-            # we need to spill everything allocation is done
-            for vr in self.live_ranges:
-                self.location[vr] = self.sp
-                self.sp -=4
-            return self.rewrite_instructions()
-
-        self.free_reg = [f'r{j}' for j in range(start, end)]
+            raise ValueError("Number of registers must be 2 or greater.")
 
-        for i in map(self.make_interval, self.live_ranges):
-            self.expire_old_intervals(i)
-            if len(self.active) == k:
-                self.spill_at_interval(i)
-            else:
-                reg = self.free_reg.pop()
-                self.vr_to_reg[i.name] = reg
-                heapq.heappush(self.active, i)
+        block = self.instructions
+        self.vr_to_reg = [None] * len(block.names)
+        self.location = [None] * len(block.names)
+        if block.bp != NONE:
+            self.vr_to_reg[block.bp] = self.bp
+        self.active = IntervalSet()
+        self.sp = -4
+        self.num_regs = k
+        self.free_reg = [j for j in range(1, k + 1)]
+        constants = self.constants if self.rematerialize else {}
+
+        with self.stats.phase('assign'):
+            for i in self.live_ranges:
+                self.expire_old_intervals(i)
+                if len(self.active) == k:
+                    self.spill_at_interval(i)
+                else:
+                    reg = self.free_reg.pop()
+                    self.vr_to_reg[i.name] = reg
+                    self.active.add(i)
+
+            # then those ending last where spill code does not fit
+            last = Liveness.of(block).last
+            spilled = [pos is not None for pos in self.location]
+            rank = [-end for end in last]
+            for vr in fit_spill_code(block, spilled, k, rank, constants):
+                self.location[vr] = self.sp
+                self.vr_to_reg[vr] = None
+                self.sp -= 4
         
-        return self.rewrite_instructions()
+        with self.stats.phase('rewrite'):
+            result = self.result = self._rewrite_spilled(
+                k, self.vr_to_reg, self.location, constants
+            )
+        return self._finish(result)
                 
 
     def expire_old_intervals(self, i):
         while self.active:
-            j = heapq.heappop(self.active)
+            j = self.active.min()
             if j.end >= i.start:
-                heapq.heappush(self.active, j)
                 return
+            self.active.remove(j)
             phy_reg = self.vr_to_reg[j.name]
             self.free_reg.append(phy_reg)
 
 
     def spill_at_interval(self, i):
-        spill = max(self.active)
+        spill = self.active.max()
         if spill.end > i.end:
             self.vr_to_reg[i.name] = self.vr_to_reg[spill.name]
             self.active.remove(spill)
             
             self.location[spill.name] = self.sp
-            del self.vr_to_reg[spill.name]
-            heapq.heappush(self.active, i)
+            self.vr_to_reg[spill.name] = None
+            self.active.add(i)
         else:
             self.location[i.name] = self.sp
         
         self.sp -= 4
 
+                 
+class SplittingLinearScanAlloc(LinearScanAlloc):
+    """Linear scan splitting intervals rather than spilling them whole,
+    as in second-chance binpacking.
+
+    Every definition starts an interval of its own, so registers are free
+    in the lifetime holes between the last read of a value and the next
+    definition of its register. When no register is free, the active
+    interval whose next read is the farthest away is split there: it is
+    stored, unless memory already holds its value or it is a constant, and
+    the rest of it is queued again from that next read, where it is
+    reloaded into whichever register is free then. Values thus stay in
+    registers across dense runs of uses and in memory only between them.
+
+    Positions are 2j for the operands instruction j reads and 2j + 1 for
+    the register it defines.
+    """
+
+    @analysis
+    def __init__(self, instructions) -> None:
+        super().__init__(instructions)
+        block = self.instructions
+        n, bp = len(block), block.bp
+        #next_read[s]: operand slot of the next read of the value in slot s
+        next_read = array('i', [NEVER]) * (3 * n)
+        upcoming = [NEVER] * len(block.names)   # next read of the current value
+        last = [NEVER] * len(block.names)       # position of its last read
+        intervals = []                          # (start, end, vr, first read)
+        rows = zip(
+            range(n - 1, -1, -1), reversed(block.opcode), reversed(block.op1),
+            reversed(block.op2), reversed(block.dst), reversed(block.const)
+        )
+        for j, opcode, op1, op2, dst, const in rows:
+            reads = [(dst, DST_CONST, 2)] if opcode in NO_DEFINITION else []
+            if not reads and dst != NONE and not const & DST_CONST and dst != bp:
+                end = 2 * j + 1 if last[dst] == NEVER else last[dst]
+                intervals.append((2 * j + 1, end, dst, upcoming[dst]))
+                upcoming[dst] = last[dst] = NEVER
+            reads += [(op2, OP2_CONST, 1), (op1, OP1_CONST, 0)]
+            for reg, bit, field in reads:
+                if reg == NONE or const & bit or reg == bp:
+                    continue
+                slot = 3 * j + field
+                next_read[slot] = upcoming[reg]
+                upcoming[reg] = slot
+                if last[reg] == NEVER:
+                    last[reg] = 2 * j
+        #registers read before any definition hold what the block starts with
+        for reg, slot in enumerate(upcoming):
+            if slot != NEVER:
+                intervals.append((2 * (slot // 3), last[reg], reg, slot))
+
+        self.next_read = next_read
+        self.intervals = sorted(intervals)
+
+    @instrumented
+    def allocate(self, k):
+        if k < 2:
+            raise ValueError("Number of registers must be 2 or greater.")
+
+        block = self.instructions
+        next_read = self.next_read
+        constants = self.constants if self.rematerialize else {}
+        self.num_regs = k
+        self.sp = -4
+        self.location = {}  # vr -> its spill slot
+        reg_at = self.reg_at = array('i', [NONE]) * (3 * len(block))
+        self.before = defaultdict(list) # j -> spill code placed before j
+        #pieces of intervals, the rests of split ones being queued in unhandled
+        vr, reg, cursor, end, next_pos = [], [], [], [], []
+        unhandled = []  # (start, piece)
+        #active pieces by next read, entries are refreshed once it is passed
+        soonest, farthest = [], []  # (next read, piece), (-next read, piece)
+        dirty = bytearray(len(block.names)) # value not in memory yet
+        free = list(range(k, 0, -1))
+        active = IntervalSet()
+
+        def advance(p, pos):
+            """Assigns reg[p] to the reads of piece p before pos, returns the
+            position of its next read."""
+            slot, r = cursor[p], reg[p]
+            while slot != NEVER and 2 * (slot // 3) < pos:
+                reg_at[slot] = r
+                slot = next_read[slot]
+            cursor[p] = slot
+            return NEVER if slot == NEVER else 2 * (slot // 3)
+
+        def track(p, pos):
+            use = next_pos[p] = advance(p, pos)
+            heapq.heappush(soonest, (use, p))
+            heapq.heappush(farthest, (-use, p))
+
+        with self.stats.phase('assign'):
+            intervals = iter(self.intervals)
+            interval = next(intervals, None)
+            while interval is not None or unhandled:
+                if unhandled and (interval is None or unhandled[0][0] <= interval[0]):
+                    pos, p = heapq.heappop(unhandled)
+                    reload = True
+                else:
+                    pos, stop, value, slot = interval
+                    p = len(vr)
+                    vr.append(value)
+                    reg.append(NONE)
+                    cursor.append(slot)
+                    end.append(stop)
+                    next_pos.append(NEVER)
+                    interval = next(intervals, None)
+                    reload = False
+
+                expired = active.min()
+                while expired is not None and expired.end < pos:
+                    advance(expired.name, NEVER)
+                    active.remove(expired)
+                    free.append(reg[expired.name])
+                    expired = active.min()
+
+                if not free:
+                    members = active.members
+                    while soonest[0][0] < pos:
+                        use, q = heapq.heappop(soonest)
+                        if q in members and next_pos[q] == use:
+                            track(q, pos)
+                    while True:
+                        use, victim = farthest[0]
+                        if victim in members and next_pos[victim] == -use:
+                            break
+                        heapq.heappop(farthest)
+                    use = -use
+                    if use <= pos:
+                        raise ValueError(f"{k} registers cannot hold the operands of an instruction.")
+                    value = vr[victim]
+                    active.remove(self.LiveInterval(victim, 0, end[victim]))
+                    free.append(reg[victim])
+                    if use != NEVER:
+                        if dirty[value]:
+                            self._store(value, reg[victim], pos // 2)
+                            dirty[value] = 0
+                        rest = len(vr)
+                        vr.append(value)
+                        reg.append(NONE)
+                        cursor.append(cursor[victim])
+                        end.append(end[victim])
+                        next_pos.append(NEVER)
+                        heapq.heappush(unhandled, (use, rest))
+                    if len(farthest) > 4 * len(active) + 64: # drop stale entries
+                        soonest[:] = [(next_pos[q], q) for q in members]
+                        farthest[:] = [(-next_pos[q], q) for q in members]
+                        heapq.heapify(soonest)
+                        heapq.heapify(farthest)
+
+                reg[p] = free.pop()
+                active.add(self.LiveInterval(p, pos, end[p]))
+                track(p, pos)
+                if pos & 1:
+                    reg_at[3 * (pos // 2) + 2] = reg[p]
+                if reload:
+                    self._reload(vr[p], reg[p], pos // 2, constants)
+                else:
+                    dirty[vr[p]] = vr[p] not in constants
+
+            for q in active.members:
+                advance(q, NEVER)
+
+        with self.stats.phase('rewrite'):
+            result = self.rewrite_instructions()
+        return self._finish(result)
+
+
+    def _store(self, vr, reg, j):
+        if vr not in self.location:
+            self.location[vr] = self.sp
+            self.sp -= 4
+        self.before[j].append((STOREAI, reg, BP, self.location[vr], DST_CONST))
+
+
+    def _reload(self, vr, reg, j, constants):
+        if vr in constants:
+            self.before[j].append((LOADI, constants[vr], NONE, reg, OP1_CONST))
+        else:
+            self.before[j].append((LOADAI, BP, self.location[vr], reg, OP2_CONST))
+
 
     def rewrite_instructions(self):
-        result = []
-        fregs = ['r1', 'r2']
-        flag = True # prevents both registers being used for the same operand
-        for i in self.instructions:
-            new_instr = [i.opcode]
-            for vr in i.operands:
-                reg = vr
-                if vr in self.location:
-                    reg = fregs[flag]
-                    flag = not flag
-                    pos = self.location[vr]
-                    result.append(Instruction('loadAI', 'r0', pos, reg))
-                elif vr in self.vr_to_reg:
-                    reg = self.vr_to_reg[vr]
-                new_instr.append(reg)
-            
-            reg = vr = i.dst
-            spill = None
-            if vr in self.location:
-                reg = fregs[flag]
-                flag = not flag
-                pos = self.location[vr]
-                spill = Instruction('storeAI', reg, 'r0', pos)
-            elif vr in self.vr_to_reg:
-                reg = self.vr_to_reg[vr]
-            
-            new_instr.append(reg)
-            result.append(Instruction(*new_instr))
-            if spill:
-                result.append(spill)
-        
+        block = self.instructions
+        result = self.result = Block(physical_names(self.num_regs))
+        before, reg_at = self.before, self.reg_at
+        vbp = block.bp
+        for j, (opcode, op1, op2, dst, const) in enumerate(block.rows()):
+            for spill in before.get(j, ()):
+                result.append(*spill)
+            ops = [op1, op2, dst]
+            for field, bit in enumerate((OP1_CONST, OP2_CONST, DST_CONST)):
+                if ops[field] == vbp and not const & bit:
+                    ops[field] = BP
+                elif ops[field] != NONE and not const & bit:
+                    ops[field] = reg_at[3 * j + field]
+            result.append(opcode, *ops, const)
+
         return result
 
-                 
+
+class GraphColoringAlloc(BaseAlloc):
+    """Chaitin-Briggs graph coloring over an InterferenceGraph.
+
+    Simplify removes registers with fewer than k neighbors. When none is
+    left, the one with the lowest spill cost per neighbor is removed as
+    well, optimistically: it is only spilled if select finds no color for
+    it. Spill costs are use counts, weighted by the 5 cycles of a loadAI
+    or storeAI, or the 1 of a loadI rematerializing a constant. Spilled
+    registers are reloaded into a new register before every use and
+    stored from one after every definition, then the graph is rebuilt,
+    until everything gets a color.
+
+    As in Bernstein et al.'s best of three, allocate colors the block once
+    per HEURISTICS entry, ranking spill candidates by cost per neighbor,
+    per squared neighbor and per neighbor and instruction of their range,
+    and keeps the cheapest code. rounds is the number of graphs the kept
+    coloring took.
+    """
+    HEURISTICS = (
+        lambda cost, degree, length: cost / degree,
+        lambda cost, degree, length: cost / (degree * degree),
+        lambda cost, degree, length: cost / (degree * length),
+    )
+
+    @analysis
+    def __init__(self, instructions) -> None:
+        self.instructions = Block.encode(instructions)
+        self.graph = InterferenceGraph(self.instructions, {self.instructions.bp})
+        self.rounds = 0
+
+    @instrumented
+    def allocate(self, k):
+        if k < 2:
+            raise ValueError("Number of registers must be 2 or greater.")
+
+        best = None
+        for heuristic in self.HEURISTICS:
+            block, graph = self.instructions, self.graph
+            unspillable = set() # registers spill code was inserted for
+            self.offset = -4
+            rounds = 1
+            while True:
+                with self.stats.phase('assign'):
+                    color, spilled = self._color(block, graph, k, unspillable, heuristic)
+                if not spilled:
+                    break
+                with self.stats.phase('rewrite'):
+                    block = self._insert_spill_code(block, spilled, unspillable)
+                with self.stats.phase('assign'):
+                    graph = InterferenceGraph(block, {block.bp})
+                rounds += 1
+
+            with self.stats.phase('rewrite'):
+                result = self._rewrite(block, color, k)
+            cost = spill_cost(self.instructions, result)
+            if best is None or cost < best[0]:
+                best = cost, result, rounds
+            if rounds == 1:
+                break   # nothing spilled, the others color alike
+
+        _, self.result, self.rounds = best
+        return self._finish(self.result)
+
+
+    def _color(self, block, graph, k, unspillable, heuristic):
+        """Simplify and select, removing the spill candidate heuristic ranks
+        lowest when every register left has k neighbors or more. Returns
+        the color, 1 to k, of every register and the registers to spill.
+        """
+        live = Liveness.of(block)
+        remat = constants(block)
+        count, start, last = live.count, live.start, live.last
+        offsets, adjacency = graph.offsets, graph.adjacency
+        degree = array('i', graph.degree)
+        def cost(reg):
+            return heuristic(
+                count[reg] * (1 if reg in remat else 5), degree[reg],
+                last[reg] - start[reg]
+            )
+
+        #spill code would not make ranges that end right after they start shorter
+        spillable = {
+            reg for reg in graph.nodes
+            if last[reg] - start[reg] > 1 and reg not in unspillable
+        }
+        low = [reg for reg in graph.nodes if degree[reg] < k]
+        high = [(cost(reg), reg) for reg in spillable if degree[reg] >= k]
+        heapq.heapify(high)
+        fixed = [
+            reg for reg in graph.nodes if degree[reg] >= k and reg not in spillable
+        ]
+
+        removed = bytearray(len(block.names))
+        stack = []
+        remaining = len(graph)
+        while remaining:
+            if low:
+                reg = low.pop()
+            elif high:
+                key, reg = heapq.heappop(high)
+                if not removed[reg] and cost(reg) > key: # lost neighbors since
+                    heapq.heappush(high, (cost(reg), reg))
+                    continue
+            else:
+                reg = fixed.pop()
+            if removed[reg]:
+                continue
+            removed[reg] = 1
+            remaining -= 1
+            stack.append(reg)
+            for other in adjacency[offsets[reg]:offsets[reg + 1]]:
+                if not removed[other]:
+                    degree[other] -= 1
+                    if degree[other] == k - 1:
+                        low.append(other)
+
+        color = array('i', bytes(4 * len(block.names)))
+        uncolored = []
+        for reg in reversed(stack):
+            taken = {color[other] for other in adjacency[offsets[reg]:offsets[reg + 1]]}
+            for c in range(1, k + 1):
+                if c not in taken:
+                    color[reg] = c
+                    break
+            else:
+                uncolored.append(reg)
+
+        spilled = [reg for reg in uncolored if reg in spillable]
+        if uncolored and not spilled:
+            raise ValueError(f"{k} registers cannot hold the operands of every instruction.")
+        return color, spilled
+
+
+    def _insert_spill_code(self, block, spilled, unspillable) -> Block:
+        """Returns block with every spilled register loaded into a new one
+        before each use and stored from a new one after each definition
+        used later, constants being rematerialized instead. The new
+        registers are added to unspillable.
+        """
+        next_use = Liveness.of(block).next_use
+        remat = constants(block)
+        names = block.names
+        code = Block(list(names))
+        bp = code.intern('r0')
+        slot = {}
+        for reg in spilled:
+            if reg not in remat:
+                slot[reg] = self.offset
+                self.offset -= 4
+
+        def temp(reg):
+            new = code.intern(f'{names[reg]}.{len(code.names)}')
+            unspillable.add(new)
+            return new
+
+        spilled = set(spilled)
+        fields = (OP1_CONST, OP2_CONST, DST_CONST)
+        for j, (opcode, op1, op2, dst, const) in enumerate(block.rows()):
+            defines = dst != NONE and not const & DST_CONST and opcode not in NO_DEFINITION
+            if defines and dst in spilled and dst in remat:
+                continue # reloaded with its loadI at every use instead
+            ops = [op1, op2, dst]
+            loaded = {}
+            for field, bit in enumerate(fields[:2] if defines else fields):
+                reg = ops[field]
+                if const & bit or reg not in spilled:
+                    continue
+                if reg not in loaded:
+                    loaded[reg] = temp(reg)
+                    if reg in remat:
+                        code.append(LOADI, remat[reg], NONE, loaded[reg], OP1_CONST)
+                    else:
+                        code.append(LOADAI, bp, slot[reg], loaded[reg], OP2_CONST)
+                ops[field] = loaded[reg]
+
+            store = defines and dst in spilled and next_use[3 * j + 2] != NEVER
+            if defines and dst in spilled:
+                ops[2] = loaded[dst] if dst in loaded else temp(dst)
+            code.append(opcode, *ops, const)
+            if store:
+                code.append(STOREAI, ops[2], bp, slot[dst], DST_CONST)
+
+        return code
+
+
+    def _rewrite(self, block, color, k) -> Block:
+        """block with every register replaced by its color."""
+        if block.bp != NONE:
+            color[block.bp] = BP
+        result = Block(physical_names(k))
+        for opcode, op1, op2, dst, const in block.rows():
+            result.append(
+                opcode,
+                op1 if op1 == NONE or const & OP1_CONST else color[op1],
+                op2 if op2 == NONE or const & OP2_CONST else color[op2],
+                dst if dst == NONE or const & DST_CONST else color[dst],
+                const
+            )
+        return result
+
+
+def spill_cost(block, result) -> int:
+    """Cycles the spill code an allocator added to block takes under the
+    latencies of iloc_sim: its loadAI and storeAI, plus the loadI and i2i
+    rematerializing and copying values.
+    """
+    _, loads, stores = spill_summary(block, result)
+    def moves(code):
+        return sum(1 for opcode in code.opcode if opcode == LOADI or opcode == I2I)
+    return (
+        loads * iloc_sim.LATENCY['loadAI'] + stores * iloc_sim.LATENCY['storeAI']
+        + moves(result) - moves(block)
+    )
+
+
+class ExactAlloc(BaseAlloc):
+    """Allocation of minimum spill cost, by dynamic programming over the
+    register states between instructions.
+
+    Every definition is a value of its own and a state is the set of values
+    held in registers together with the dirty ones among them, not stored
+    since defined. Values are only evicted to make room and reloaded right
+    before being read, so a state's cost charges the reload of a value
+    when it is evicted: 5 cycles, or 1 for a loadI defined value, plus 5 to
+    store it if dirty. A loadI may also be moved down to the first read of
+    its value, keeping the register free until then. Among the clean
+    values of equal reload cost only the one read farthest ahead is
+    evicted, as Belady's rule is optimal among them. States costlier than
+    the BottomUpAlloc result, or dominated by a cheaper state (see
+    _prune), are dropped. The optimum is over these evictions and reloads;
+    the peephole of _finish may improve on it.
+
+    A search still running after budget seconds is given up and the
+    bottom-up result returned. After allocate(k) optimal tells whether the
+    result was proven optimal and cost is its spill_cost.
+    """
+    @analysis
+    def __init__(self, instructions, budget=10.0) -> None:
+        self.instructions = block = Block.encode(instructions)
+        self.budget = budget
+        self.optimal = False
+        self.cost = None
+        current = {}        # register -> value it holds
+        self.uses = []      # value -> instructions reading it
+        self.constant = []  # value -> constant of the loadI defining it
+        self.fields = []    # instruction -> value of each of its fields
+        self.srcs = []      # instruction -> values it reads
+        self.defs = []      # instruction -> value it defines
+        vbp = block.bp
+
+        def value(constant):
+            self.uses.append([])
+            self.constant.append(constant)
+            return len(self.uses) - 1
+
+        for j, (opcode, op1, op2, dst, const) in enumerate(block.rows()):
+            fields = [None, None, None]
+            srcs = []
+            read = [(0, op1, OP1_CONST), (1, op2, OP2_CONST)]
+            if opcode in NO_DEFINITION:
+                read.append((2, dst, DST_CONST))
+            for field, reg, bit in read:
+                if reg == NONE or const & bit or reg == vbp:
+                    continue
+                if reg not in current: # read before any definition
+                    current[reg] = value(None)
+                v = fields[field] = current[reg]
+                if v not in srcs:
+                    srcs.append(v)
+                    self.uses[v].append(j)
+            defined = None
+            if (dst != NONE and not const & DST_CONST and dst != vbp
+                    and opcode not in NO_DEFINITION):
+                remat = op1 if opcode == LOADI and const & OP1_CONST else None
+                defined = fields[2] = current[dst] = value(remat)
+            self.fields.append(fields)
+            self.srcs.append(frozenset(srcs))
+            self.defs.append(defined)
+
+        dies = [[] for _ in range(len(block))]
+        for v, uses in enumerate(self.uses):
+            if uses:
+                dies[uses[-1]].append(v)
+        self.dies = [frozenset(d) for d in dies]
+
+    @instrumented
+    def allocate(self, k):
+        need = max(map(len, self.srcs), default=0)
+        if k < max(2, need):
+            raise ValueError(f"Number of registers must be {max(2, need)} or greater.")
+
+        deadline = time.monotonic() + (
+            float('inf') if self.budget is None else self.budget
+        )
+        bottom_up = BottomUpAlloc(self.instructions)
+        fallback = bottom_up.allocate(k)
+        bound = spill_cost(self.instructions, fallback)
+        actions = None
+        self.optimal = True
+        if bound:
+            try:
+                with self.stats.phase('assign'):
+                    actions = self._search(k, bound, deadline)
+            except TimeoutError:
+                self.optimal = False
+        if actions is None: #nothing beats the bottom-up result, or no time
+            self.stats.spill_code_removed = bottom_up.stats.spill_code_removed
+            self.stats.unshared_frame = bottom_up.stats.unshared_frame
+            self.result = fallback
+        else:
+            with self.stats.phase('rewrite'):
+                self.result = self._rewrite(k, actions)
+            self._finish(self.result)
+        self.cost = spill_cost(self.instructions, self.result)
+        return self.result
+
+
+    def _victims(self, held, dirty, j):
+        """Yields the values of held worth evicting to make room at
+        instruction j and what it costs: every dirty one, and the clean one
+        read farthest ahead per reload cost.
+        """
+        store, load = iloc_sim.LATENCY['storeAI'], iloc_sim.LATENCY['loadAI']
+        farthest = {}   # reload cost -> (next read, value)
+        for v in held:
+            reload = load if self.constant[v] is None else 1
+            if v in dirty:
+                yield v, store + reload
+                continue
+            uses = self.uses[v]
+            candidate = (uses[bisect_right(uses, j)], v)
+            if candidate > farthest.get(reload, (-1, None)):
+                farthest[reload] = candidate
+        for reload, (_, v) in farthest.items():
+            yield v, reload
+
+
+    def _search(self, k, bound, deadline):
+        """Evictions of the cheapest allocation costing at most bound, per
+        instruction the (victim, value) pairs making room for its operands
+        and the victim making room for its definition, None for no victim
+        and the defined value itself for a loadI left until its first read.
+        None if nothing is that cheap, TimeoutError past the deadline.
+        """
+        store = iloc_sim.LATENCY['storeAI']
+        empty = frozenset()
+        layer = {(empty, empty): (0, None)}  # (held, dirty) -> (cost, path)
+        for j, (srcs, dies, defined) in enumerate(zip(self.srcs, self.dies, self.defs)):
+            if time.monotonic() > deadline:
+                raise TimeoutError
+            following = {}
+            keeps = defined is not None and bool(self.uses[defined])
+            dirty_def = keeps and self.constant[defined] is None
+            #a loadI whose value is read may wait until its first read
+            defer = ((defined, 0),) if keeps and not dirty_def else ()
+            for (held, dirty), (cost, path) in layer.items():
+                states = [(held, dirty, cost, ())]
+                for v in srcs - held:
+                    grown = []
+                    for held, dirty, cost, loads in states:
+                        if len(held) < k:
+                            grown.append((held | {v}, dirty, cost, loads + ((None, v),)))
+                            continue
+                        for victim, price in self._victims(held - srcs, dirty, j):
+                            if cost + price <= bound:
+                                grown.append((
+                                    held - {victim} | {v}, dirty - {victim},
+                                    cost + price, loads + ((victim, v),)
+                                ))
+                    states = grown
+                for held, dirty, cost, loads in states:
+                    held, dirty = held - dies, dirty - dies
+                    if defined is None or len(held) < k:
+                        choices = ((None, 0),)
+                    else:
+                        choices = self._victims(held, dirty, j)
+                    for victim, price in itertools.chain(choices, defer):
+                        if cost + price > bound:
+                            continue
+                        h, d = held, dirty
+                        if victim != defined:
+                            if victim is not None:
+                                h, d = h - {victim}, d - {victim}
+                            if keeps:
+                                h = h | {defined}
+                                if dirty_def:
+                                    d = d | {defined}
+                        key = (h, d)
+                        if key not in following or cost + price < following[key][0]:
+                            following[key] = (cost + price, (path, (loads, victim)))
+
+            layer = self._prune(following)
+
+        if not layer:
+            return None
+        _, path = min(layer.values(), key=lambda entry: entry[0])
+        actions = []
+        while path is not None:
+            path, step = path
+            actions.append(step)
+        actions.reverse()
+        return actions
+
+
+    def _prune(self, states, tries=256):
+        """states without the dominated ones. A state dominates another if
+        it is cheaper even after evicting the values only it holds and
+        storing the dirty values it holds where the other has them clean:
+        it can then do whatever the other does. Every state is compared
+        with the tries cheapest states kept.
+        """
+        store, load = iloc_sim.LATENCY['storeAI'], iloc_sim.LATENCY['loadAI']
+        constant = self.constant
+        kept = []
+        for key, (cost, path) in sorted(states.items(), key=lambda item: item[1][0]):
+            held, dirty = key
+            for c, h, d in kept[:tries]:
+                extra = c + store * len(d & held - dirty)
+                for v in h - held:
+                    extra += (load if constant[v] is None else 1) + (store if v in d else 0)
+                if extra <= cost:
+                    break
+            else:
+                kept.append((cost, held, dirty))
+        return {(h, d): states[h, d] for _, h, d in kept}
+
+
+    def _rewrite(self, k, actions) -> Block:
+        """The block with the evictions and reloads of actions."""
+        block = self.instructions
+        result = Block(physical_names(k))
+        free = list(range(k, 0, -1))
+        where = {}  # value -> physical register holding it
+        slot = {}   # value -> spill slot, once stored
+        offset = -4
+
+        def evict(v):
+            nonlocal offset
+            reg = where.pop(v)
+            if self.constant[v] is None and v not in slot:
+                slot[v] = offset
+                offset -= 4
+                result.append(STOREAI, reg, BP, slot[v], DST_CONST)
+            free.append(reg)
+
+        for j, (row, (loads, victim)) in enumerate(zip(block.rows(), actions)):
+            for evicted, v in loads:
+                if evicted is not None:
+                    evict(evicted)
+                reg = where[v] = free.pop()
+                if self.constant[v] is not None:
+                    result.append(LOADI, self.constant[v], NONE, reg, OP1_CONST)
+                elif v in slot:
+                    result.append(LOADAI, BP, slot[v], reg, OP2_CONST)
+
+            opcode, *ops, const = row
+            fields = self.fields[j]
+            for field in (0, 1, 2):
+                if fields[field] is not None and fields[field] != self.defs[j]:
+                    ops[field] = where[fields[field]]
+                elif ops[field] == block.bp != NONE and not const & 1 << field:
+                    ops[field] = BP
+            for v in self.dies[j]:
+                free.append(where.pop(v))
+            defined = self.defs[j]
+            if defined is not None and victim == defined:
+                continue
+            if defined is not None:
+                if victim is not None:
+                    evict(victim)
+                ops[2] = free.pop()
+                if self.uses[defined]:
+                    where[defined] = ops[2]
+                else:
+                    free.append(ops[2])
+            result.append(opcode, *ops, const)
+
+        return result
+
+
+def _portfolio_worker(task):
+    """Allocates a block with one allocator and scores the result."""
+    algorithm, block, k = task
+    result = ALLOCATORS[algorithm](block).allocate(k)
+    return result, iloc_sim.estimate_cycles(result)
+
+
+class PortfolioAlloc(BaseAlloc):
+    """Runs several allocators on the block in parallel worker processes
+    and keeps the result with the fewest cycles according to the cycle
+    model of iloc_sim.
+
+    algorithms are the ALLOCATORS keys of the allocators to run, by default
+    all of them but p itself. budget is the number of seconds the
+    allocators get, those still running then are stopped and left out.
+    After allocate(k), winner names the allocator whose result was kept and
+    outcomes describes how every allocator did.
+    """
+    @analysis
+    def __init__(self, instructions, algorithms=None, budget=None) -> None:
+        self.instructions = Block.encode(instructions)
+        if algorithms is None:
+            algorithms = ''.join(a for a in ALLOCATORS if a != 'p')
+        self.algorithms = algorithms
+        self.budget = budget
+        self.winner = None
+        self.outcomes = {}
+
+
+    def _run(self, k) -> dict:
+        """Result and cycles of every allocator that finished in time."""
+        finished = {}
+        self.outcomes = {}
+        pool = multiprocessing.Pool(len(self.algorithms))
+        try:
+            pending = [
+                pool.apply_async(_portfolio_worker, ((a, self.instructions, k),))
+                for a in self.algorithms
+            ]
+            if self.budget is not None:
+                deadline = time.monotonic() + self.budget
+            for a, p in zip(self.algorithms, pending):
+                name = ALLOCATORS[a].__name__
+                timeout = None
+                if self.budget is not None:
+                    timeout = max(0, deadline - time.monotonic())
+                try:
+                    finished[name] = p.get(timeout)
+                    self.outcomes[name] = f"{finished[name][1]} cycles"
+                except multiprocessing.TimeoutError:
+                    self.outcomes[name] = f"stopped after {self.budget} s"
+                except Exception as e:
+                    self.outcomes[name] = f"failed: {e}"
+        finally:
+            pool.terminate()
+
+        return finished
+
+
+    @instrumented
+    def allocate(self, k):
+        with self.stats.phase('assign'):
+            finished = self._run(k)
+        if not finished:
+            raise RuntimeError(
+                f"no allocator finished: {'; '.join(self.outcomes.values())}"
+            )
+
+        #ties go to the allocator listed first
+        self.winner = min(finished, key=lambda name: finished[name][1])
+        self.result = finished[self.winner][0]
+        return self.result
+
+
+    def report(self) -> str:
+        outcomes = ', '.join(f"{name} {o}" for name, o in self.outcomes.items())
+        return f"portfolio: {self.winner} won with k = {self.stats.k} ({outcomes})"
+
+
+class Syntax(NamedTuple):
+    """The punctuation and keywords of ILOC source, as str or as bytes."""
+    slashes: str
+    colon: str
+    to: str
+    arrow: str
+    comma: str
+    space: str
+    nop: str
+    store: str
+    label: str
+    branches: dict  # opcode -> number of operands and of targets
+
+
+STR_SYNTAX = Syntax('//', ':', '->', '=>', ',', ' ', 'nop', 'store', 'label',
+                    BRANCH_OPERANDS)
+BYTES_SYNTAX = Syntax(*(t.encode() for t in STR_SYNTAX[:-1]), {
+    opcode.encode(): counts for opcode, counts in BRANCH_OPERANDS.items()
+})
+
+
+def split_line(line, syntax=STR_SYNTAX, plain=False):
+    """Splits an ILOC source line, a str or bytes as syntax tells, into the
+    [opcode, op1, op2, dst] tokens of its instructions, trailing fields left
+    out and a skipped op2 None. Returns None for a malformed line.
+
+    Tokenizing relies on plain string operations: everything after '//' is
+    dropped, the line is split on '=>' and operands on ','. plain lines are
+    known to hold no comment, label or branch.
+    """
+    slashes, colon, to, arrow, comma, space, nop, store, label_, branches = syntax
+    found = []
+    if not plain:
+        comment = line.find(slashes)
+        if comment != -1:
+            line = line[:comment] #eliminate inline comments
+
+        label, labeled, rest = line.partition(colon)
+        if labeled:
+            if len(label.split()) != 1:
+                return None
+            found.append([label_, label.strip()])
+            line = rest
+            if line.split() == [nop]:
+                return found
+
+        lhs, branch, targets = line.partition(to)
+        if branch:
+            args = lhs.replace(comma, space).split()
+            targets = targets.replace(comma, space).split()
+            if not args or branches.get(args[0]) != (len(args) - 1, len(targets)):
+                return None
+            found.append(args + targets)
+            return found
+
+    lhs, defines, rhs = line.partition(arrow)
+    args = lhs.replace(comma, space).split()
+    if not args and not defines:
+        return found
+    if args == [nop] and not defines:
+        found.append([nop, None])
+        return found
+
+    # operands are comma separated on each side of '=>', a mismatch
+    # means there is an empty or missing operand.
+    separators = lhs.count(comma)
+    if defines:
+        args += rhs.replace(comma, space).split()
+        separators += rhs.count(comma) + 1
+
+    num_args = len(args) - 1
+    if num_args < 1 or num_args > 3 or separators != num_args - 1:
+        return None
+
+    if num_args == 2 and args[0] != store:
+        # exclude store since it's last parameter
+        # works as an operand and not a destination
+        args.insert(2, None)
+    found.append(args)
+    return found
+
+
+def invalid_line(source, lineno, line) -> ValueError:
+    if isinstance(line, bytes):
+        line = line.decode()
+    return ValueError(
+        f"{source}:{lineno}: '{line.strip()}' is an invalid ILOC instruction."
+    )
+
+
+def parse_lines(lines, source='<input>'):
+    """Lazily parses ILOC source lines, yielding one Instruction at a time.
+    Malformed lines raise a ValueError naming the source and line number.
+
+    A label 'L1:' before an instruction becomes Instruction('label', 'L1'),
+    'L1: nop' only the label and a bare 'nop' Instruction('nop', None).
+    Branches keep their targets as operands:
+    'jumpI -> L1' is Instruction('jumpI', 'L1') and 'cbr r1 -> L1, L2' is
+    Instruction('cbr', 'r1', 'L1', 'L2').
+    """
+    for lineno, line in enumerate(lines, 1):
+        found = split_line(line)
+        if found is None:
+            raise invalid_line(source, lineno, line)
+        for fields in found:
+            yield Instruction(*fields)
+
+
+def iter_instructions(filename):
+    """Streams the instructions of an ILOC file without reading it whole."""
+    with open(filename, 'r') as code:
+        yield from parse_lines(code, filename)
+
+
 def read_instructions(filename) -> List[Instruction]:
     """read instructions from an ILOC file.
     """
-    instructions = []
-    match_words = re.compile("\w+")
-    match_comments = re.compile("\/\/.*")
-    with open(filename, 'r') as code:
-        for line in code:
-            line = match_comments.sub("", line) #eliminate inline comments
-            line = match_words.findall(line)
-            if line:
-                num_args = len(line) - 1
-                if num_args > 3:
-                    raise ValueError(f"{line} is an invalid ILOC instruction.")
-
-                if num_args == 2 and line[0] != 'store':
-                    # exclude store since it's last parameter
-                    # works as an operand and not a destination
-                    instructions.append(
-                        Instruction(line[0], line[1], dst=line[2])
-                    )
-                else: #3 and 1 parameter instructions
-                    instructions.append(Instruction(*line))
-
-
-    return instructions
+    return list(iter_instructions(filename))
             
 
+def read_block(filename) -> Block:
+    """Reads an ILOC file straight into a Block, for files too large to
+    hold as Instructions.
+
+    The file is memory mapped and tokenized as bytes a chunk of lines at a
+    time, handing the pages of each chunk back once it is encoded. Each
+    distinct token is decoded and classified once and operands go straight
+    into the Block's columns, so memory stays close to the size of the
+    columns rather than a multiple of the file. Lines are split by
+    split_line, as for parse_lines, so both accept the same code.
+    """
+    block = Block()
+    with open(filename, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return block # empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            _encode_lines(block, _mapped_chunks(data), filename)
+    return block
+
+
+def parse_block(text, source='<input>') -> Block:
+    """Encodes ILOC source text into a Block, like read_block does for files.
+    """
+    block = Block()
+    _encode_lines(block, [text.encode()], source)
+    return block
+
+
+def _mapped_chunks(data, size=2 ** 20):
+    """Yields a memory map in chunks of whole lines, handing the pages of
+    each back once the next one is asked for.
+    """
+    start, end = 0, len(data)
+    dontneed = getattr(mmap, 'MADV_DONTNEED', None)
+    while start < end:
+        stop = end
+        if start + size < end:
+            stop = data.rfind(b'\n', start, start + size) + 1
+            if stop <= start: # a line longer than a chunk
+                stop = data.find(b'\n', start + size) + 1 or end
+        yield data[start:stop]
+        if dontneed is not None and stop >= mmap.PAGESIZE:
+            data.madvise(dontneed, 0, stop - stop % mmap.PAGESIZE)
+        start = stop
+
+
+def _encode_lines(block, chunks, source):
+    """Appends the instructions of chunks of ILOC source lines, as bytes,
+    to block.
+    """
+    codes = {None: (NONE, 0)}   # token -> (value, is constant)
+    def code(token):
+        text = token.decode()
+        if isconstant(text):
+            try:
+                codes[token] = constant(text), 1
+            except ValueError as e:
+                raise ValueError(f"{source}:{lineno}: {e}") from None
+        else:
+            codes[token] = block.intern(text), 0
+        return codes[token]
+
+    opcodes = {}                # token -> opcode id
+    def opcode(token):
+        text = token.decode()
+        opcodes[token] = OPCODE_ID[text] if text in OPCODE_ID else opcode_id(text)
+        return opcodes[token]
+
+    opcode_column, op1_column = block.opcode.append, block.op1.append
+    op2_column, dst_column = block.op2.append, block.dst.append
+    const_column = block.const.append
+    def emit(name, a=None, b=None, d=None):
+        a, a_const = codes.get(a) or code(a)
+        b, b_const = codes.get(b) or code(b)
+        d, d_const = codes.get(d) or code(d)
+        opcode_column(opcodes[name] if name in opcodes else opcode(name))
+        op1_column(a)
+        op2_column(b)
+        dst_column(d)
+        const_column(a_const | b_const << 1 | d_const << 2)
+
+    lineno = 0
+    for chunk in chunks:
+        # most chunks have no comments, labels or branches to look for
+        plain = b'//' not in chunk and b':' not in chunk and b'->' not in chunk
+        for lineno, line in enumerate(chunk.splitlines(), lineno + 1):
+            found = split_line(line, BYTES_SYNTAX, plain)
+            if found is None:
+                raise invalid_line(source, lineno, line)
+            for fields in found:
+                emit(*fields)
+
+
+def register_range(text) -> range:
+    """argparse type accepting a number of registers k or an inclusive
+    range of them written as low..high
+    """
+    low, dots, high = text.partition('..')
+    try:
+        low = int(low)
+        high = int(high) if dots else low
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number of registers '{text}'.")
+
+    if low < 2:
+        raise argparse.ArgumentTypeError("number of register must be at least 2.")
+    if high < low:
+        raise argparse.ArgumentTypeError(f"empty register range '{text}'.")
+
+    return range(low, high + 1)
+
+
+def write_stats(stats, parse_ms, filename):
+    """Appends every AllocStats in stats as one JSON object per line to
+    filename, or to stderr if it is None.
+    """
+    out = sys.stderr if filename is None else open(filename, 'a')
+    try:
+        for s in stats:
+            record = s.as_dict()
+            record['phases'] = {'parse': parse_ms, **s.phases}
+            print(json.dumps(record), file=out)
+    finally:
+        if out is not sys.stderr:
+            out.close()
+
+
+def write_sweep(sweep, filename, output_dir):
+    """Writes the result of every k in sweep to output_dir as
+    <name>.k<k>.i and prints a summary of the inserted spill code.
+    spilled counts the values stored to a slot of their own before
+    color_slots shared them, frame the bytes of the shared slots.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    print(
+        "|k|", "|spilled|", "|loads|", "|stores|", "|removed|", "|frame|",
+        "|unshared|", "|ms|", sep='\t'
+    )
+    for k, result, stats in sweep:
+        path = os.path.join(output_dir, f"{stem}.k{k}.i")
+        with open(path, 'w') as out:
+            for i in result:
+                print(i, file=out)
+        print(
+            k, stats.frame_size_before // 4, stats.reloads, stats.spills,
+            stats.spill_code_removed, stats.frame_size, stats.frame_size_before, f"{stats.ms:.2f}", sep='\t'
+        )
+
+
+ALLOCATORS = {
+    's': SimpleAlloc,
+    't': TopDownAlloc,
+    'b': BottomUpAlloc,
+    'o': LinearScanAlloc,
+    'l': SplittingLinearScanAlloc,
+    'g': GraphColoringAlloc,
+    'e': ExactAlloc,
+    'p': PortfolioAlloc,
+}
+
+
+def make_allocator(algorithm, instructions, jobs=1, **options) -> BaseAlloc:
+    """ALLOCATORS[algorithm](instructions, **options), or for programs with
+    labels and branches a GlobalAlloc running it on every basic block in
+    jobs worker processes.
+    """
+    import iloc_cfg
+    if iloc_cfg.has_branches(instructions):
+        return iloc_cfg.GlobalAlloc(instructions, algorithm, jobs, **options)
+    return ALLOCATORS[algorithm](instructions, **options)
+
+
 def main():
-    allocators = {
-        's': SimpleAlloc,
-        't': TopDownAlloc,
-        'b': BottomUpAlloc,
-        'o': LinearScanAlloc,
-    }
+    allocators = ALLOCATORS
     parser = argparse.ArgumentParser(
         description='Brian Uribe - ILOC register allocator',
         formatter_class=argparse.RawTextHelpFormatter
     )
     parser.add_argument(
-        "registers", type=int,
-        help='number of registers for the target machine'
+        "registers", type=register_range,
+        help='number of registers for the target machine, or a range such\n'
+            'as 2..32 to allocate once for every number in it'
     )
     parser.add_argument(
         'algorithm', type=str, choices=allocators,
@@ -572,23 +1693,116 @@ def main():
             'b: bottom-up approach\n'
             's: simple top-down (no live ranges)\n'
             't: top-down with live ranges and max live\n'
-            'o: custom allocator'
+            'o: custom allocator\n'
+            'l: linear scan splitting intervals at their uses\n'
+            'g: graph coloring (Chaitin-Briggs)\n'
+            'e: exact, minimum spill cost within --budget seconds, else b\n'
+            'p: portfolio, runs all of the above in parallel and keeps the\n'
+            '   result with the fewest estimated cycles'
     )
     parser.add_argument(
         'filename', type=str,
-        help='path of the file containing the ILOC program'
+        help='path of the file containing the ILOC program, or with --batch\n'
+            'a directory, glob pattern or manifest listing ILOC files'
+    )
+    parser.add_argument(
+        '-o', '--output-dir', type=str, default='.',
+        help='directory receiving one <name>.k<k>.i file per number of\n'
+            'registers when a range is given, and the results of --batch\n'
+            '(default: current directory)'
+    )
+    parser.add_argument(
+        '--budget', type=float, default=None,
+        help='seconds each allocator of the portfolio p may run before it\n'
+            'is stopped and left out, or e may search before falling back\n'
+            'to bottom-up (default: no limit for p, 10 for e)'
+    )
+    parser.add_argument(
+        '--stats', choices=['json'],
+        help='report timings per phase, spill code, frame size (before and\n'
+            'after sharing spill slots) and max live of every allocation as\n'
+            'JSON lines on stderr or --stats-file.\n'
+            'Peak memory is included when tracemalloc is tracing, e.g. with\n'
+            'PYTHONTRACEMALLOC=1'
+    )
+    parser.add_argument(
+        '--stats-file', type=str, default=None,
+        help='file the --stats report is appended to (default: stderr)'
+    )
+    parser.add_argument(
+        '--batch', action='store_true',
+        help='allocate every file named by filename in parallel, writing\n'
+            'the results below --output-dir'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='number of worker processes for --batch, or allocating the\n'
+            'basic blocks of a program with branches (default: CPU count\n'
+            'for --batch, 1 otherwise)'
+    )
+    parser.add_argument(
+        '--cache-dir', type=str, default=None,
+        help='reuse allocations of identical blocks stored in this directory\n'
+            'and store new ones there, reporting the hit rate on stderr'
+    )
+    parser.add_argument(
+        '--cache-size', type=float, default=256,
+        help='MiB the --cache-dir may grow to before the least recently\n'
+            'used allocations are evicted (default: 256)'
+    )
+    parser.add_argument(
+        '--schedule', action='store_true',
+        help='list schedule the allocated code between labels and branches\n'
+            'to hide the latency of loads and multiplies'
     )
     args = parser.parse_args()
+    cache_bytes = int(args.cache_size * 2 ** 20)
 
-    if args.registers < 2:
-        raise argparse.ArgumentTypeError("number of register must be at least 2.")
+    if args.batch:
+        import batch
+        reports = batch.run_batch(
+            args.filename, args.registers, args.algorithm, args.output_dir,
+            args.jobs, args.cache_dir, cache_bytes, args.schedule
+        )
+        sys.exit(1 if any(r.error for r in reports) else 0)
 
-    instructions = read_instructions(args.filename)
+    tic = time.perf_counter()
+    instructions = read_block(args.filename)
+    parse_ms = (time.perf_counter() - tic) * 1000
     Allocator = allocators[args.algorithm]
-    result = Allocator(instructions).allocate(args.registers)
+    options = {}
+    if Allocator in (PortfolioAlloc, ExactAlloc) and args.budget is not None:
+        options['budget'] = args.budget
+    if args.cache_dir:
+        from alloc_cache import AllocationCache, CachedAlloc
+        cache = AllocationCache(args.cache_dir, cache_bytes)
+        allocator = CachedAlloc(cache, args.algorithm, instructions, **options)
+    else:
+        allocator = make_allocator(
+            args.algorithm, instructions, args.jobs or 1, **options
+        )
 
-    for i in result:
-        print(i)
+    stats = []
+    for k in args.registers:
+        result = allocator.allocate(k)
+        if args.schedule:
+            with allocator.stats.phase('schedule'):
+                result = allocator.stats.result = iloc_sched.schedule(result)
+        stats.append(allocator.stats)
+        if Allocator is PortfolioAlloc:
+            print(allocator.report(), file=sys.stderr)
+
+    if len(args.registers) > 1:
+        sweep = [Sweep(s.k, s.result, s) for s in stats]
+        write_sweep(sweep, args.filename, args.output_dir)
+    else:
+        for i in result:
+            print(i)
+
+    if args.stats:
+        write_stats(stats, parse_ms, args.stats_file)
+    if args.cache_dir:
+        print(cache.report(), file=sys.stderr)
 
 
 if __name__ == '__main__':
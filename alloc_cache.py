@@ -0,0 +1,329 @@
+"""Content addressed on-disk cache of allocation results.
+
+Entries are keyed by a hash of the encoded block, k, the algorithm and its
+options, and the source of the allocator modules, so editing an allocator
+invalidates what it cached. Results are stored as their zlib compressed
+Block columns, one file per entry. Files are written to a temporary name
+and renamed into place, so concurrent readers and writers, e.g. parallel
+batch workers, only ever see complete entries. Hits refresh an entry's
+modification time and entries are evicted least recently used first once
+the cache outgrows its size cap. The size is tracked by counting what is
+written and rescanning the directory every RESCAN writes, so an eviction,
+down to LOW_WATER of the cap, only happens once in many writes.
+
+    cache = AllocationCache('.alloc_cache')
+    result = cache.allocate(instructions, 5, 'b')
+    print(cache.report())
+"""
+import ast
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError: # Windows, where concurrent evictions merely race
+    fcntl = None
+
+import alloc
+import iloc_cfg
+from alloc_utils import AllocStats
+from iloc_ir import CBR, JUMPI, LABEL, OPCODES, Block, physical_names
+
+
+MAX_BYTES = 256 * 2 ** 20
+MAGIC = b'ILOCBLK3'
+HEADER = struct.Struct('<8sII')  # magic, k, number of instructions
+LOW_WATER = 0.75    # fraction of max_bytes a full cache is evicted down to
+RESCAN = 256        # writes between scans catching up with other processes
+
+
+def allocator_modules() -> list:
+    """Paths of alloc and of the modules next to it that it imports, also
+    through one another, outside of command line main functions: what
+    make_allocator may run. Results are scheduled, e.g. by batch or the
+    server, after they leave the cache, and IncrementalAlloc does not go
+    through it, so neither needs to be covered.
+    """
+    here = os.path.dirname(os.path.abspath(alloc.__file__))
+    paths, pending = [], [os.path.join(here, 'alloc.py')]
+    while pending:
+        path = pending.pop()
+        if path in paths:
+            continue
+        paths.append(path)
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+        nodes = [tree]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, ast.FunctionDef) and node.name == 'main':
+                continue
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                names = [node.module]
+            else:
+                names = []
+            for name in names:
+                imported = os.path.join(here, name.split('.')[0] + '.py')
+                if os.path.exists(imported):
+                    pending.append(imported)
+            nodes.extend(ast.iter_child_nodes(node))
+    return sorted(paths)
+
+
+@lru_cache(maxsize=None)
+def allocator_version() -> str:
+    """Hash of the source of the allocator_modules()."""
+    digest = hashlib.blake2b(digest_size=8)
+    for path in allocator_modules():
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def label_names(block) -> dict:
+    """Names of the ids block uses as labels, which unlike register names
+    are carried over into its allocation.
+    """
+    labels = {}
+    for j, op in enumerate(block.opcode):
+        if op == LABEL or op == JUMPI:
+            labels[block.op1[j]] = None
+        elif op == CBR:
+            labels[block.op2[j]] = labels[block.dst[j]] = None
+    return {id: block.names[id] for id in sorted(labels)}
+
+
+def block_key(block, k, algorithm, options=None) -> str:
+    """Hex digest identifying the allocation of block with k registers."""
+    digest = hashlib.blake2b(digest_size=20)
+    header = (
+        allocator_version(), sys.byteorder, algorithm, k,
+        sorted((options or {}).items()), len(block.names), block.bp,
+        [OPCODES[op] for op in sorted(set(block.opcode))], label_names(block),
+    )
+    digest.update(repr(header).encode())
+    for column in (block.opcode, block.op1, block.op2, block.dst, block.const):
+        digest.update(column)
+    return digest.hexdigest()
+
+
+def dump_block(block, k) -> bytes:
+    """Compressed columns of an allocator result for k registers, followed
+    by the labels its names hold after the registers.
+    """
+    columns = (block.opcode, block.op1, block.op2, block.dst, block.const)
+    data = b''.join(column.tobytes() for column in columns)
+    data += '\n'.join(block.names[k + 1:]).encode()
+    return HEADER.pack(MAGIC, k, len(block)) + zlib.compress(data)
+
+
+def load_block(data) -> Block:
+    magic, k, n = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a cached allocation.")
+    data = zlib.decompress(data[HEADER.size:])
+
+    block = Block(physical_names(k))
+    offset = 0
+    for name, typecode in (
+        ('opcode', 'H'), ('op1', 'q'), ('op2', 'q'), ('dst', 'q'), ('const', 'B')
+    ):
+        column = array(typecode)
+        size = n * column.itemsize
+        column.frombytes(data[offset:offset + size])
+        setattr(block, name, column)
+        offset += size
+    if offset > len(data):
+        raise ValueError("truncated cached allocation.")
+    if offset < len(data):
+        for label in data[offset:].decode().split('\n'):
+            block.intern(label)
+    return block
+
+
+class AllocationCache:
+    """Allocation results stored below directory, at most max_bytes of them.
+    hits and misses count the lookups made through this object.
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self.size = None    # bytes at the last scan plus those written since
+        self.writes = 0     # writes since the last scan
+        os.makedirs(directory, exist_ok=True)
+
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+    def path(self, key) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+
+    def get(self, key):
+        """Cached result for key, None if there is none."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                block = load_block(f.read())
+            os.utime(path) #mark it as recently used
+        except FileNotFoundError:
+            block = None
+        except (ValueError, struct.error, zlib.error):
+            self._remove(path)
+            block = None
+
+        if block is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return block
+
+
+    def put(self, key, result, k):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        data = dump_block(result, k)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            self._remove(tmp)
+            raise
+
+        if self.size is None or self.writes >= RESCAN:
+            self.size = sum(size for _, _, size in self._entries())
+            self.writes = 0
+        else:
+            self.size += len(data)
+            self.writes += 1
+        if self.size > self.max_bytes:
+            self.evict(int(self.max_bytes * LOW_WATER))
+
+
+    def allocate(self, instructions, k, algorithm='o', **options) -> Block:
+        """make_allocator(algorithm, instructions, **options).allocate(k), read
+        from the cache if it was allocated before.
+        """
+        return CachedAlloc(self, algorithm, instructions, **options).allocate(k)
+
+
+    def evict(self, max_bytes=None):
+        """Removes the least recently used entries while the cache is larger
+        than max_bytes (default: self.max_bytes), one process at a time.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        lock = open(os.path.join(self.directory, '.lock'), 'w')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries, total = [], 0
+            for mtime, path, size in self._entries():
+                if not path.endswith('.tmp'):
+                    entries.append((mtime, path, size))
+                total += size
+
+            entries.sort()
+            for _, path, size in entries:
+                if total <= max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+        finally:
+            lock.close()
+        self.size = total
+        self.writes = 0
+
+
+    def _entries(self):
+        """Yields the (modification time, path, size) of every file below
+        the directory, including those still being written.
+        """
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, entry.path, st.st_size
+
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def report(self) -> str:
+        return (
+            f"cache: {self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate:.0%} hit rate)"
+        )
+
+
+class CachedAlloc(alloc.BaseAlloc):
+    """make_allocator(algorithm, instructions, **options) behind a cache. The
+    allocator is only built, analyzing the block, on the first miss. For
+    hits stats has a single 'cache' phase and hit is set.
+    """
+
+    def __init__(self, cache, algorithm, instructions, **options) -> None:
+        self.cache = cache
+        self.algorithm = algorithm
+        self.options = options
+        self.instructions = Block.encode(instructions)
+        self.allocator = None
+        self.hit = False
+
+
+    def allocate(self, k) -> Block:
+        key = block_key(self.instructions, k, self.algorithm, self.options)
+        tic = time.perf_counter()
+        result = self.cache.get(key)
+        self.hit = result is not None
+        if self.hit:
+            name = alloc.ALLOCATORS[self.algorithm].__name__
+            if iloc_cfg.has_branches(self.instructions):
+                name = iloc_cfg.GlobalAlloc.__name__
+            self.stats = AllocStats(name, k, self.instructions)
+            self.stats.result = result
+            self.stats.ms = (time.perf_counter() - tic) * 1000
+            self.stats.phases['cache'] = self.stats.ms
+            return result
+
+        if self.allocator is None:
+            self.allocator = alloc.make_allocator(
+                self.algorithm, self.instructions, **self.options
+            )
+        result = self.allocator.allocate(k)
+        self.stats = self.allocator.stats
+        self.cache.put(key, result, k)
+        return result
+
+
+    def report(self) -> str:
+        """Report of the allocator, for PortfolioAlloc, or of the hit."""
+        if self.hit:
+            return f"k={self.stats.k}: read from the cache"
+        return self.allocator.report()
@@ -0,0 +1,95 @@
+"""Thin client of alloc_server.py. It only imports what talking JSON lines
+over a Unix socket takes, so it starts much faster than alloc.py does.
+
+    with AllocClient('/tmp/alloc.sock') as client:
+        reply = client.allocate(code, 8, 'b')
+        print(reply['code'])
+
+    python alloc_client.py --socket /tmp/alloc.sock 8 b block.i
+"""
+import argparse
+import json
+import socket
+import sys
+
+
+class AllocClient:
+    """Connection to an allocation server listening on the Unix socket path.
+    """
+
+    def __init__(self, path) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+        self.next_id = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+    def allocate(self, code, k, algorithm='b', **options) -> dict:
+        """Allocates the ILOC source code with k registers, returning the
+        reply with the allocated code and its stats. options are "schedule"
+        and "budget". Failed requests raise a ValueError with the server's
+        message.
+        """
+        self.next_id += 1
+        request = dict(options, id=self.next_id, code=code, k=k, algorithm=algorithm)
+        self.file.write(json.dumps(request).encode() + b'\n')
+        self.file.flush()
+
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('the allocation server closed the connection.')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='allocates an ILOC file on a running alloc_server.py'
+    )
+    parser.add_argument('registers', type=int,
+                        help='number of registers for the target machine')
+    parser.add_argument('algorithm', help='algorithm, as for alloc.py')
+    parser.add_argument('filename', help='path of the ILOC file')
+    parser.add_argument('--socket', required=True,
+                        help='Unix socket the server listens on')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='seconds the e or p allocators may run')
+    parser.add_argument('--schedule', action='store_true',
+                        help='list schedule the allocated code')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the stats of the allocation as JSON on stderr')
+    args = parser.parse_args()
+
+    with open(args.filename, 'r') as f:
+        code = f.read()
+    options = {'schedule': args.schedule}
+    if args.budget is not None:
+        options['budget'] = args.budget
+    try:
+        with AllocClient(args.socket) as client:
+            reply = client.allocate(code, args.registers, args.algorithm, **options)
+    except ValueError as e:
+        sys.exit(f"{args.filename}: {e}")
+
+    print(reply['code'])
+    if args.stats:
+        print(json.dumps(reply['stats']), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,650 @@
+"""Incremental re-allocation of a block after small edits.
+
+IncrementalAlloc allocates a block the way BottomUpAlloc does and keeps the
+allocation up to date while the block is edited. An edit script replaces
+ranges of instructions; each edit only reallocates a window around the
+instructions it changes. The window starts from the register state the
+previous allocation had there, and compensation code at its end moves
+every live value back to where the untouched code after it expects it.
+
+    allocator = IncrementalAlloc(instructions)
+    result = allocator.allocate(8)
+    result = allocator.edit([Edit(10, 11, parse_lines(['addI r3, 1 => r3']))])
+
+Instructions are kept in chunks of about CHUNK, each holding its allocated
+code and the register state at its start, so recovering the state around an
+edit costs a chunk rather than the whole block. Chunks are found by binary
+search over the positions, code rows and keys they start at. The block and
+its code are also kept whole, patched in place where a chunk changed. Live
+ranges are kept as the sorted keys of every register's occurrences and
+updated locally; keys leave gaps so that inserted instructions rarely
+renumber them.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import List, NamedTuple, Sequence
+
+from alloc import BP, BottomUpAlloc, analysis, instrumented
+from alloc_utils import (
+    NEVER, NO_DEFINITION, Liveness, NextUseHeap, color_slots,
+    remove_redundant_spill_code
+)
+from iloc_ir import (
+    NONE, OP1_CONST, OP2_CONST, DST_CONST, LOADAI, STOREAI, I2I, Block,
+    Instruction, physical_names
+)
+
+
+CHUNK = 256     # instructions per chunk
+GAP = 1 << 10   # distance between the keys of consecutive instructions
+LOOKAHEAD = 16  # rows after an edit searched for registers overwritten unread
+
+
+class Edit(NamedTuple):
+    """Replaces the instructions [start, stop) with instructions. Positions
+    count in the block before the edit script; start == stop inserts and
+    no instructions deletes.
+    """
+    start: int
+    stop: int
+    instructions: Sequence[Instruction] = ()
+
+
+class State:
+    """Virtual registers held by the physical registers (locations > 0) and
+    spill slots (their negative offsets from r0) at a point of the allocated
+    code. Defining a virtual register forgets its older copies.
+    """
+
+    def __init__(self, holders=()) -> None:
+        self.holder = {}                # location -> vr
+        self.homes = defaultdict(set)   # vr -> locations holding it
+        for loc, vr in holders:
+            self.put(loc, vr)
+
+
+    def copy(self) -> 'State':
+        return State(self.holder.items())
+
+
+    def put(self, loc, vr):
+        old = self.holder.pop(loc, None)
+        if old is not None:
+            self.homes[old].discard(loc)
+        if vr is not None:
+            self.holder[loc] = vr
+            self.homes[vr].add(loc)
+
+
+    def define(self, loc, vr):
+        for old in self.homes.pop(vr, ()):
+            del self.holder[old]
+        self.put(loc, vr)
+
+
+    def move(self, row):
+        """Follows a spill, reload or copy inserted by an allocator."""
+        opcode, op1, op2, dst = row[:4]
+        self.put(dst, self.holder.get(op2 if opcode == LOADAI else op1))
+
+
+class Chunk:
+    """Consecutive instructions of the block with their allocated code.
+    widths[j] counts the rows of code emitted for instruction j, ending with
+    the instruction itself; state is the register state before the first.
+    """
+
+    def __init__(self, keys, block, widths, code, state) -> None:
+        self.keys = keys
+        self.block = block
+        self.widths = widths
+        self.code = code
+        self.state = state
+
+
+def splice(names, parts, ids=None) -> Block:
+    """Block made of the rows [lo, hi) of every (block, lo, hi) in parts,
+    naming registers with names. ids maps names back, it is built if not
+    given.
+    """
+    result = Block()
+    if names is not None:
+        result.names = names
+        result.ids = ids if ids is not None else {n: i for i, n in enumerate(names)}
+    for block, lo, hi in parts:
+        result.opcode.extend(block.opcode[lo:hi])
+        result.op1.extend(block.op1[lo:hi])
+        result.op2.extend(block.op2[lo:hi])
+        result.dst.extend(block.dst[lo:hi])
+        result.const.extend(block.const[lo:hi])
+    return result
+
+
+def patch(block, lo, hi, rows):
+    """Replaces the rows [lo, hi) of block with those of rows, in place."""
+    block.opcode[lo:hi] = rows.opcode
+    block.op1[lo:hi] = rows.op1
+    block.op2[lo:hi] = rows.op2
+    block.dst[lo:hi] = rows.dst
+    block.const[lo:hi] = rows.const
+    Liveness.forget(block)
+
+
+def registers(row) -> tuple:
+    """Registers an instruction reads and the one it defines, NONE if none."""
+    opcode, op1, op2, dst, const = row
+    read = [
+        reg for reg, bit in ((op1, OP1_CONST), (op2, OP2_CONST))
+        if reg != NONE and not const & bit
+    ]
+    if const & DST_CONST:
+        dst = NONE
+    elif opcode in NO_DEFINITION:
+        if dst != NONE:
+            read.append(dst)
+        dst = NONE
+    return read, dst
+
+
+def upward_exposed(block) -> tuple:
+    """Registers block reads before defining them, and those it defines."""
+    exposed, defined = set(), set()
+    for row in block.rows():
+        read, dst = registers(row)
+        exposed.update(reg for reg in read if reg not in defined)
+        if dst != NONE:
+            defined.add(dst)
+    return exposed, defined
+
+
+class IncrementalAlloc(BottomUpAlloc):
+    #a State only knows values held in registers and spill slots
+    rematerialize = False
+
+    @analysis
+    def __init__(self, instructions) -> None:
+        block = Block.encode(instructions)
+        self.names = list(block.names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.instructions = self._splice([(block, 0, len(block))])
+        self.bp = self.Register(BP)
+        self.vbp = self.ids.get('r0', NONE)
+        self.chunks = []
+        self.window = 0
+
+
+    @instrumented
+    def allocate(self, k):
+        """Allocates the whole block from scratch, like BottomUpAlloc, and
+        remembers the allocation for later edits.
+        """
+        if k < 2:
+            raise ValueError("Number of registers must be 2 or greater.")
+
+        block = self.instructions
+        self.k = k
+        self.offset = -4
+        with self.stats.phase('analysis'):
+            keys = self._index(block)
+        with self.stats.phase('assign'):
+            code, widths = self._allocate_window(State(), block, keys)
+        chunk = Chunk(keys, block, widths, code, State())
+        self.chunks = self._split(chunk) or [chunk]
+        self.code = code
+        self.starts, self.offsets, self.firsts = self._bounds(self.chunks)
+        #cleaned up in the result only, the chunks keep their own code
+        result = splice(code.names, [(code, 0, len(code))])
+        self.stats.spill_code_removed = remove_redundant_spill_code(result)
+        self.stats.unshared_frame = color_slots(self.instructions, result)
+        return result
+
+
+    def edit(self, script) -> Block:
+        """Applies a script of Edits to the block and returns its updated
+        allocation for the same number of registers. window counts the
+        instructions that were reallocated. Neither redundant spill code
+        is removed nor spill slots shared, which would take a pass over the
+        whole block. The allocation is self.code, which later edits update
+        in place; copy it to keep it.
+        """
+        script = sorted(script, key=lambda e: (e.start, e.stop))
+        n = len(self.instructions)
+        for e, following in zip(script, script[1:] + [None]):
+            if not 0 <= e.start <= e.stop <= n:
+                raise ValueError(f"edit {e.start}:{e.stop} is out of range.")
+            if following and (e.stop > following.start or e.start == following.start):
+                raise ValueError(f"edit {e.start}:{e.stop} overlaps another.")
+
+        self.window = 0
+        #from the last edit on, so positions of the earlier ones stay valid
+        for e in reversed(script):
+            self._apply(e.start, e.stop, self._encode(e.instructions))
+        return self.code
+
+
+    def _splice(self, parts) -> Block:
+        return splice(self.names, parts, self.ids)
+
+
+    def _bounds(self, chunks, start=0, offset=0) -> tuple:
+        """First positions, code rows and keys of chunks, the first one
+        starting at position start and code row offset.
+        """
+        starts, offsets, firsts = [], [], []
+        for chunk in chunks:
+            starts.append(start)
+            offsets.append(offset)
+            firsts.append(chunk.keys[0] if chunk.keys else NEVER)
+            start += len(chunk.keys)
+            offset += len(chunk.code)
+        return starts, offsets, firsts
+
+
+    def _replace(self, first, last, merged, chunks):
+        """Replaces chunks first to last, merged into merged, with chunks,
+        patching the whole block and code to match.
+        """
+        lo, hi = self.starts[first], self.starts[last] + len(self.chunks[last].keys)
+        patch(self.instructions, lo, hi, merged.block)
+        shift = len(merged.block) - (hi - lo)
+        lo, hi = self.offsets[first], self.offsets[last] + len(self.chunks[last].code)
+        patch(self.code, lo, hi, merged.code)
+        code_shift = len(merged.code) - (hi - lo)
+
+        starts, offsets, firsts = self._bounds(
+            chunks, self.starts[first], self.offsets[first]
+        )
+        self.starts[first:] = starts + [s + shift for s in self.starts[last + 1:]]
+        self.offsets[first:] = offsets + [o + code_shift for o in self.offsets[last + 1:]]
+        self.firsts[first:last + 1] = firsts
+        self.chunks[first:last + 1] = chunks
+
+
+    def _encode(self, instructions) -> Block:
+        """Encodes instructions with the register ids of the block."""
+        if isinstance(instructions, Block):
+            instructions = instructions.decode()
+        block = Block.encode(instructions)
+        ids = []
+        for name in block.names:
+            if name not in self.ids:
+                self.ids[name] = len(self.names)
+                self.names.append(name)
+            ids.append(self.ids[name])
+        self.vbp = self.ids.get('r0', NONE)
+
+        for column, bit in (
+            (block.op1, OP1_CONST), (block.op2, OP2_CONST), (block.dst, DST_CONST)
+        ):
+            for j, (reg, const) in enumerate(zip(column, block.const)):
+                if reg != NONE and not const & bit:
+                    column[j] = ids[reg]
+        block.names = self.names
+        return block
+
+
+    def _index(self, block, gap=GAP) -> list:
+        """Keys gap apart for the instructions of block, recording the
+        occurrences of every register.
+        """
+        self.occurrences = defaultdict(list)    # vr -> keys it occurs at
+        self.reads = defaultdict(list)          # vr -> keys it is read at
+        keys = list(range(gap, gap * (len(block) + 1), gap))
+        for key, row in zip(keys, block.rows()):
+            self._occur(key, row, True)
+        return keys
+
+
+    def _occur(self, key, row, add):
+        """Adds or removes the occurrences of the instruction at key."""
+        read, dst = registers(row)
+        for table, regs in (
+            (self.occurrences, set(read) | {dst} - {NONE}), (self.reads, set(read))
+        ):
+            for reg in regs:
+                keys = table[reg]
+                if add:
+                    keys.insert(bisect_left(keys, key), key)
+                else:
+                    del keys[bisect_left(keys, key)]
+
+
+    def _next(self, vr, key) -> int:
+        """Key of the first occurrence of vr after key, NEVER if there is none."""
+        keys = self.occurrences[vr]
+        i = bisect_right(keys, key)
+        return keys[i] if i < len(keys) else NEVER
+
+
+    def _live(self, vr, key) -> bool:
+        """Whether vr is read at key or after, before being defined again."""
+        keys = self.occurrences[vr]
+        i = bisect_left(keys, key)
+        if i == len(keys):
+            return False
+        reads = self.reads[vr]
+        j = bisect_left(reads, keys[i])
+        return j < len(reads) and reads[j] == keys[i]
+
+
+    def _checkpoint(self, state, key) -> State:
+        """state reduced to the registers live at key."""
+        return State(
+            (loc, vr) for loc, vr in state.holder.items() if self._live(vr, key)
+        )
+
+
+    def _replay(self, state, chunk, hi) -> State:
+        """state updated along the code of the first hi instructions of chunk."""
+        block, code = chunk.block, chunk.code
+        offset = 0
+        for j in range(hi):
+            for r in range(offset, offset + chunk.widths[j] - 1):
+                state.move((code.opcode[r], code.op1[r], code.op2[r], code.dst[r]))
+            offset += chunk.widths[j]
+            _, dst = registers((block.opcode[j], NONE, NONE, block.dst[j], block.const[j]))
+            if dst != NONE and dst != self.vbp:
+                state.define(code.dst[offset - 1], dst)
+        return state
+
+
+    def _allocate_window(self, state, block, keys) -> tuple:
+        """Allocates block, whose instructions have the given keys, starting
+        from the register state before it. Returns its code and widths.
+        """
+        self.regs = [self.Register(j) for j in range(1, self.k + 1)]
+        self.location = defaultdict(lambda: None)
+        self.spilled = defaultdict(lambda: None)
+        self.constant = defaultdict(lambda: None)
+        self.home = defaultdict(lambda: None)
+        if self.vbp != NONE:
+            self.location[self.vbp] = self.bp
+
+        #registers first, then spill slots, of the values used from here on
+        first = keys[0] if keys else NEVER
+        for loc, vr in sorted(state.holder.items(), reverse=True):
+            upcoming = self._next(vr, first - 1)
+            if upcoming == NEVER or self.location[vr] is not None:
+                continue
+            if loc > 0:
+                reg = self.regs[loc - 1]
+                reg.vr_name, reg.next = vr, upcoming
+                self.location[vr] = reg
+            elif self.spilled[vr] is None:
+                self.spilled[vr] = loc
+        self.available = [r for r in self.regs if r.vr_name is None]
+        self.farthest = NextUseHeap(self.regs)
+
+        #next uses as in Liveness, counted in keys and beyond the window
+        n = len(block)
+        next_use = [NEVER] * (3 * n)
+        upcoming = {}
+        last = keys[-1] if keys else 0
+        for j in range(n - 1, -1, -1):
+            const = block.const[j]
+            for reg, bit, field in (
+                (block.dst[j], DST_CONST, 2), (block.op2[j], OP2_CONST, 1),
+                (block.op1[j], OP1_CONST, 0)
+            ):
+                if reg != NONE and not const & bit:
+                    if reg not in upcoming:
+                        upcoming[reg] = self._next(reg, last)
+                    next_use[3 * j + field] = upcoming[reg]
+                    upcoming[reg] = keys[j]
+
+        self.result = Block(physical_names(self.k))
+        widths = []
+        step = self._step
+        for j, row in enumerate(block.rows()):
+            before = len(self.result)
+            step(row, next_use, 3 * j)
+            widths.append(len(self.result) - before)
+        return self.result, widths
+
+
+    def _resync(self, have, want) -> List[tuple]:
+        """Code moving every value of want from where it is in have to its
+        location in want.
+        """
+        code = []
+        have = have.copy()
+        def emit(*row):
+            code.append(row)
+            have.move(row)
+        def fresh():
+            self.offset -= 4
+            return self.offset + 4
+        def regs(vr):
+            return sorted(loc for loc in have.homes[vr] if loc > 0)
+
+        #spill slots first, while registers still hold the window's values
+        pending = []
+        for slot, vr in want.holder.items():
+            if slot < 0 and have.holder.get(slot) != vr:
+                if regs(vr):
+                    emit(STOREAI, regs(vr)[0], BP, slot, DST_CONST)
+                elif have.homes[vr]:
+                    pending.append((slot, vr))
+
+        #then registers, a parallel copy whose cycles are broken in memory
+        moves = {
+            reg: vr for reg, vr in want.holder.items()
+            if reg > 0 and have.holder.get(reg) != vr and have.homes[vr]
+        }
+        wanted = set(moves.values()) | {vr for _, vr in pending}
+        def needed(reg):
+            vr = have.holder.get(reg)
+            return vr in wanted and have.homes[vr] == {reg}
+        while moves:
+            ready = [reg for reg in sorted(moves) if not needed(reg)]
+            if not ready:
+                reg = min(moves)
+                emit(STOREAI, reg, BP, fresh(), DST_CONST)
+                continue
+            reg = ready[0]
+            vr = moves.pop(reg)
+            wanted = set(moves.values()) | {vr for _, vr in pending}
+            if regs(vr):
+                emit(I2I, regs(vr)[0], NONE, reg, 0)
+            else:
+                emit(LOADAI, BP, max(have.homes[vr]), reg, OP2_CONST)
+
+        #last, values wanted in a slot that only were in other slots
+        for slot, vr in pending:
+            if have.holder.get(slot) == vr:
+                continue
+            if regs(vr):
+                emit(STOREAI, regs(vr)[0], BP, slot, DST_CONST)
+                continue
+            free = [r for r in range(1, self.k + 1) if r not in want.holder]
+            reg = free[0] if free else 1
+            if not free:
+                saved = fresh()
+                emit(STOREAI, reg, BP, saved, DST_CONST)
+            emit(LOADAI, BP, max(have.homes[vr]), reg, OP2_CONST)
+            emit(STOREAI, reg, BP, slot, DST_CONST)
+            if not free:
+                emit(LOADAI, BP, saved, reg, OP2_CONST)
+        return code
+
+
+    def _following(self, code, start, chunk):
+        """Yields up to LOOKAHEAD rows of code from start on, continuing
+        with the code of the chunks from index chunk on.
+        """
+        rows = 0
+        for code in [code] + [c.code for c in self.chunks[chunk:chunk + LOOKAHEAD]]:
+            stop = start + LOOKAHEAD
+            for row in zip(code.opcode[start:stop], code.op1[start:stop],
+                           code.op2[start:stop], code.dst[start:stop],
+                           code.const[start:stop]):
+                yield row
+                rows += 1
+                if rows == LOOKAHEAD:
+                    return
+            start = 0
+
+
+    def _unread(self, want, rows) -> State:
+        """want without the registers rows overwrite before reading them.
+        Their values would never be used, and the machine does not order
+        writes to a register: a reload issued right before a faster write
+        to the same register lands after it, replacing the new value.
+        """
+        want = want.copy()
+        pending = {loc for loc in want.holder if loc > 0}
+        for row in rows:
+            if not pending:
+                break
+            read, dst = registers(row)
+            pending.difference_update(read)
+            if dst in pending:
+                want.put(dst, None)
+                pending.discard(dst)
+        return want
+
+
+    def _locate(self, pos) -> tuple:
+        """Index of the chunk holding instruction pos and the position of
+        its first instruction. The end of the block is in the last chunk.
+        """
+        i = max(bisect_right(self.starts, pos) - 1, 0)
+        return i, self.starts[i]
+
+
+    def _key(self, pos) -> int:
+        i, base = self._locate(pos)
+        return self.chunks[i].keys[pos - base]
+
+
+    def _position(self, key) -> int:
+        i = max(bisect_right(self.firsts, key) - 1, 0)
+        return self.starts[i] + bisect_left(self.chunks[i].keys, key)
+
+
+    def _gather(self, first, last) -> Chunk:
+        """Chunks first to last merged into one."""
+        chunks = self.chunks[first:last + 1]
+        return Chunk(
+            [key for c in chunks for key in c.keys],
+            self._splice([(c.block, 0, len(c.block)) for c in chunks]),
+            [w for c in chunks for w in c.widths],
+            splice(None, [(c.code, 0, len(c.code)) for c in chunks]),
+            chunks[0].state,
+        )
+
+
+    def _split(self, chunk) -> List[Chunk]:
+        """chunk cut into chunks of at most CHUNK instructions."""
+        n = len(chunk.keys)
+        chunks = []
+        state, offset = chunk.state, 0
+        for lo in range(0, n, CHUNK):
+            hi = min(lo + CHUNK, n)
+            width = sum(chunk.widths[lo:hi])
+            piece = Chunk(
+                chunk.keys[lo:hi], self._splice([(chunk.block, lo, hi)]),
+                chunk.widths[lo:hi], splice(None, [(chunk.code, offset, offset + width)]),
+                state,
+            )
+            chunks.append(piece)
+            if hi < n:
+                state = self._checkpoint(
+                    self._replay(state.copy(), piece, hi - lo), chunk.keys[hi]
+                )
+            offset += width
+        return chunks
+
+
+    def _renumber(self, gap):
+        keys = iter(self._index(self.instructions, gap))
+        for chunk in self.chunks:
+            chunk.keys = [next(keys) for _ in chunk.keys]
+        self.firsts = self._bounds(self.chunks)[2]
+
+
+    def _apply(self, start, stop, new):
+        n = len(self.instructions)
+        m = len(new)
+
+        #keys of the new instructions, between those of their neighbours
+        def bounds():
+            lo = self._key(start - 1) if start else 0
+            return lo, self._key(stop) if stop < n else lo + GAP * (m + 1)
+        lo, hi = bounds()
+        if hi - lo <= m:
+            self._renumber(max(GAP, m + 1))
+            lo, hi = bounds()
+        new_keys = [lo + (hi - lo) * (i + 1) // (m + 1) for i in range(m)]
+
+        last, _ = self._locate(stop)
+        first, base = self._locate(start)
+        merged = self._gather(first, last)
+
+        #where the code after the edit expects its values
+        want = State()
+        if stop < n:
+            want = self._replay(merged.state.copy(), merged, stop - base)
+            want = self._checkpoint(want, merged.keys[stop - base])
+
+        for j in range(start - base, stop - base):
+            row = (merged.block.opcode[j], merged.block.op1[j], merged.block.op2[j],
+                   merged.block.dst[j], merged.block.const[j])
+            self._occur(merged.keys[j], row, False)
+        for key, row in zip(new_keys, new.rows()):
+            self._occur(key, row, True)
+
+        #the window grows back to the last occurrence of every value it needs
+        #that the allocation did not keep
+        a = start
+        while True:
+            state = self._replay(merged.state.copy(), merged, a - base)
+            window = self._splice([(merged.block, a - base, start - base), (new, 0, m)])
+            read, defined = upward_exposed(window)
+            needed = read | {vr for vr, homes in want.homes.items() if homes} - defined
+            before = self._key(a - 1) if a else -1
+            previous = []
+            for vr in needed - {self.vbp}:
+                keys = self.occurrences[vr]
+                i = bisect_right(keys, before)
+                if not state.homes.get(vr) and i:
+                    previous.append(self._position(keys[i - 1]))
+            if not previous:
+                break
+            a = min(previous)
+            if a < base:
+                first, base = self._locate(a)
+                merged = self._gather(first, last)
+
+        la, ls, lb = a - base, start - base, stop - base
+        keys = merged.keys[la:ls] + new_keys
+        code, widths = self._allocate_window(state, window, keys)
+        self.window += len(window)
+
+        offset = sum(merged.widths[:la])
+        end = offset + sum(merged.widths[la:lb])
+        have = self._replay(state.copy(), Chunk(keys, window, widths, code, None), len(window))
+        fix = Block()
+        if stop < n:
+            want = self._unread(want, self._following(merged.code, end, last + 1))
+            for row in self._resync(have, want):
+                fix.append(*row)
+        merged = Chunk(
+            merged.keys[:la] + keys + merged.keys[lb:],
+            self._splice([
+                (merged.block, 0, la), (window, 0, len(window)),
+                (merged.block, lb, len(merged.block))
+            ]),
+            merged.widths[:la] + widths + [
+                w + len(fix) * (j == lb) for j, w in enumerate(merged.widths) if j >= lb
+            ],
+            splice(None, [
+                (merged.code, 0, offset), (code, 0, len(code)), (fix, 0, len(fix)),
+                (merged.code, end, len(merged.code))
+            ]),
+            merged.state,
+        )
+        chunks = self._split(merged)
+        if not chunks and len(self.chunks) == last - first + 1:
+            chunks = [merged] # keep an empty chunk for an empty block
+        self._replace(first, last, merged, chunks)
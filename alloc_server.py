@@ -0,0 +1,286 @@
+"""Long running allocator server, sparing a compiler driver that allocates
+one small block at a time the start up of a Python process per block.
+
+Requests and replies are JSON objects, one per line, over a Unix socket or
+stdin and stdout:
+
+    {"id": 7, "code": "loadI 1024 => r0\\n...", "k": 8, "algorithm": "b"}
+    {"id": 7, "code": "loadI\\t1024\\t=> r0\\n...", "stats": {...}}
+
+A request may also set "schedule" to list schedule the result and "budget"
+for the e and p allocators; id is echoed back as is. A failing request is
+answered with {"id": 7, "error": "..."} and the connection stays usable,
+also when a worker crashes: its requests are answered with an error
+without id and the pool is replaced.
+
+Requests are decoded, allocated and encoded by a process pool, the event
+loop only moves lines. Every connection has a bounded queue of pending
+requests, answered in the order they came in; while it is full the server
+stops reading from that connection, so a client sending faster than the
+pool allocates is slowed down rather than buffered. A semaphore bounds the
+requests in the pool across all connections.
+
+    python alloc_server.py --socket /tmp/alloc.sock [-j JOBS]
+    python alloc_server.py --stdin < requests.jsonl
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import alloc
+import iloc_sched
+from alloc_cache import MAX_BYTES, AllocationCache, CachedAlloc
+
+
+LINE_LIMIT = 2 ** 28    # longest request line in bytes
+
+_cache = None           # the worker's AllocationCache, if any
+
+
+def _init_worker(cache_dir, cache_bytes):
+    global _cache
+    if cache_dir:
+        _cache = AllocationCache(cache_dir, cache_bytes)
+
+
+def allocate(request) -> dict:
+    """Allocates the block of a decoded request, returning its reply."""
+    if not isinstance(request, dict):
+        raise ValueError("requests must be JSON objects.")
+    missing = [f for f in ('code', 'k', 'algorithm') if f not in request]
+    if missing:
+        raise ValueError(f"request without {', '.join(missing)}.")
+    algorithm, k = request['algorithm'], request['k']
+    if algorithm not in alloc.ALLOCATORS:
+        raise ValueError(f"unknown algorithm '{algorithm}'.")
+    if not isinstance(k, int):
+        raise ValueError(f"k must be an integer, not {k!r}.")
+
+    tic = time.perf_counter()
+    block = alloc.parse_block(request['code'], '<request>')
+    parse_ms = (time.perf_counter() - tic) * 1000
+    options = {}
+    Allocator = alloc.ALLOCATORS[algorithm]
+    if Allocator in (alloc.PortfolioAlloc, alloc.ExactAlloc) and \
+            request.get('budget') is not None:
+        options['budget'] = request['budget']
+    if _cache is not None:
+        allocator = CachedAlloc(_cache, algorithm, block, **options)
+    else:
+        allocator = alloc.make_allocator(algorithm, block, **options)
+
+    result = allocator.allocate(k)
+    if request.get('schedule'):
+        with allocator.stats.phase('schedule'):
+            result = allocator.stats.result = iloc_sched.schedule(result)
+    stats = allocator.stats.as_dict()
+    stats['phases'] = {'parse': parse_ms, **stats['phases']}
+    return {
+        'id': request.get('id'),
+        'code': '\n'.join(map(str, result)),
+        'stats': stats,
+    }
+
+
+def allocate_line(line) -> bytes:
+    """Worker: answers one request line with one reply line. Errors are
+    replied instead of raised so they never take down the pool.
+    """
+    request = {}
+    try:
+        request = json.loads(line)
+        reply = allocate(request)
+    except Exception as e:
+        id = request.get('id') if isinstance(request, dict) else None
+        reply = error_reply(id, e)
+    return json.dumps(reply).encode() + b'\n'
+
+
+def error_reply(id, e) -> dict:
+    return {'id': id, 'error': f"{type(e).__name__}: {e}"}
+
+
+class AllocServer:
+    """Serves allocation requests with jobs worker processes, keeping up to
+    max_pending requests per connection queued (default: twice jobs).
+    """
+
+    def __init__(self, jobs=None, max_pending=None, cache_dir=None,
+                 cache_bytes=MAX_BYTES) -> None:
+        self.jobs = jobs or os.cpu_count()
+        self.max_pending = max_pending or 2 * self.jobs
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self.pool = None
+        self.slots = None
+
+
+    async def __aenter__(self):
+        self.pool = self._start_pool()
+        self.slots = asyncio.Semaphore(self.jobs + self.max_pending)
+        return self
+
+
+    async def __aexit__(self, *exc):
+        self.pool.shutdown(cancel_futures=True)
+        self.pool = None
+
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        # forked workers would inherit, and keep open, the connections
+        # accepted before they were started
+        return ProcessPoolExecutor(
+            self.jobs, multiprocessing.get_context('forkserver'),
+            initializer=_init_worker,
+            initargs=(self.cache_dir, self.cache_bytes)
+        )
+
+
+    def _submit(self, line) -> asyncio.Future:
+        """Hands a request line to the pool, replacing the pool first if a
+        crashed worker broke it.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return loop.run_in_executor(self.pool, allocate_line, line)
+        except BrokenProcessPool:
+            self.pool.shutdown(wait=False)
+            self.pool = self._start_pool()
+            return loop.run_in_executor(self.pool, allocate_line, line)
+
+
+    async def handle(self, reader, writer):
+        """Serves one connection until the client stops sending, then
+        answers what is still pending and closes it.
+        """
+        pending = asyncio.Queue(self.max_pending)
+        reading = asyncio.ensure_future(self._read(reader, pending))
+        try:
+            while True:
+                reply = await pending.get()
+                if reply is None:
+                    break
+                try:
+                    line = await reply
+                except Exception as e: # e.g. BrokenProcessPool
+                    line = json.dumps(error_reply(None, e)).encode() + b'\n'
+                writer.write(line)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            reading.cancel()
+            writer.close()
+
+
+    async def _read(self, reader, pending):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.isspace():
+                    continue
+                await self.slots.acquire()
+                try:
+                    reply = self._submit(line)
+                except BaseException:
+                    self.slots.release()
+                    raise
+                reply.add_done_callback(lambda _: self.slots.release())
+                await pending.put(reply)
+        except ValueError as e: # a line longer than LINE_LIMIT
+            reply = loop.create_future()
+            reply.set_result(json.dumps(error_reply(None, e)).encode() + b'\n')
+            await pending.put(reply)
+        except ConnectionError:
+            pass
+        await pending.put(None)
+
+
+    async def serve_unix(self, path):
+        """Accepts connections on the Unix socket path until cancelled."""
+        server = await asyncio.start_unix_server(self.handle, path, limit=LINE_LIMIT)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+    async def serve_stdin(self):
+        """Answers the requests on stdin until it is closed."""
+        await self.handle(StdinReader(), StdoutWriter())
+
+
+class StdinReader:
+    """The readline() of a StreamReader on stdin, which unlike a pipe
+    transport also works when stdin is redirected from a regular file.
+    """
+
+    async def readline(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, sys.stdin.buffer.readline)
+
+
+class StdoutWriter:
+    """The parts of a StreamWriter handle() writes replies with."""
+
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+
+
+    async def drain(self):
+        sys.stdout.buffer.flush()
+
+
+    def close(self):
+        sys.stdout.buffer.flush()
+
+
+async def serve(args):
+    cache_bytes = int(args.cache_size * 2 ** 20)
+    async with AllocServer(
+        args.jobs, args.max_pending, args.cache_dir, cache_bytes
+    ) as server:
+        if args.stdin:
+            await server.serve_stdin()
+        else:
+            await server.serve_unix(args.socket)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='ILOC register allocation server speaking JSON lines'
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--socket', help='path of the Unix socket to listen on')
+    source.add_argument('--stdin', action='store_true',
+                        help='answer requests on stdin on stdout instead')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='requests queued per connection before the server '
+                             'stops reading from it (default: twice --jobs)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='reuse allocations stored in this directory, see '
+                             'alloc.py --cache-dir')
+    parser.add_argument('--cache-size', type=float, default=256,
+                        help='MiB the --cache-dir may grow to (default: 256)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,28 @@
+import heapq
+import time
+import weakref
+from array import array
 from collections import Counter, defaultdict, namedtuple
+from contextlib import contextmanager
+from functools import cached_property
+from itertools import accumulate
+
+try:
+    import numpy as np
+except ImportError: # Liveness falls back to its pure Python pass
+    np = None
+
+from iloc_ir import (
+    NONE, OP1_CONST, OP2_CONST, DST_CONST, OPCODE_ID, LOADI, LOADAI, STOREAI, I2I
+)
 
 
 Interval = namedtuple('Interval', ["start", "end"])
+NEVER = 2 ** 31 - 1 # end of a live range that never ends, no next use
 
 def isregister(string) -> bool:
     """Returns True if string is not an integer constant."""
-    return string is not None and not string.isdigit()
+    return string is not None and not string.lstrip('-').isdigit()
 
 
 def range_cmp(a, b):
@@ -89,4 +106,712 @@ def get_vr_usage(instructions):
             if isregister(reg):
                 usage[reg].append(i)
     
-    return usage
\ No newline at end of file
+    return usage
+
+
+def spill_summary(block, result):
+    """Compares an allocator result against its input Block. Returns the
+    number of stack slots written through r0 and the number of loadAI and
+    storeAI instructions the allocator inserted.
+    """
+    def memory_ops(code, bp):
+        loads = stores = 0
+        slots = set()
+        for opcode, _, op2, dst, _ in code.rows():
+            if opcode == LOADAI:
+                loads += 1
+            elif opcode == STOREAI:
+                stores += 1
+                if op2 == bp:
+                    slots.add(dst)
+        return slots, loads, stores
+
+    slots, loads, stores = memory_ops(block, block.bp)
+    new_slots, new_loads, new_stores = memory_ops(result, result.bp)
+    return len(new_slots - slots), new_loads - loads, new_stores - stores
+
+
+def constants(block) -> dict:
+    """Maps the virtual registers whose only definition is a loadI coming
+    before their first use to its constant. Spilling them costs nothing,
+    they can be rematerialized with another loadI.
+    """
+    start = Liveness.of(block).start
+    defined = Counter(
+        dst for dst, const in zip(block.dst, block.const)
+        if dst != NONE and not const & DST_CONST
+    )
+    return {
+        dst: op1
+        for j, (opcode, op1, dst, const) in enumerate(
+            zip(block.opcode, block.op1, block.dst, block.const)
+        )
+        if opcode == LOADI and const & OP1_CONST and dst != NONE
+        and not const & DST_CONST and start[dst] == j and defined[dst] == 1
+    }
+
+
+MEMORY_WRITES = frozenset(OPCODE_ID[op] for op in (
+    'store', 'storeAI', 'storeAO', 'cstore', 'cstoreAI', 'cstoreAO'
+))
+CONTROL = frozenset(OPCODE_ID[op] for op in ('label', 'jumpI', 'jump', 'cbr'))
+#opcodes whose dst, if any, is read rather than written
+NO_DEFINITION = MEMORY_WRITES | CONTROL | {
+    OPCODE_ID[op] for op in ('nop', 'output', 'outputAI')
+}
+
+
+def remove_redundant_spill_code(code) -> int:
+    """Peephole pass over allocated code. Drops a loadAI through r0 into a
+    register that still holds that slot, e.g. right after storing it
+    there, and a storeAI of a register into the slot it still holds.
+    Reloads of a slot another register holds become an i2i. Any other
+    store to memory, a label or a branch forgets what is held. Returns
+    the number of memory operations removed or turned into copies.
+    """
+    bp = code.bp
+    opcode, op1s, op2s, dsts, consts = code.opcode, code.op1, code.op2, code.dst, code.const
+    holds = {}      # register -> slot it holds the value of
+    held = {}       # slot -> registers holding its value, never empty
+    def forget(reg):
+        slot = holds.pop(reg, None)
+        if slot is not None:
+            held[slot].discard(reg)
+            if not held[slot]:
+                del held[slot]
+
+    drop, copies = [], 0
+    barriers, no_definition = MEMORY_WRITES | CONTROL, NO_DEFINITION
+    for j, (op, op1, op2, dst, const) in enumerate(zip(opcode, op1s, op2s, dsts, consts)):
+        #spill slots are words, unaligned offsets only come from the input
+        if op == LOADAI and op1 == bp and const & OP2_CONST and not op2 & 3 and dst != bp:
+            if holds.get(dst) == op2:
+                drop.append(j)
+                continue
+            forget(dst)
+            if op2 in held:
+                opcode[j], op1s[j], op2s[j], consts[j] = I2I, min(held[op2]), NONE, 0
+                copies += 1
+            holds[dst] = op2
+            held.setdefault(op2, set()).add(dst)
+        elif op == STOREAI and op2 == bp and const & DST_CONST and not dst & 3:
+            if holds.get(op1) == dst:
+                drop.append(j)
+                continue
+            for reg in held.pop(dst, ()):
+                del holds[reg]
+            forget(op1)
+            holds[op1] = dst
+            held[dst] = {op1}
+        elif op in barriers:
+            holds.clear()
+            held.clear()
+        elif op not in no_definition and dst != NONE and not const & DST_CONST:
+            if dst == bp:
+                holds.clear()
+                held.clear()
+            else:
+                forget(dst)
+
+    #compacted in place, moving the rows between dropped ones
+    for column in (opcode, op1s, op2s, dsts, consts) if drop else ():
+        end = drop[0]
+        for j, stop in zip(drop, drop[1:] + [len(column)]):
+            column[end:end + stop - j - 1] = column[j + 1:stop]
+            end += stop - j - 1
+        del column[end:]
+    if drop or copies:
+        Liveness.forget(code)
+    return len(drop) + copies
+
+
+def color_slots(block, result) -> int:
+    """Shares the spill slots of result, an allocation of block, between
+    values that are never spilled at the same time. A slot is taken from
+    its first to its last access through r0; slots are colored in order of
+    their start, each reusing the free offset closest to r0, if any.
+    Offsets block itself accesses through r0 are left alone and never
+    handed out. Returns the bytes of spill slots result had before.
+    """
+    def accesses(code) -> tuple:
+        """Rows and offsets of the accesses through r0 with a constant offset."""
+        rows, offsets = array('i'), array('q')
+        bp, op1, op2, dst, const = code.bp, code.op1, code.op2, code.dst, code.const
+        for j, op in enumerate(code.opcode):
+            if op == LOADAI:
+                if op1[j] == bp and const[j] & OP2_CONST:
+                    rows.append(j)
+                    offsets.append(op2[j])
+            elif op == STOREAI:
+                if op2[j] == bp and const[j] & DST_CONST:
+                    rows.append(j)
+                    offsets.append(dst[j])
+        return rows, offsets
+
+    fixed = set()   # negative offsets overlapping a word block accesses
+    for offset in accesses(block)[1]:
+        if offset - 3 < 0:
+            fixed.update(range(offset - 3, min(offset + 4, 0)))
+
+    #slot n is offset -4n; unaligned offsets are only ever in the input
+    rows, offsets = accesses(result)
+    first, last = array('i'), array('i')
+    for j, offset in zip(rows, offsets):
+        if offset >= 0 or offset & 3 or offset in fixed:
+            continue
+        n = -offset >> 2
+        if n >= len(last):
+            grow = max(n + 1 - len(last), len(last))
+            first += array('i', [len(result)]) * grow
+            last += array('i', [-1]) * grow
+        if j < first[n]:
+            first[n] = j
+        if j > last[n]:
+            last[n] = j
+    starts = array('i', [0]) * len(result)  # slot first accessed by a row
+    for n, j in enumerate(first):
+        if last[n] >= 0:
+            starts[j] = n
+
+    #slots are colored in order of their first access
+    free, taken = [], []    # heaps of -offset and of (last access, offset)
+    shared = array('i', range(0, -4 * len(last), -4))
+    top = 0
+    for j in range(len(starts)):
+        n = starts[j]
+        if not n:
+            continue
+        while taken and taken[0][0] < j:
+            heapq.heappush(free, -heapq.heappop(taken)[1])
+        if free:
+            shared[n] = -heapq.heappop(free)
+        else:
+            top -= 4
+            while top in fixed:
+                top -= 4
+            shared[n] = top
+        heapq.heappush(taken, (last[n], shared[n]))
+
+    opcode = result.opcode
+    for j, offset in zip(rows, offsets):
+        if offset < 0 and not offset & 3 and offset not in fixed:
+            column = result.op2 if opcode[j] == LOADAI else result.dst
+            column[j] = shared[-offset >> 2]
+    return 4 * (len(last) - last.count(-1))
+
+
+class AllocStats:
+    """Measurements of one allocation, attached to the allocator as stats.
+
+    phases holds the milliseconds spent parsing (when the caller records
+    it), in the k independent analysis, choosing what to keep in registers
+    (assign), emitting the result (rewrite) and, when the caller schedules
+    the result, list scheduling it (schedule). ms is the wall time of
+    allocate() itself. Spill code, frame size and max live are derived
+    from the input and result blocks on first access. spill_code_removed
+    counts the memory operations remove_redundant_spill_code saved. peak_kib
+    is only measured when tracemalloc is tracing.
+    """
+    FIELDS = (
+        'algorithm', 'k', 'instructions', 'phases', 'ms', 'spills', 'reloads',
+        'spill_code_removed', 'frame_size', 'frame_size_before',
+        'max_live_before', 'max_live_after', 'peak_kib'
+    )
+
+    def __init__(self, algorithm, k, block) -> None:
+        self.algorithm = algorithm
+        self.k = k
+        self.instructions = len(block)
+        self.phases = {}
+        self.ms = 0.0
+        self.peak_kib = None
+        self.block = block
+        self.result = None
+        self.unshared_frame = None
+        self.spill_code_removed = None
+
+
+    @contextmanager
+    def phase(self, name):
+        """Adds the time spent in the with statement to phases[name]."""
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            toc = time.perf_counter()
+            self.phases[name] = self.phases.get(name, 0.0) + (toc - tic) * 1000
+
+
+    @cached_property
+    def _spill_code(self):
+        return spill_summary(self.block, self.result)
+
+
+    @property
+    def spills(self) -> int:
+        """storeAI instructions inserted."""
+        return self._spill_code[2]
+
+
+    @property
+    def reloads(self) -> int:
+        """loadAI instructions inserted."""
+        return self._spill_code[1]
+
+
+    @property
+    def frame_size(self) -> int:
+        """bytes of spill slots below r0."""
+        return 4 * self._spill_code[0]
+
+
+    @property
+    def frame_size_before(self) -> int:
+        """bytes of spill slots below r0 before color_slots shared them."""
+        if self.unshared_frame is None:
+            return self.frame_size
+        return self.unshared_frame
+
+
+    @property
+    def max_live_before(self) -> int:
+        return Liveness.of(self.block).max_pressure
+
+
+    @property
+    def max_live_after(self) -> int:
+        return Liveness.of(self.result).max_pressure
+
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class NextUseHeap:
+    """Max-heap over a register file keyed on each register's next use.
+
+    Keys are never updated in place: update() pushes a fresh entry and stale
+    ones are dropped lazily once they reach the top, so every operation is
+    O(log k). Ties go to the register that comes first in regs.
+    """
+    def __init__(self, regs) -> None:
+        self.regs = regs
+        self.rebuild()
+
+
+    def rebuild(self):
+        self.heap = [(-reg.next, i) for i, reg in enumerate(self.regs)]
+        heapq.heapify(self.heap)
+
+
+    def update(self, i):
+        """Records a new next use for the register at position i."""
+        heapq.heappush(self.heap, (-self.regs[i].next, i))
+        if len(self.heap) > 4 * len(self.regs):
+            self.rebuild() # drop stale entries, amortized O(1)
+
+
+    def top(self):
+        """Returns the register whose next use is the farthest away."""
+        heap = self.heap
+        while True:
+            key, i = heap[0]
+            if self.regs[i].next == -key:
+                return self.regs[i]
+            heapq.heappop(heap)
+
+
+class IntervalSet:
+    """Set of live intervals ordered by their end point.
+
+    Backed by a min-heap and a max-heap over (end, insertion order), both
+    with lazy deletion, so the shortest and longest lived members can be
+    looked up or removed in O(log n). Intervals are identified by name and
+    ties on the end point go to the earliest inserted interval.
+    """
+    def __init__(self) -> None:
+        self.by_end = []      # (end, seq, interval)
+        self.by_end_desc = [] # (-end, seq, interval)
+        self.members = {}     # interval name -> seq of its live entries
+        self.seq = 0
+
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+
+    def add(self, interval):
+        self.seq += 1
+        self.members[interval.name] = self.seq
+        heapq.heappush(self.by_end, (interval.end, self.seq, interval))
+        heapq.heappush(self.by_end_desc, (-interval.end, self.seq, interval))
+
+
+    def remove(self, interval):
+        del self.members[interval.name]
+        if len(self.by_end) > 2 * len(self.members) + 32:
+            self._compact()
+
+
+    def _top(self, heap):
+        members = self.members
+        while heap:
+            _, seq, interval = heap[0]
+            if members.get(interval.name) == seq:
+                return interval
+            heapq.heappop(heap)
+        return None
+
+
+    def min(self):
+        """interval that ends first, None if the set is empty."""
+        return self._top(self.by_end)
+
+
+    def max(self):
+        """interval that ends last, None if the set is empty."""
+        return self._top(self.by_end_desc)
+
+
+    def _compact(self):
+        """Drops the stale entries left behind by remove()."""
+        members = self.members
+        self.by_end = [e for e in self.by_end if members.get(e[2].name) == e[1]]
+        self.by_end_desc = [
+            e for e in self.by_end_desc if members.get(e[2].name) == e[1]
+        ]
+        heapq.heapify(self.by_end)
+        heapq.heapify(self.by_end_desc)
+
+
+class Liveness:
+    """Liveness facts of a Block, computed in a single backward pass, or
+    with NumPy over every operand slot at once for blocks of at least
+    numpy_min instructions when NumPy is installed.
+
+    All results are flat integer arrays:
+    count[r]      number of occurrences of register r.
+    start[r]      index of the first occurrence of r.
+    end[r]        end of the live range of r as defined by get_live_ranges,
+                  NEVER if r occurs only once.
+    last[r]       index of the last occurrence of r.
+    next_use[s]   index of the next occurrence of the register held in
+                  operand slot s = 3 * j + field (0: op1, 1: op2, 2: dst),
+                  counting later fields of the same instruction. NEVER if
+                  there is none or the slot does not hold a register.
+    pressure[j]   number of registers live at instruction j, a register
+                  being live from its first to its last occurrence.
+
+    Use Liveness.of(block) to share one analysis between allocators.
+    """
+    _cache = weakref.WeakKeyDictionary()
+    numpy_min = 256
+
+    def __init__(self, block, vectorized=None) -> None:
+        if vectorized is None:
+            vectorized = np is not None and len(block) >= self.numpy_min
+        analyze = self._vectorized if vectorized else self._scan
+        (
+            self.count, self.start, self.end, self.last, self.next_use,
+            self.pressure
+        ) = analyze(block)
+
+
+    @staticmethod
+    def _scan(block) -> tuple:
+        n = len(block)
+        num_regs = len(block.names)
+        count = [0] * num_regs
+        upcoming = [NEVER] * num_regs
+        last = [-1] * num_regs
+        next_use = [NEVER] * (3 * n)
+
+        slot = 3 * n
+        for j, op1, op2, dst, const in zip(
+            range(n - 1, -1, -1), reversed(block.op1), reversed(block.op2),
+            reversed(block.dst), reversed(block.const)
+        ):
+            slot -= 3
+            if dst != NONE and not const & DST_CONST:
+                next_use[slot + 2] = upcoming[dst]
+                upcoming[dst] = j
+                count[dst] += 1
+                if last[dst] < 0:
+                    last[dst] = j
+            if op2 != NONE and not const & OP2_CONST:
+                next_use[slot + 1] = upcoming[op2]
+                upcoming[op2] = j
+                count[op2] += 1
+                if last[op2] < 0:
+                    last[op2] = j
+            if op1 != NONE and not const & OP1_CONST:
+                next_use[slot] = upcoming[op1]
+                upcoming[op1] = j
+                count[op1] += 1
+                if last[op1] < 0:
+                    last[op1] = j
+
+        # once the pass is over, the upcoming occurrence is the first one
+        events = [0] * (n + 1)
+        end = [NEVER] * num_regs
+        for reg in range(num_regs):
+            if count[reg] > 1:
+                end[reg] = last[reg] - 1
+            if count[reg]: # named registers need not occur, e.g. unused r<k>
+                events[upcoming[reg]] += 1
+                events[last[reg] + 1] -= 1
+
+        return (
+            array('i', count), array('i', upcoming), array('i', end),
+            array('i', last), array('i', next_use),
+            array('i', accumulate(events[:n]))
+        )
+
+
+    @staticmethod
+    def _vectorized(block) -> tuple:
+        """The arrays of _scan, out of the operand slots as NumPy arrays."""
+        n = len(block)
+        num_regs = len(block.names)
+        slots = np.empty(3 * n, np.intc)
+        consts = np.empty(3 * n, np.uint8)
+        const = np.frombuffer(block.const, np.uint8)
+        for field, (column, bit) in enumerate((
+            (block.op1, OP1_CONST), (block.op2, OP2_CONST),
+            (block.dst, DST_CONST)
+        )):
+            # constants wider than a register id are masked out below
+            slots[field::3] = np.frombuffer(column, np.int64)
+            consts[field::3] = const & bit
+        occupied = np.flatnonzero((slots != NONE) & (consts == 0))
+        regs = slots[occupied]
+        at = (occupied // 3).astype(np.intc) # instruction of each occurrence
+
+        # occurrences grouped by register, in slot order within a group:
+        # the keys are unique, so an unstable sort of them will do
+        keys = regs.astype(np.int64) << 32 | np.arange(len(regs))
+        keys.sort()
+        order = (keys & 0xffffffff).astype(np.intp)
+        grouped = regs[order]
+        at = at[order]
+        same = grouped[1:] == grouped[:-1]
+        firsts = np.flatnonzero(np.diff(grouped, prepend=NONE))
+        lasts = np.flatnonzero(np.diff(grouped, append=NONE))
+        used = grouped[firsts]
+
+        count = np.bincount(regs, minlength=num_regs)
+        start = np.full(num_regs, NEVER, np.intc)
+        start[used] = at[firsts]
+        last = np.full(num_regs, -1, np.intc)
+        last[used] = at[lasts]
+        end = np.where(count > 1, last - 1, NEVER)
+
+        following = np.full(len(regs), NEVER, np.intc)
+        following[order[:-1][same]] = at[1:][same]
+        next_use = np.full(3 * n, NEVER, np.intc)
+        next_use[occupied] = following
+
+        events = np.bincount(start[used], minlength=n + 1)
+        events -= np.bincount(last[used] + 1, minlength=n + 1)
+        pressure = np.cumsum(events[:n])
+        return tuple(
+            array('i', column.astype(np.intc).tobytes())
+            for column in (count, start, end, last, next_use, pressure)
+        )
+
+
+    @classmethod
+    def of(cls, block) -> 'Liveness':
+        """Returns the memoized analysis of block, recomputing it only if
+        instructions were appended since. Code rewriting rows in place must
+        call forget(block).
+        """
+        cached = cls._cache.get(block)
+        if cached is None or len(cached.pressure) != len(block):
+            cached = cls._cache[block] = cls(block)
+        return cached
+
+
+    @classmethod
+    def forget(cls, block):
+        """Drops the memoized analysis of block, whose rows changed."""
+        cls._cache.pop(block, None)
+
+
+    @property
+    def max_pressure(self) -> int:
+        return max(self.pressure, default=0)
+
+
+def fit_spill_code(block, spilled, k, rank, remat=()) -> list:
+    """Spills registers of block until the spill code of every instruction
+    fits in the k physical registers left over by the values kept there,
+    so none has to be reserved for it.
+
+    A kept register holds its physical register from its first to its last
+    occurrence. An instruction j loads each spilled operand into a register
+    free before it and stores a spilled definition from one free after it,
+    unless the register is in remat, whose definitions are dropped. Where
+    that does not fit, the register with the lowest rank that is live
+    across j without being used there is spilled as well; spilling it never
+    makes an earlier instruction short of registers, so one pass does.
+
+    spilled[r] is updated in place. Returns the registers spilled, in order.
+    """
+    live = Liveness.of(block)
+    start, last = live.start, live.last
+    bp = block.bp
+    dying = [0] * len(block) # kept registers live into j last occurring at j
+    for r, count in enumerate(live.count):
+        if count and r != bp and not spilled[r] and start[r] < last[r]:
+            dying[last[r]] += 1
+
+    def demand(j, op1, op2, dst, live_in) -> tuple:
+        """Registers instruction j needs for its operands, spilled ones and
+        those first read here, the kept ones among those living on, and
+        the registers in use right after it.
+        """
+        before = new = 0
+        for r in (op1, op2):
+            if r == NONE:
+                continue
+            if spilled[r]:
+                before += 1
+            elif start[r] == j:
+                before += 1
+                if last[r] > j:
+                    new += 1
+        after = live_in - dying[j] + new
+        if dst != NONE and not (
+            spilled[dst] and dst in remat
+            or not spilled[dst] and start[dst] <= j < last[dst]
+            and (start[dst] < j or dst == op1 or dst == op2)
+        ):
+            after += 1
+        return before, new, after
+
+    added = []
+    live_in = 0     # kept registers live into instruction j
+    candidates = [] # (rank, register) of the kept registers live into j
+    for j, op1, op2, dst, const in zip(
+        range(len(block)), block.op1, block.op2, block.dst, block.const
+    ):
+        if op1 == bp or const & OP1_CONST:
+            op1 = NONE
+        if op2 == bp or op2 == op1 or const & OP2_CONST:
+            op2 = NONE
+        if dst == bp or const & DST_CONST:
+            dst = NONE
+        before, new, after = demand(j, op1, op2, dst, live_in)
+        if live_in + before > k or after > k:
+            held = []   # candidates instruction j uses, spilled last
+            while live_in + before > k or after > k:
+                if candidates:
+                    r = heapq.heappop(candidates)[1]
+                    if spilled[r] or last[r] <= j:
+                        continue
+                    if r == op1 or r == op2 or r == dst:
+                        heapq.heappush(held, (rank[r], r))
+                        continue
+                elif held:
+                    #only what j uses is left: reloaded and stored around j
+                    #through the registers free there, like any spill
+                    r = heapq.heappop(held)[1]
+                else:
+                    raise ValueError(
+                        f'instruction {j} needs more than {k} registers'
+                    )
+                spilled[r] = True
+                added.append(r)
+                live_in -= 1
+                dying[last[r]] -= 1
+                before, new, after = demand(j, op1, op2, dst, live_in)
+            for entry in held:
+                heapq.heappush(candidates, entry)
+
+        live_in += new - dying[j]
+        for r in (op1, op2) if new else ():
+            if r != NONE and start[r] == j < last[r] and not spilled[r]:
+                heapq.heappush(candidates, (rank[r], r))
+        if dst != NONE and start[dst] == j < last[dst] and not spilled[dst]:
+            if dst != op1 and dst != op2:
+                live_in += 1
+                heapq.heappush(candidates, (rank[dst], dst))
+
+    return added
+
+
+
+
+class InterferenceGraph:
+    """Interference graph over the live ranges of a Block's registers.
+
+    Two registers interfere when their ranges, as get_live_ranges defines
+    them, overlap: from the first occurrence to the one before the last, or
+    only the first occurrence for registers occurring once. Edges are kept
+    in a triangular bit matrix, bit a * (a - 1) // 2 + b for a > b, for
+    constant time interferes(), and in adjacency arrays: the neighbors of
+    register r are adjacency[offsets[r]:offsets[r + 1]]. Registers in skip,
+    e.g. r0, and those that never occur are left out of the graph.
+    """
+    def __init__(self, block, skip=()) -> None:
+        live = Liveness.of(block)
+        n = len(block.names)
+        count, start, end = live.count, live.start, live.end
+        bits = self.bits = bytearray((n * (n - 1) // 2 + 7) // 8)
+
+        #ranges are swept by their start, each meets the ones still active
+        nodes = self.nodes = sorted(
+            (reg for reg in range(n) if count[reg] and reg not in skip),
+            key=start.__getitem__
+        )
+        stop = array('i', (s if e == NEVER else max(s, e) for s, e in zip(start, end)))
+        earlier = array('i')            # the active ranges every node met
+        met = array('i', bytes(4 * n))
+        later = [[] for _ in range(n)]  # the nodes that met it
+        active, j = [], -1
+        for a in nodes:
+            if start[a] != j:
+                j = start[a]
+                active = [reg for reg in active if stop[reg] >= j]
+            row = a * (a - 1) // 2
+            for b in active:
+                i = row + b if b < a else b * (b - 1) // 2 + a
+                bits[i >> 3] |= 1 << (i & 7)
+                later[b].append(a)
+            earlier.extend(active)
+            met[a] = len(active)
+            active.append(a)
+
+        degree = array('i', (m + len(l) for m, l in zip(met, later)))
+        offsets = array('i', accumulate(degree, initial=0))
+        adjacency = array('i', bytes(4 * offsets[-1]))
+        p = 0
+        for a in nodes:
+            o, m = offsets[a], met[a]
+            adjacency[o:o + m] = earlier[p:p + m]
+            adjacency[o + m:offsets[a + 1]] = array('i', later[a])
+            p += m
+        self.degree = degree
+        self.offsets = offsets
+        self.adjacency = adjacency
+
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+    @property
+    def edges(self) -> int:
+        return len(self.adjacency) // 2
+
+
+    def interferes(self, a, b) -> bool:
+        if a == b:
+            return False
+        i = a * (a - 1) // 2 + b if a > b else b * (b - 1) // 2 + a
+        return bool(self.bits[i >> 3] & 1 << (i & 7))
+
+
+    def neighbors(self, reg) -> array:
+        return self.adjacency[self.offsets[reg]:self.offsets[reg + 1]]
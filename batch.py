@@ -0,0 +1,148 @@
+"""Allocates many ILOC files at once, spreading them over a process pool.
+
+Files come from a directory (every *.i file below it), a glob pattern or a
+manifest listing one path per line. Each file is allocated by a worker
+process and written below the output directory, mirroring the layout of
+the inputs; one failing file does not stop the others.
+"""
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple
+
+import alloc
+import iloc_sched
+from alloc_cache import MAX_BYTES, AllocationCache, CachedAlloc
+from alloc_utils import spill_summary
+from iloc_ir import Block
+
+
+class FileReport(NamedTuple):
+    path: str
+    instructions: int = 0
+    loads: int = 0
+    stores: int = 0
+    ms: float = 0
+    hits: int = 0
+    misses: int = 0
+    error: str = None
+
+
+def collect_files(spec) -> List[str]:
+    """Expands a directory, glob pattern or manifest file into a sorted list
+    of ILOC files. Manifest paths are relative to the manifest itself and
+    lines starting with '#' are ignored.
+    """
+    if os.path.isdir(spec):
+        pattern = os.path.join(spec, '**', '*.i')
+        return sorted(glob.glob(pattern, recursive=True))
+
+    if any(c in spec for c in '*?['):
+        return sorted(glob.glob(spec, recursive=True))
+
+    base = os.path.dirname(spec)
+    files = []
+    with open(spec, 'r') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                files.append(os.path.join(base, line))
+    return files
+
+
+def output_paths(files, spec, output_dir) -> List[str]:
+    """Output path of every file without extension, keeping the directory
+    structure relative to the batch root so equal names never collide.
+    """
+    if os.path.isdir(spec):
+        root = spec
+    else:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+
+    paths = []
+    for f in files:
+        rel = os.path.relpath(os.path.abspath(f), os.path.abspath(root))
+        paths.append(os.path.join(output_dir, os.path.splitext(rel)[0]))
+    return paths
+
+
+def allocate_file(task) -> FileReport:
+    """Worker: parses, allocates and writes one file. Errors are reported
+    instead of raised so they never take down the pool.
+    """
+    path, out_base, ks, algorithm, cache_dir, cache_bytes, schedule = task
+    try:
+        tic = time.perf_counter()
+        block = alloc.read_block(path)
+        if cache_dir:
+            cache = AllocationCache(cache_dir, cache_bytes)
+            allocator = CachedAlloc(cache, algorithm, block)
+        else:
+            cache = None
+            allocator = alloc.make_allocator(algorithm, block)
+        os.makedirs(os.path.dirname(out_base) or '.', exist_ok=True)
+
+        loads = stores = 0
+        for k, result, _ in allocator.allocate_many(ks):
+            if schedule:
+                result = iloc_sched.schedule(result)
+            name = f"{out_base}.i" if len(ks) == 1 else f"{out_base}.k{k}.i"
+            with open(name, 'w') as out:
+                for i in result:
+                    print(i, file=out)
+            _, k_loads, k_stores = spill_summary(block, result)
+            loads += k_loads
+            stores += k_stores
+
+        ms = (time.perf_counter() - tic) * 1000
+        if cache is None:
+            return FileReport(path, len(block), loads, stores, ms)
+        return FileReport(
+            path, len(block), loads, stores, ms, cache.hits, cache.misses
+        )
+    except Exception as e:
+        return FileReport(path, error=f"{type(e).__name__}: {e}")
+
+
+def run_batch(spec, ks, algorithm, output_dir, jobs=None, cache_dir=None,
+              cache_bytes=MAX_BYTES, schedule=False) -> List[FileReport]:
+    """Allocates every file named by spec with up to jobs worker processes
+    and prints a report. Reports come back in input order, whatever order
+    the workers finish in. Workers share the allocation cache in cache_dir,
+    if given. With schedule the results are list scheduled as well.
+    """
+    files = collect_files(spec)
+    if not files:
+        raise ValueError(f"no ILOC files found for '{spec}'.")
+
+    tasks = [
+        (f, out, ks, algorithm, cache_dir, cache_bytes, schedule)
+        for f, out in zip(files, output_paths(files, spec, output_dir))
+    ]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        reports = list(pool.map(allocate_file, tasks, chunksize=4))
+
+    print_report(reports)
+    return reports
+
+
+def print_report(reports):
+    print("|file|", "|instructions|", "|loads|", "|stores|", "|ms|", sep='\t')
+    for r in reports:
+        if r.error:
+            print(r.path, f"FAILED {r.error}", sep='\t')
+        else:
+            print(r.path, r.instructions, r.loads, r.stores, f"{r.ms:.2f}", sep='\t')
+
+    ok = [r for r in reports if not r.error]
+    print(
+        f"{len(ok)} of {len(reports)} files allocated,",
+        f"{sum(r.instructions for r in ok)} instructions,",
+        f"{sum(r.loads for r in ok)} loads and",
+        f"{sum(r.stores for r in ok)} stores inserted."
+    )
+    hits, misses = sum(r.hits for r in ok), sum(r.misses for r in ok)
+    if hits + misses:
+        rate = hits / (hits + misses)
+        print(f"cache: {hits} hits, {misses} misses ({rate:.0%} hit rate)")
@@ -0,0 +1,484 @@
+"""Allocator benchmarks on synthetic straight-line ILOC blocks.
+
+    python bench.py bottom-up [--size N] [--pressure P]
+    python bench.py suite [--sizes N,..] [--ks K,..] [--json FILE] [--baseline FILE]
+    python bench.py coloring [--sizes N,..] [--pressures P,..] [--ks K,..]
+    python bench.py exact [--sizes N,..] [--pressures P,..] [--ks K,..] [--budget S]
+    python bench.py liveness [--sizes N,..] [--pressure P]
+    python bench.py parse [--sizes N,..] [--pressure P]
+    python bench.py server [--sizes N,..] [--pressure P] [--ks K] [--repeat R]
+
+The suite allocates every generated block with each allocator across a
+grid of register counts and records wall time, peak memory, inserted
+spill instructions and simulated cycles. Results are saved as JSON and
+compared against a baseline, flagging regressions.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import alloc
+import iloc_sim
+from alloc_utils import Liveness, np, spill_summary
+from iloc_ir import OPCODE_ID, OP1_CONST, OP2_CONST, LOADI, STORE, Block
+
+
+BASELINE = 'bench_baseline.json'
+REFERENCE = 's'     # allocator the suite's timings are relative to
+
+OPERATIONS = [OPCODE_ID[op] for op in ('add', 'sub', 'mult')]
+IMMEDIATES = [OPCODE_ID[op] for op in ('addI', 'subI', 'multI')]
+OUTPUT = OPCODE_ID['output']
+
+
+def equal_ranges(rnd, pressure):
+    return pressure
+
+
+def uniform_ranges(rnd, pressure):
+    return rnd.randint(1, 2 * pressure - 1)
+
+
+def geometric_ranges(rnd, pressure):
+    return 1 + int(rnd.expovariate(1 / pressure))
+
+
+def pareto_ranges(rnd, pressure):
+    #many short ranges and a few very long ones, with mean pressure
+    return max(1, int(rnd.paretovariate(1.5) * pressure / 3))
+
+
+#live range length distributions, each with mean pressure
+RANGES = {
+    'equal': equal_ranges, 'uniform': uniform_ranges,
+    'geometric': geometric_ranges, 'pareto': pareto_ranges,
+}
+
+
+def make_block(size, pressure, seed=0, ranges='geometric', constants=0.0) -> Block:
+    """Returns a block of size operations keeping about pressure values live.
+
+    Every operation defines a value whose live range length is drawn from
+    the ranges distribution; the value is read one last time when its range
+    ends, other operands are random live values. A constants fraction of
+    the operations use an immediate operand instead. Values still live at
+    the end are stored to r0 and output one at a time, so simulating the
+    block checks every one of them. r0 points past the largest possible
+    spill frame.
+    """
+    rnd = random.Random(seed)
+    length = RANGES[ranges]
+    block = Block([f'r{j}' for j in range(size + 1)])
+    emit = block.append
+
+    base = 1024 + 12 * (size + 1)  # room for three spills per operation
+    emit(LOADI, base, dst=0, const=OP1_CONST)
+
+    live, pos = [], {}   # live values, indexable for random picks
+    deaths = []           # heap of (instruction its range ends at, value)
+    def kill(vr):
+        last = live.pop()
+        if last != vr:
+            live[pos[vr]] = last
+            pos[last] = pos[vr]
+        del pos[vr]
+
+    for vr in range(1, size + 1):
+        due = []
+        while deaths and deaths[0][0] <= vr and len(due) < 2:
+            due.append(heapq.heappop(deaths)[1])
+        for v in due:
+            kill(v)
+
+        if rnd.random() < constants or not live and len(due) < 2:
+            if due:
+                emit(rnd.choice(IMMEDIATES), due[0], rnd.randint(1, 9), vr, OP2_CONST)
+                for v in due[1:]: # keep it live until the next operation
+                    heapq.heappush(deaths, (vr + 1, v))
+                    pos[v] = len(live)
+                    live.append(v)
+            else:
+                emit(LOADI, rnd.randint(-99, 99), dst=vr, const=OP1_CONST)
+        else:
+            while len(due) < 2:
+                due.append(rnd.choice(live))
+            emit(rnd.choice(OPERATIONS), due[0], due[1], vr)
+
+        heapq.heappush(deaths, (vr + length(rnd, pressure), vr))
+        pos[vr] = len(live)
+        live.append(vr)
+
+    for _, vr in sorted(deaths):
+        emit(STORE, vr, 0)
+        emit(OUTPUT, base, const=OP1_CONST)
+
+    return block
+
+
+def time_allocation(Allocator, block, k, repeat=5):
+    """Best wall time in ms of Allocator(block).allocate(k) and its result."""
+    best = float('inf')
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = Allocator(block).allocate(k)
+        toc = time.perf_counter()
+        best = min(best, (toc - tic) * 1000)
+
+    return best, result
+
+
+def peak_memory(Allocator, block, k) -> int:
+    """Peak KiB traced while analyzing and allocating block."""
+    tracemalloc.start()
+    try:
+        Allocator(block).allocate(k)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_bottom_up(size, pressure):
+    """Scaling of BottomUpAlloc with the size of the register file."""
+    block = make_block(size, pressure)
+    print(f"BottomUpAlloc, {len(block)} instructions, {pressure} live values")
+    print("|k|", "|ms|", "|us/instr|", "|spill code|", sep='\t')
+    k = 8
+    while k <= 256:
+        ms, result = time_allocation(alloc.BottomUpAlloc, block, k)
+        us = ms * 1000 / len(block)
+        _, loads, stores = spill_summary(block, result)
+        print(k, f'{ms:.1f}', f'{us:.2f}', loads + stores, sep='\t')
+        k *= 2
+
+
+def bench_coloring(sizes, pressures, constants, ks, repeat=3):
+    """GraphColoringAlloc against LinearScanAlloc on the suite's blocks."""
+    print("|block|", "|k|", "|coloring ms|", "|linear scan ms|", "|coloring spill code|",
+          "|linear scan spill code|", "|coloring cycles|", "|linear scan cycles|",
+          "|rounds|", sep='\t')
+    for size, pressure in itertools.product(sizes, pressures):
+        block = make_block(size, pressure, constants=constants)
+        memory_size = block.op1[0] + 4
+        for k in ks:
+            row = []
+            for Allocator in (alloc.GraphColoringAlloc, alloc.LinearScanAlloc):
+                ms, result = time_allocation(Allocator, block, k, repeat)
+                _, loads, stores = spill_summary(block, result)
+                cycles = iloc_sim.run(result, memory_size=memory_size).cycles
+                row.append((f'{ms:.1f}', loads + stores, cycles))
+            coloring = alloc.GraphColoringAlloc(block)
+            coloring.allocate(k)
+            print(f"n{size}-p{pressure}", k, *(x for column in zip(*row) for x in column),
+                  coloring.rounds, sep='\t', flush=True)
+
+
+def bench_liveness(sizes, pressure, repeat=3):
+    """Liveness of ever larger blocks, scanned in Python and with NumPy."""
+    print("|instructions|", "|python ms|", "|numpy ms|", "|max pressure|", sep='\t')
+    for size in sizes:
+        block = make_block(size, pressure)
+        row = []
+        for vectorized in (False, True) if np is not None else (False,):
+            best = float('inf')
+            for _ in range(repeat):
+                tic = time.perf_counter()
+                live = Liveness(block, vectorized)
+                best = min(best, time.perf_counter() - tic)
+            row.append(f'{best * 1000:.1f}')
+        if np is None:
+            row.append('-')
+        print(len(block), *row, live.max_pressure, sep='\t', flush=True)
+
+
+def bench_parse(sizes, pressure, repeat=3):
+    """Parse throughput and peak memory of read_block against encoding the
+    Instructions of parse_lines, on generated blocks with a fresh virtual
+    register per value and on their allocation to 16 registers.
+    """
+    readers = {
+        'read_block': alloc.read_block,
+        'parse_lines': lambda path: Block.encode(alloc.iter_instructions(path)),
+    }
+    print("|file|", "|MB|", *(f"|{name} MB/s|" for name in readers),
+          *(f"|{name} peak KiB|" for name in readers), "|columns KiB|", sep='\t')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            block = make_block(size, pressure)
+            allocated = alloc.BottomUpAlloc(block).allocate(16)
+            for kind, code in (('virtual', block), ('allocated', allocated)):
+                path = os.path.join(tmp, f'{kind}{size}.i')
+                with open(path, 'w') as f:
+                    f.writelines(f'{i}\n' for i in code)
+                mb = os.path.getsize(path) / 2 ** 20
+                speed, peak = [], []
+                for read in readers.values():
+                    best = float('inf')
+                    for _ in range(repeat):
+                        tic = time.perf_counter()
+                        read(path)
+                        best = min(best, time.perf_counter() - tic)
+                    speed.append(f'{mb / best:.1f}')
+                    tracemalloc.start()
+                    try:
+                        parsed = read(path)
+                        peak.append(tracemalloc.get_traced_memory()[1] // 1024)
+                    finally:
+                        tracemalloc.stop()
+                columns = sum(
+                    len(c) * c.itemsize for c in
+                    (parsed.opcode, parsed.op1, parsed.op2, parsed.dst, parsed.const)
+                )
+                print(f'{kind}-n{size}', f'{mb:.1f}', *speed, *peak, columns // 1024,
+                      sep='\t', flush=True)
+
+
+def bench_server(sizes, pressure, k, algorithm='b', repeat=20):
+    """Latency of allocating one block per call to `python alloc.py` against
+    starting `python alloc_client.py` per block and against requests over
+    one connection to a running alloc_server.py, in milliseconds per block.
+    """
+    from alloc_client import AllocClient
+    here = os.path.dirname(os.path.abspath(__file__))
+    print("|block|", "|alloc.py ms|", "|alloc_client.py ms|", "|connection ms|",
+          "|speedup|", sep='\t')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'alloc.sock')
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(here, 'alloc_server.py'),
+             '--socket', path, '-j', '1']
+        )
+        try:
+            while not os.path.exists(path):
+                if server.poll() is not None:
+                    sys.exit("alloc_server.py did not start.")
+                time.sleep(0.05)
+            with AllocClient(path) as client:
+                for size in sizes:
+                    block = make_block(size, pressure)
+                    name = os.path.join(tmp, f'n{size}.i')
+                    with open(name, 'w') as f:
+                        f.writelines(f'{i}\n' for i in block)
+                    with open(name) as f:
+                        code = f.read()
+                    commands = {
+                        'alloc.py': [os.path.join(here, 'alloc.py'), str(k), algorithm, name],
+                        'alloc_client.py': [
+                            os.path.join(here, 'alloc_client.py'),
+                            '--socket', path, str(k), algorithm, name
+                        ],
+                    }
+                    row = []
+                    for command in commands.values():
+                        tic = time.perf_counter()
+                        for _ in range(repeat):
+                            subprocess.run([sys.executable, *command], check=True,
+                                           stdout=subprocess.DEVNULL)
+                        row.append((time.perf_counter() - tic) * 1000 / repeat)
+                    client.allocate(code, k, algorithm) # warms up the worker
+                    tic = time.perf_counter()
+                    for _ in range(repeat):
+                        client.allocate(code, k, algorithm)
+                    row.append((time.perf_counter() - tic) * 1000 / repeat)
+                    print(f'n{size}-p{pressure}', *(f'{ms:.1f}' for ms in row),
+                          f'{row[0] / row[-1]:.1f}x', sep='\t', flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def bench_exact(sizes, pressures, constants, ks, algorithms, budget):
+    """Spill cost of the heuristic allocators against the ExactAlloc optimum,
+    in cycles and percent above it, n/a when the optimum costs nothing.
+    Searches that ran out of budget are marked, their cost is the
+    bottom-up one.
+    """
+    names = [alloc.ALLOCATORS[a].__name__ for a in algorithms]
+    print("|block|", "|k|", "|exact ms|", "|optimal|", "|exact cost|",
+          *(f"|{name}|" for name in names), sep='\t')
+    for size, pressure in itertools.product(sizes, pressures):
+        block = make_block(size, pressure, constants=constants)
+        for k in ks:
+            exact = alloc.ExactAlloc(block, budget)
+            exact.allocate(k)
+            row = []
+            for a in algorithms:
+                cost = alloc.spill_cost(block, alloc.ALLOCATORS[a](block).allocate(k))
+                if exact.cost:
+                    row.append(f"{cost} ({(cost - exact.cost) / exact.cost * 100:+.1f}%)")
+                else:
+                    row.append(f"{cost} (n/a)")
+            print(f"n{size}-p{pressure}", k, f"{exact.stats.ms:.0f}",
+                  'yes' if exact.optimal else 'no', exact.cost, *row, sep='\t', flush=True)
+
+
+def run_suite(sizes, pressures, ranges, constants, ks, algorithms, repeat=3):
+    """Allocates every generated block with every algorithm and k.
+
+    Returns one record per run: the block parameters, the algorithm, k,
+    the best of repeat wall times, that time relative to the REFERENCE
+    allocator's on the same block and k, the traced peak memory, the spill
+    instructions inserted and the simulated cycles.
+    """
+    records = []
+    grid = itertools.product(sizes, pressures, ranges, constants)
+    for size, pressure, distribution, density in grid:
+        block = make_block(size, pressure, ranges=distribution, constants=density)
+        name = f"n{size}-p{pressure}-{distribution}-c{density}"
+        memory_size = block.op1[0] + 4  # r0 and the final stores above it
+
+        reference = {}  # k -> ms of the REFERENCE allocator
+        for a, k in itertools.product(algorithms, ks):
+            Allocator = alloc.ALLOCATORS[a]
+            ms, result = time_allocation(Allocator, block, k, repeat)
+            if a == REFERENCE:
+                reference[k] = ms
+            elif k not in reference:
+                reference[k] = time_allocation(
+                    alloc.ALLOCATORS[REFERENCE], block, k, repeat
+                )[0]
+            _, loads, stores = spill_summary(block, result)
+            cycles = iloc_sim.run(result, memory_size=memory_size).cycles
+            records.append({
+                'block': name, 'algorithm': Allocator.__name__, 'k': k,
+                'instructions': len(block), 'ms': round(ms, 3),
+                'relative_ms': round(ms / reference[k], 3),
+                'peak_kib': peak_memory(Allocator, block, k),
+                'spill_instructions': loads + stores, 'cycles': cycles,
+            })
+            print_record(records[-1])
+
+    return records
+
+
+def print_record(r):
+    print(
+        r['block'], r['algorithm'], r['k'], f"{r['ms']:.1f}",
+        f"{r['relative_ms']:.2f}", r['peak_kib'],
+        r['spill_instructions'], r['cycles'], sep='\t', flush=True
+    )
+
+
+def compare(records, baseline, tolerance=0.5, min_ms=5.0):
+    """Regressions of records against baseline, as readable strings.
+
+    Spill instructions and cycles are deterministic and any increase is a
+    regression. Memory regresses when it exceeds the baseline by more than
+    tolerance. Time is compared relative to the REFERENCE allocator timed
+    in the same run, so baselines carry over between machines: it
+    regresses when that ratio exceeds the baseline's by more than
+    tolerance, ignoring slowdowns below min_ms.
+    """
+    key = lambda r: (r['block'], r['algorithm'], r['k'])
+    old = {key(r): r for r in baseline}
+    regressions = []
+    for r in records:
+        b = old.get(key(r))
+        if b is None:
+            continue
+        run = '{} {} k={}'.format(*key(r))
+        for metric in ('spill_instructions', 'cycles'):
+            if r[metric] > b[metric]:
+                regressions.append(f"{run}: {metric} {b[metric]} -> {r[metric]}")
+        #the baseline's ms scaled to this machine by the reference's time
+        expected = r['ms'] / r['relative_ms'] * b['relative_ms']
+        if (r['relative_ms'] > b['relative_ms'] * (1 + tolerance)
+                and r['ms'] - expected > min_ms):
+            regressions.append(
+                f"{run}: relative_ms {b['relative_ms']:.2f} -> {r['relative_ms']:.2f}"
+            )
+        if r['peak_kib'] > b['peak_kib'] * (1 + tolerance):
+            regressions.append(f"{run}: peak_kib {b['peak_kib']} -> {r['peak_kib']}")
+
+    return regressions
+
+
+def int_list(text):
+    return [int(x) for x in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='register allocator benchmarks')
+    parser.add_argument('benchmark', choices=[
+        'bottom-up', 'suite', 'coloring', 'exact', 'liveness', 'parse', 'server'
+    ])
+    parser.add_argument('--size', type=int, default=50000,
+                        help='number of instructions in the block')
+    parser.add_argument('--pressure', type=int, default=4096,
+                        help='number of simultaneously live values')
+    parser.add_argument('--sizes', type=int_list, default=[1000, 10000],
+                        help='suite, liveness, parse, server: comma separated block sizes')
+    parser.add_argument('--pressures', type=int_list, default=[16, 64],
+                        help='suite: comma separated register pressures')
+    parser.add_argument('--ranges', default='geometric,pareto',
+                        help='suite: comma separated live range distributions '
+                             f'out of {", ".join(RANGES)}')
+    parser.add_argument('--constants', type=float, default=0.2,
+                        help='suite: fraction of operations with an immediate')
+    parser.add_argument('--ks', type=int_list, default=[4, 8, 16, 32],
+                        help='suite: comma separated numbers of registers, '
+                             'server: the first one is used')
+    parser.add_argument('--algorithms', default='stbo',
+                        help='suite: allocators to run (default: stbo)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='suite: timed runs per allocation, the best is kept; '
+                             'server: calls per block')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='suite: relative slowdown or memory growth flagged '
+                             'as a regression (default: 0.5)')
+    parser.add_argument('--budget', type=float, default=10.0,
+                        help='exact: seconds of search per block and k (default: 10)')
+    parser.add_argument('--json', help='suite: save the results to this file')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE,
+                        help=f'suite: flag regressions against a results file '
+                             f'(default: {BASELINE})')
+    args = parser.parse_args()
+
+    if args.benchmark == 'bottom-up':
+        bench_bottom_up(args.size, args.pressure)
+        return
+    if args.benchmark == 'coloring':
+        bench_coloring(args.sizes, args.pressures, args.constants, args.ks, args.repeat)
+        return
+    if args.benchmark == 'liveness':
+        bench_liveness(args.sizes, args.pressure, args.repeat)
+        return
+    if args.benchmark == 'parse':
+        bench_parse(args.sizes, args.pressure, args.repeat)
+        return
+    if args.benchmark == 'server':
+        bench_server(args.sizes, args.pressure, args.ks[0], repeat=args.repeat)
+        return
+    if args.benchmark == 'exact':
+        bench_exact(args.sizes, args.pressures, args.constants, args.ks, 'bolg', args.budget)
+        return
+
+    print("|block|", "|algorithm|", "|k|", "|ms|", f"|x {REFERENCE}|", "|peak KiB|",
+          "|spill code|", "|cycles|", sep='\t')
+    records = run_suite(
+        args.sizes, args.pressures, args.ranges.split(','), [args.constants],
+        args.ks, args.algorithms, args.repeat
+    )
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(records, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(records, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""Control flow graphs, global liveness and allocation of ILOC programs with
+labels and branches.
+
+A program is cut into basic blocks at every label and after every jumpI or
+cbr; a block without a branch falls through to the next one. Liveness is
+solved over the graph with a worklist, one Python int per block serving as
+the bit vector of the registers live at its start or end.
+
+GlobalAlloc allocates every basic block on its own with one of the local
+allocators. A virtual register live across an edge has a home slot below
+the spill slots of the blocks: a block reloads it from there right before
+its first use and stores it right after its last definition. Every block
+thus finds the values it needs where the others left them, whatever order
+and whichever process they are allocated in.
+
+    allocator = GlobalAlloc(alloc.read_instructions('loop.i'), 'b', jobs=4)
+    result = allocator.allocate(5)
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import alloc
+from iloc_ir import (
+    NONE, OP1_CONST, OP2_CONST, DST_CONST, LABEL, JUMPI, CBR, LOADAI, STOREAI,
+    OPCODES, Block, Instruction, physical_names
+)
+
+
+BRANCHES = ('jumpI', 'cbr')
+HOME = -2 ** 30  # home slot offsets are HOME - 4 * n until the frame is known
+
+
+def has_branches(instructions) -> bool:
+    """Whether instructions contain labels or branches."""
+    if isinstance(instructions, Block):
+        return any(op in (LABEL, JUMPI, CBR) for op in set(instructions.opcode))
+    return any(i.opcode in ('label', 'jump') + BRANCHES for i in instructions)
+
+
+class CFG:
+    """Basic blocks of a program and the edges between them.
+
+    Block b is labeled labels[b] (None for none) and ends with branches[b]
+    (None when it falls through). Its other instructions are the rows
+    bounds[b] of code, which all blocks share so register ids are global;
+    a cbr is kept there as 'cbr r' so its register is read at the end.
+    """
+
+    def __init__(self, instructions) -> None:
+        if isinstance(instructions, Block):
+            instructions = instructions.decode()
+        self.labels, self.branches, starts, body = [None], [None], [0], []
+        def begin(label):
+            self.labels.append(label)
+            self.branches.append(None)
+            starts.append(len(body))
+
+        for i in instructions:
+            if i.opcode == 'label':
+                if self.labels[-1] is None and starts[-1] == len(body):
+                    self.labels[-1] = i.op1
+                else:
+                    begin(i.op1)
+            elif i.opcode in BRANCHES:
+                if i.opcode == 'cbr':
+                    body.append(Instruction('cbr', i.op1))
+                self.branches[-1] = i
+                begin(None)
+            elif i.opcode == 'jump':
+                raise ValueError("indirect jumps are not supported.")
+            else:
+                body.append(i)
+        #nothing falls through into the empty block after a final branch
+        if len(starts) > 1 and self.labels[-1] is None and starts[-1] == len(body):
+            self.labels.pop()
+            self.branches.pop()
+            starts.pop()
+        self.bounds = list(zip(starts, starts[1:] + [len(body)]))
+
+        self.code = Block.encode(body)
+        self.index = {}
+        for b, label in enumerate(self.labels):
+            if label in self.index:
+                raise ValueError(f"label '{label}' is defined twice.")
+            if label is not None:
+                self.index[label] = b
+        self.succ = [self._targets(b) for b in range(len(self))]
+        self.pred = [[] for _ in range(len(self))]
+        for b, targets in enumerate(self.succ):
+            for s in targets:
+                self.pred[s].append(b)
+
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+
+    def _targets(self, b) -> List[int]:
+        branch = self.branches[b]
+        if branch is None:
+            return [b + 1] if b + 1 < len(self) else []
+        labels = [branch.op1] if branch.opcode == 'jumpI' else [branch.op2, branch.dst]
+        for label in labels:
+            if label not in self.index:
+                raise ValueError(f"branch to undefined label '{label}'.")
+        return sorted({self.index[label] for label in labels})
+
+
+    def body(self, b) -> Block:
+        """Instructions of block b with the register ids of code."""
+        lo, hi = self.bounds[b]
+        block = Block()
+        block.names, block.ids = self.code.names, self.code.ids
+        for column in ('opcode', 'op1', 'op2', 'dst', 'const'):
+            getattr(block, column).extend(getattr(self.code, column)[lo:hi])
+        return block
+
+
+    def postorder(self) -> List[int]:
+        """Blocks in postorder of a depth first search from the entry,
+        followed by those it does not reach.
+        """
+        order, seen = [], [False] * len(self)
+        for root in range(len(self)):
+            if seen[root]:
+                continue
+            seen[root] = True
+            stack = [(root, iter(self.succ[root]))]
+            while stack:
+                b, targets = stack[-1]
+                for s in targets:
+                    if not seen[s]:
+                        seen[s] = True
+                        stack.append((s, iter(self.succ[s])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(b)
+        return order
+
+
+def uses(block, lo=0, hi=None) -> tuple:
+    """Bit vectors of the registers the rows [lo, hi) of block read before
+    defining them and of those they define.
+    """
+    gen = kill = 0
+    rows = zip(block.op1[lo:hi], block.op2[lo:hi], block.dst[lo:hi], block.const[lo:hi])
+    for op1, op2, dst, const in rows:
+        if op1 != NONE and not const & OP1_CONST and not kill >> op1 & 1:
+            gen |= 1 << op1
+        if op2 != NONE and not const & OP2_CONST and not kill >> op2 & 1:
+            gen |= 1 << op2
+        if dst != NONE and not const & DST_CONST:
+            kill |= 1 << dst
+    return gen, kill
+
+
+def liveness(cfg) -> tuple:
+    """Bit vectors of the registers live in and live out of every block,
+    bit r standing for register id r of cfg.code.
+    """
+    n = len(cfg)
+    gen, kill = zip(*(uses(cfg.code, lo, hi) for lo, hi in cfg.bounds)) if n else ((), ())
+    live_in, live_out = [0] * n, [0] * n
+
+    #a block is revisited when the start of a successor changes; in
+    #postorder successors mostly come first
+    worklist = deque(cfg.postorder())
+    queued = [True] * n
+    while worklist:
+        b = worklist.popleft()
+        queued[b] = False
+        out = 0
+        for s in cfg.succ[b]:
+            out |= live_in[s]
+        live_out[b] = out
+        start = gen[b] | out & ~kill[b]
+        if start != live_in[b]:
+            live_in[b] = start
+            for p in cfg.pred[b]:
+                if not queued[p]:
+                    queued[p] = True
+                    worklist.append(p)
+    return live_in, live_out
+
+
+def bits(vector):
+    """Positions of the bits set in vector."""
+    while vector:
+        low = vector & -vector
+        yield low.bit_length() - 1
+        vector ^= low
+
+
+def _allocate_region(task) -> Block:
+    """Worker: allocates the code of one basic block."""
+    algorithm, options, code, k = task
+    return alloc.ALLOCATORS[algorithm](code, **options).allocate(k)
+
+
+class GlobalAlloc(alloc.BaseAlloc):
+    """Allocates a program with branches one basic block at a time with
+    ALLOCATORS[algorithm](block, **options), in jobs worker processes or,
+    for jobs=1, in this one. None uses a process per CPU.
+    """
+
+    @alloc.analysis
+    def __init__(self, instructions, algorithm='b', jobs=1, **options) -> None:
+        self.instructions = Block.encode(instructions)
+        self.algorithm = algorithm
+        self.options = options
+        self.jobs = jobs
+        self.cfg = cfg = CFG(self.instructions)
+        self.live_in, self.live_out = liveness(cfg)
+
+        vbp = cfg.code.bp
+        self.homes = {}
+        self.regions = [self._reconcile(b, vbp) for b in range(len(cfg))]
+
+
+    def _reconcile(self, b, vbp) -> Block:
+        """Code of block b reloading its live in registers from their homes
+        before their first use and storing its live out ones after their
+        last definition. Registers defined more than once are renamed, as
+        the local allocators expect every value to have a name of its own.
+        """
+        body = self.cfg.body(b)
+        names = body.names
+        live_in, live_out = self.live_in[b], self.live_out[b]
+        seen, last, reload = set(), {}, set()
+        for j, (op1, op2, dst, const) in enumerate(
+            zip(body.op1, body.op2, body.dst, body.const)
+        ):
+            for reg, bit in ((op1, OP1_CONST), (op2, OP2_CONST)):
+                if reg != NONE and not const & bit and reg not in seen:
+                    seen.add(reg)
+                    if live_in >> reg & 1 and reg != vbp:
+                        reload.add(reg)
+            if dst != NONE and not const & DST_CONST:
+                seen.add(dst)
+                last[dst] = j
+
+        code = []
+        current = {}    # vr -> name of its value at this point
+        def use(reg, const, bit):
+            if reg == NONE or const & bit:
+                return body.field(reg, const, bit)
+            return current.get(reg, names[reg])
+
+        for j, (opcode, op1, op2, dst, const) in enumerate(body.rows()):
+            for reg, bit in ((op1, OP1_CONST), (op2, OP2_CONST)):
+                if not const & bit and reg in reload and reg not in current:
+                    current[reg] = names[reg]
+                    code.append(Instruction('loadAI', 'r0', str(self._home(reg)), names[reg]))
+            fields = [use(op1, const, OP1_CONST), use(op2, const, OP2_CONST)]
+            if dst == NONE or const & DST_CONST or dst == vbp:
+                code.append(Instruction(OPCODES[opcode], *fields, use(dst, const, DST_CONST)))
+                continue
+            current[dst] = f'{names[dst]}.{j}' if dst in current else names[dst]
+            code.append(Instruction(OPCODES[opcode], *fields, current[dst]))
+            if last[dst] == j and live_out >> dst & 1:
+                code.append(Instruction('storeAI', current[dst], 'r0', str(self._home(dst))))
+        return Block.encode(code)
+
+
+    def _home(self, vr) -> int:
+        """Placeholder offset of the home slot of vr."""
+        n = self.homes.setdefault(vr, len(self.homes))
+        return HOME - 4 * n
+
+
+    @alloc.instrumented
+    def allocate(self, k):
+        tasks = [(self.algorithm, self.options, region, k) for region in self.regions]
+        with self.stats.phase('assign'):
+            if self.jobs == 1 or len(tasks) < 2:
+                results = list(map(_allocate_region, tasks))
+            else:
+                jobs = self.jobs or os.cpu_count()
+                with ProcessPoolExecutor(jobs) as pool:
+                    results = list(pool.map(
+                        _allocate_region, tasks,
+                        chunksize=max(1, len(tasks) // (4 * jobs))
+                    ))
+
+        with self.stats.phase('rewrite'):
+            self.result = self._assemble(results, k)
+        return self.result
+
+
+    def _assemble(self, results, k) -> Block:
+        """Joins the allocated blocks with their labels and branches, moving
+        the home slots below the deepest spill slot of any block.
+        """
+        def slots(code):
+            for j, op in enumerate(code.opcode):
+                if op == LOADAI and code.op1[j] == alloc.BP:
+                    yield code.op2, j
+                elif op == STOREAI and code.op2[j] == alloc.BP:
+                    yield code.dst, j
+
+        frame = 0
+        for code in results:
+            for column, j in slots(code):
+                if HOME // 2 < column[j] < 0:
+                    frame = max(frame, -column[j])
+
+        result = Block(physical_names(k))
+        for b, code in enumerate(results):
+            for column, j in slots(code):
+                if column[j] <= HOME // 2:
+                    column[j] = -frame - 4 - (HOME - column[j])
+
+            label, branch = self.cfg.labels[b], self.cfg.branches[b]
+            if label is not None:
+                result.append(LABEL, result.intern(label))
+            for column in ('opcode', 'op1', 'op2', 'dst', 'const'):
+                getattr(result, column).extend(getattr(code, column))
+            if branch is None:
+                continue
+            if branch.opcode == 'jumpI':
+                result.append(JUMPI, result.intern(branch.op1))
+            else:
+                result.op2[-1] = result.intern(branch.op2)
+                result.dst[-1] = result.intern(branch.dst)
+        return result
+
+
+    def report(self) -> str:
+        return (
+            f"global: {len(self.cfg)} basic blocks, {len(self.homes)} registers "
+            f"live across their edges, k={self.stats.k}"
+        )
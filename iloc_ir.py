@@ -0,0 +1,265 @@
+from array import array
+from typing import List, NamedTuple
+
+
+NONE = -1  # marks an empty operand slot
+
+# bit flags marking which operand slots hold integer constants
+OP1_CONST = 1
+OP2_CONST = 2
+DST_CONST = 4
+
+OPCODES = [
+    'nop', 'add', 'sub', 'mult', 'div', 'addI', 'subI', 'multI', 'divI',
+    'lshift', 'lshiftI', 'rshift', 'rshiftI', 'and', 'andI', 'or', 'orI',
+    'xor', 'xorI', 'loadI', 'load', 'loadAI', 'loadAO', 'cload', 'cloadAI',
+    'cloadAO', 'store', 'storeAI', 'storeAO', 'cstore', 'cstoreAI',
+    'cstoreAO', 'i2i', 'c2c', 'c2i', 'i2c', 'output', 'outputAI',
+    'cmp_LT', 'cmp_LE', 'cmp_EQ', 'cmp_GE', 'cmp_GT', 'cmp_NE', 'label',
+    'jumpI', 'jump', 'cbr',
+]
+OPCODE_ID = {name: i for i, name in enumerate(OPCODES)}
+
+LOADI = OPCODE_ID['loadI']
+LOAD = OPCODE_ID['load']
+LOADAI = OPCODE_ID['loadAI']
+STORE = OPCODE_ID['store']
+STOREAI = OPCODE_ID['storeAI']
+I2I = OPCODE_ID['i2i']
+LABEL = OPCODE_ID['label']
+JUMPI = OPCODE_ID['jumpI']
+CBR = OPCODE_ID['cbr']
+
+
+class Instruction(NamedTuple):
+    opcode: str     # instruction name
+    op1: str        # first operand: virtual register or integer constant
+    op2: str = None # second operand: virtual register/None/integer constant
+    dst: str = None # destination register
+
+    @property
+    def operands(self):
+        return (self.op1, self.op2)
+
+
+    def __str__(self) -> str:
+        if self.opcode == 'storeAI':
+            return f'{self.opcode}\t{self.op1}\t=> {self.op2}, {self.dst}'
+
+        if self.opcode == 'store':
+            return f'{self.opcode}\t{self.op1}\t=> {self.op2}'
+
+        if self.opcode == 'output':
+            return f'{self.opcode}\t{self.op1}'
+
+        if self.opcode == 'outputAI':
+            return f'{self.opcode} {self.op1}, {self.dst}'
+
+        if self.opcode == 'nop':
+            return self.opcode
+
+        if self.opcode == 'label':
+            return f'{self.op1}:\tnop'
+
+        if self.opcode in ('jumpI', 'jump'):
+            return f'{self.opcode}\t-> {self.op1}'
+
+        if self.opcode == 'cbr':
+            return f'{self.opcode}\t{self.op1}\t-> {self.op2}, {self.dst}'
+
+        if self.op2 is None: #regular 2 argument instruction
+            return f'{self.opcode}\t{self.op1}\t=> {self.dst}'
+        #regular 3 argument instructions
+        return f'{self.opcode}\t{self.op1}, {self.op2}\t=> {self.dst}'
+
+
+def opcode_id(name) -> int:
+    """Returns the id of an opcode, interning names outside the ILOC table."""
+    try:
+        return OPCODE_ID[name]
+    except KeyError:
+        OPCODE_ID[name] = len(OPCODES)
+        OPCODES.append(name)
+        return OPCODE_ID[name]
+
+
+def isconstant(string) -> bool:
+    return string.lstrip('-').isdigit()
+
+
+def constant(string) -> int:
+    """The value of a constant token, which must fit a Block column."""
+    value = int(string)
+    if not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError(f"constant {string} does not fit in 64 bits.")
+    return value
+
+
+def physical_names(k) -> List[str]:
+    """Register names r0..rk, indexed by physical register number."""
+    return [f'r{j}' for j in range(k + 1)]
+
+
+class Block:
+    """Integer encoded straight-line ILOC code.
+
+    Every instruction field lives in its own typed column: opcode ids,
+    and for op1, op2 and dst either a register id, an integer constant or
+    NONE. Bit i of const marks field i as a constant, which may be any
+    64 bit integer. Register ids index names, which for allocator output
+    are simply the physical registers.
+    """
+    __slots__ = (
+        'opcode', 'op1', 'op2', 'dst', 'const', 'names', 'ids', '__weakref__'
+    )
+
+    def __init__(self, names=None) -> None:
+        self.opcode = array('H')
+        self.op1 = array('q')
+        self.op2 = array('q')
+        self.dst = array('q')
+        self.const = array('B')
+        self.names = [] if names is None else names
+        self.ids = {name: i for i, name in enumerate(self.names)}
+
+
+    def __len__(self) -> int:
+        return len(self.opcode)
+
+
+    @property
+    def bp(self) -> int:
+        """register id of the base pointer r0, NONE if it is never used."""
+        return self.ids.get('r0', NONE)
+
+
+    def intern(self, name) -> int:
+        """Returns the id of register name, assigning the next free id to
+        names seen for the first time.
+        """
+        reg = self.ids.get(name)
+        if reg is None:
+            reg = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return reg
+
+
+    def append(self, opcode, op1=NONE, op2=NONE, dst=NONE, const=0):
+        self.opcode.append(opcode)
+        self.op1.append(op1)
+        self.op2.append(op2)
+        self.dst.append(dst)
+        self.const.append(const)
+
+
+    def add(self, instruction):
+        """Encodes and appends an Instruction."""
+        block = Block.encode([instruction], self.names)
+        self.append(
+            block.opcode[0], block.op1[0], block.op2[0], block.dst[0],
+            block.const[0]
+        )
+
+
+    @classmethod
+    def encode(cls, instructions, names=None) -> 'Block':
+        """Builds a Block out of Instructions. Blocks are returned as is.
+
+        Every distinct token is classified and interned only once, the
+        columns are then packed in bulk. Constants that do not fit a column
+        are reported with the index of their instruction.
+        """
+        if isinstance(instructions, cls):
+            return instructions
+
+        block = cls(names)
+        codes = {None: (NONE, 0)}  # token -> (value, is constant)
+        def code(token):
+            if isconstant(token):
+                try:
+                    codes[token] = constant(token), 1
+                except ValueError as e:
+                    #the instruction being encoded is the next one appended
+                    raise ValueError(f"instruction {len(opcodes)}: {e}") from None
+            else:
+                codes[token] = block.intern(token), 0
+            return codes[token]
+
+        opcodes, op1, op2, dst, const = [], [], [], [], []
+        for name, a, b, d in instructions:
+            a, a_const = codes.get(a) or code(a)
+            b, b_const = codes.get(b) or code(b)
+            d, d_const = codes.get(d) or code(d)
+            opcodes.append(OPCODE_ID.get(name) or opcode_id(name))
+            op1.append(a)
+            op2.append(b)
+            dst.append(d)
+            const.append(a_const | b_const << 1 | d_const << 2)
+
+        block.opcode = array('H', opcodes)
+        block.op1 = array('q', op1)
+        block.op2 = array('q', op2)
+        block.dst = array('q', dst)
+        block.const = array('B', const)
+        return block
+
+
+    def rows(self):
+        """Iterates (opcode, op1, op2, dst, const) tuples of every instruction.
+        """
+        return zip(self.opcode, self.op1, self.op2, self.dst, self.const)
+
+
+    def registers(self, j):
+        """Yields the register ids referenced by instruction j in field order.
+        """
+        const = self.const[j]
+        for bit, value in (
+            (OP1_CONST, self.op1[j]), (OP2_CONST, self.op2[j]),
+            (DST_CONST, self.dst[j])
+        ):
+            if value != NONE and not const & bit:
+                yield value
+
+
+    def field(self, value, const, bit):
+        if const & bit:
+            return str(value)
+        if value == NONE:
+            return None
+        return self.names[value]
+
+
+    def instruction(self, j) -> Instruction:
+        const = self.const[j]
+        return Instruction(
+            OPCODES[self.opcode[j]],
+            self.field(self.op1[j], const, OP1_CONST),
+            self.field(self.op2[j], const, OP2_CONST),
+            self.field(self.dst[j], const, DST_CONST),
+        )
+
+
+    def __iter__(self):
+        """Lazily decodes the block, one Instruction at a time."""
+        names = self.names + [None] # NONE indexes the trailing None
+        def column(values, bit):
+            return (
+                str(v) if c & bit else names[v]
+                for v, c in zip(values, self.const)
+            )
+
+        return map(Instruction._make, zip(
+            (OPCODES[op] for op in self.opcode),
+            column(self.op1, OP1_CONST),
+            column(self.op2, OP2_CONST),
+            column(self.dst, DST_CONST),
+        ))
+
+
+    def __getitem__(self, j) -> Instruction:
+        return self.instruction(j)
+
+
+    def decode(self) -> List[Instruction]:
+        return list(self)
@@ -0,0 +1,221 @@
+"""List scheduling of allocated ILOC code.
+
+Allocators place spill code right before the instruction it serves, so a
+loadAI issues one cycle before its value is read and the in-order machine
+of iloc_sim stalls for the rest of its latency. schedule() reorders the
+code between labels and branches to hide that: it builds a dependence DAG
+and list schedules it by critical path, issuing the highest instruction
+whose operands are ready, or whichever gets ready first when none is.
+
+    result = schedule(BottomUpAlloc(instructions).allocate(5))
+
+Registers are not renamed. Every instruction stays after the reads of the
+register it overwrites, so a load moves up only as far as its register is
+free and the code never needs more registers than the allocation had.
+
+The machine stalls for operands and for loads of bytes a store in flight
+writes, not for the write a register still waits for: an instruction
+overwriting the result of a longer one, which nothing read, is kept
+behind it by as many instructions as it has to trail it, with a nop
+filling the gap when nothing else can.
+
+Memory dependences are conservative but for spill slots: accesses through
+r0 with a negative constant offset, the frame the allocators spill to,
+only depend on accesses to the same bytes of it. Any other load depends on
+the last store, and any other store on the last store and every load
+since. Outputs stay in order.
+"""
+import heapq
+from collections import defaultdict
+
+from alloc_utils import CONTROL, MEMORY_WRITES, NO_DEFINITION
+from iloc_ir import NONE, OP1_CONST, OP2_CONST, DST_CONST, OPCODE_ID, OPCODES, Block
+import iloc_sim
+
+
+MEMORY_READS = frozenset(OPCODE_ID[op] for op in (
+    'load', 'loadAI', 'loadAO', 'cload', 'cloadAI', 'cloadAO', 'output', 'outputAI'
+))
+FRAME_OPS = frozenset(OPCODE_ID[op] for op in ('loadAI', 'storeAI', 'cloadAI', 'cstoreAI'))
+OUTPUTS = frozenset(OPCODE_ID[op] for op in ('output', 'outputAI'))
+NOP = OPCODE_ID['nop']
+BYTE_OPS = frozenset(OPCODE_ID[op] for op in (
+    'cload', 'cloadAI', 'cloadAO', 'cstore', 'cstoreAI', 'cstoreAO'
+))
+
+
+def latencies(latency=None) -> list:
+    """Latency of every opcode id, from a dict of opcode names to cycles
+    defaulting to those of iloc_sim.
+    """
+    latency = iloc_sim.LATENCY if latency is None else latency
+    return [latency.get(name, 1) for name in OPCODES]
+
+
+class DependenceGraph:
+    """Dependence DAG of the instructions lo..hi - 1 of a Block, none of
+    them a label or branch. succs[n] lists (successor, cycles) pairs, the
+    successor of node n = j - lo having to issue at least that many cycles
+    after it; height[n] is the length of the critical path from n on.
+    spaced[n] lists the (successor, instructions) pairs the machine would
+    not wait for by itself, which have to be that many instructions apart.
+    """
+    def __init__(self, block, lo, hi, cycles) -> None:
+        m = hi - lo
+        self.succs = succs = [[] for _ in range(m)]
+        self.preds = preds = [0] * m
+        self.spaced = spaced = [[] for _ in range(m)]
+        bp = block.bp
+        last_def = {}                       # register -> node defining it
+        reads = defaultdict(list)           # register -> nodes reading it since
+        frame_store = {}                    # frame byte -> node storing it
+        frame_loads = defaultdict(list)     # frame byte -> nodes loading it since
+        last_store, loads = None, []
+        last_output = None
+
+        def edge(a, b, w):
+            succs[a].append((b, w))
+            preds[b] += 1
+
+        rows = zip(
+            range(m), block.opcode[lo:hi], block.op1[lo:hi], block.op2[lo:hi],
+            block.dst[lo:hi], block.const[lo:hi]
+        )
+        for n, op, op1, op2, dst, const in rows:
+            used = [
+                reg for reg, bit in ((op1, OP1_CONST), (op2, OP2_CONST))
+                if reg != NONE and not const & bit
+            ]
+            defined = NONE
+            if dst != NONE and not const & DST_CONST:
+                if op in NO_DEFINITION:
+                    used.append(dst)
+                else:
+                    defined = dst
+            for reg in used:
+                if reg in last_def:
+                    edge(last_def[reg], n, cycles[block.opcode[lo + last_def[reg]]])
+                reads[reg].append(n)
+            if defined != NONE:
+                read = False
+                for r in reads.pop(defined, ()):
+                    read = True
+                    if r != n:
+                        edge(r, n, 1)
+                if defined in last_def:
+                    p = last_def[defined]
+                    w = cycles[block.opcode[lo + p]] - cycles[op] + 1
+                    edge(p, n, max(1, w))
+                    if w > 1 and not read: #a read would wait for p
+                        spaced[p].append((n, w))
+                last_def[defined] = n
+
+            if op in OUTPUTS: # printed in order
+                if last_output is not None:
+                    edge(last_output, n, 1)
+                last_output = n
+            store = op in MEMORY_WRITES
+            if not store and op not in MEMORY_READS:
+                continue
+            base, offset = (op2, dst) if store else (op1, op2)
+            if op in FRAME_OPS and base == bp and offset < 0:
+                size = 1 if op in BYTE_OPS else 4
+                for byte in range(offset, offset + size):
+                    if byte in frame_store:
+                        edge(frame_store[byte], n, cycles[block.opcode[lo + frame_store[byte]]])
+                    if store:
+                        for r in frame_loads.pop(byte, ()):
+                            edge(r, n, 1)
+                        frame_store[byte] = n
+                    else:
+                        frame_loads[byte].append(n)
+            elif store:
+                if last_store is not None:
+                    edge(last_store, n, 1)
+                for r in loads:
+                    edge(r, n, 1)
+                last_store, loads = n, []
+            else:
+                if last_store is not None:
+                    edge(last_store, n, cycles[block.opcode[lo + last_store]])
+                loads.append(n)
+
+        self.height = height = [0] * m
+        for n in range(m - 1, -1, -1):
+            h = cycles[block.opcode[lo + n]]
+            for s, w in succs[n]:
+                h = max(h, w + height[s])
+            height[n] = h
+
+
+    def order(self) -> list:
+        """List schedule of the nodes, in issue order, with None for a nop.
+        Ties go to the node coming first in the block.
+        """
+        succs, spaced, height = self.succs, self.spaced, self.height
+        preds = list(self.preds)
+        earliest = [0] * len(succs)
+        position = [0] * len(succs)     # first index of order a node may take
+        waiting = [(0, -height[n], n) for n in range(len(succs)) if not preds[n]]
+        heapq.heapify(waiting)
+        ready = []      # (-height, node) of nodes whose operands are ready
+        order = []
+        cycle = 0
+        while waiting or ready:
+            cycle += 1
+            if not ready and waiting[0][0] > cycle:
+                cycle = waiting[0][0]
+            while waiting and waiting[0][0] <= cycle:
+                _, h, n = heapq.heappop(waiting)
+                heapq.heappush(ready, (h, n))
+            held = []
+            while ready and position[ready[0][1]] > len(order):
+                held.append(heapq.heappop(ready))
+            if not ready:
+                for entry in held:
+                    heapq.heappush(ready, entry)
+                if not waiting:
+                    order.append(None)
+                continue
+            _, n = heapq.heappop(ready)
+            for entry in held:
+                heapq.heappush(ready, entry)
+            for s, w in spaced[n]:
+                position[s] = len(order) + w
+            order.append(n)
+            for s, w in succs[n]:
+                earliest[s] = max(earliest[s], cycle + w)
+                preds[s] -= 1
+                if not preds[s]:
+                    heapq.heappush(waiting, (earliest[s], -height[s], s))
+        return order
+
+
+def schedule(code, latency=None) -> Block:
+    """Returns code, a Block or Instructions, list scheduled between its
+    labels and branches. latency maps opcode names to their cycles, by
+    default those of iloc_sim. Code the schedule would not make faster,
+    according to iloc_sim.estimate_cycles, is returned unchanged.
+    """
+    block = Block.encode(code)
+    cycles = latencies(latency)
+    result = Block(list(block.names))
+    columns = (block.opcode, block.op1, block.op2, block.dst, block.const)
+    lo = 0
+    for hi in [j for j, op in enumerate(block.opcode) if op in CONTROL] + [len(block)]:
+        if hi - lo > 1:
+            order = DependenceGraph(block, lo, hi, cycles).order()
+        else:
+            order = range(hi - lo)
+        for n in order:
+            if n is None:
+                result.append(NOP)
+            else:
+                result.append(*(column[lo + n] for column in columns))
+        if hi < len(block):
+            result.append(*(column[hi] for column in columns))
+        lo = hi + 1
+
+    if iloc_sim.estimate_cycles(result) >= iloc_sim.estimate_cycles(block):
+        return block
+    return result
@@ -0,0 +1,380 @@
+"""In-process ILOC interpreter with the cycle model of the course simulator.
+
+The machine issues one instruction per cycle, in order. An instruction
+waits until its source registers are ready, and a load until stores in
+flight to any byte it reads have landed. Results, stores included, land
+after the latency of their opcode; when two writes to a register are in
+flight the one completing last wins. Memory is byte addressed with big
+endian words. Labels execute as nop, jumpI and cbr (taken when its
+register is not zero) take a cycle like other single cycle instructions.
+"""
+import argparse
+import operator
+import sys
+from collections import deque
+from typing import List, NamedTuple
+
+from iloc_ir import NONE, OPCODES, OP1_CONST, OP2_CONST, DST_CONST, LABEL, Block
+
+
+MEMORY_SIZE = 20000
+LIMIT = 10 ** 7     # instructions run executes before giving up
+INPUT_BASE = 1024  # address of the first -i value
+
+LATENCY = {
+    'load': 5, 'loadAI': 5, 'loadAO': 5, 'cload': 5, 'cloadAI': 5,
+    'cloadAO': 5, 'store': 5, 'storeAI': 5, 'storeAO': 5, 'cstore': 5,
+    'cstoreAI': 5, 'cstoreAO': 5, 'mult': 3, 'div': 3,
+}  # every other opcode takes a single cycle
+
+
+class SimulatorError(Exception):
+    pass
+
+
+class Result(NamedTuple):
+    outputs: List[int]
+    instructions: int
+    cycles: int
+
+    def __str__(self) -> str:
+        """Same text the simulator prints."""
+        return '\n'.join([str(v) for v in self.outputs] + [
+            f"Executed {self.instructions} instructions and "
+            f"{self.instructions} operations in {self.cycles} cycles."
+        ])
+
+
+def wrap(value) -> int:
+    """Truncates value to a signed 32 bit integer."""
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def char(value) -> int:
+    return ((value + 0x80) & 0xFF) - 0x80
+
+
+def divide(a, b) -> int:
+    if b == 0:
+        raise SimulatorError("Division by zero.")
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+ARITHMETIC = {
+    'add': operator.add, 'sub': operator.sub, 'mult': operator.mul,
+    'div': divide, 'lshift': lambda a, b: a << (b & 31),
+    'rshift': lambda a, b: a >> (b & 31), 'and': operator.and_,
+    'or': operator.or_, 'xor': operator.xor,
+}
+for name in list(ARITHMETIC):
+    ARITHMETIC[name + 'I'] = ARITHMETIC[name]
+for name, compare in (
+    ('LT', operator.lt), ('LE', operator.le), ('EQ', operator.eq),
+    ('GE', operator.ge), ('GT', operator.gt), ('NE', operator.ne),
+):
+    ARITHMETIC['cmp_' + name] = lambda a, b, compare=compare: int(compare(a, b))
+
+#kinds of instructions the interpreter dispatches on
+(NOP, ARITH, LOADI, LOAD, CLOAD, STORE, CSTORE, COPY, TOCHAR, OUTPUT, JUMP,
+ BRANCH) = range(12)
+
+KIND = {
+    'nop': NOP, 'label': NOP, 'jumpI': JUMP, 'cbr': BRANCH, 'loadI': LOADI,
+    'i2i': COPY, 'c2i': TOCHAR, 'i2c': TOCHAR, 'c2c': TOCHAR,
+    'output': OUTPUT, 'outputAI': OUTPUT,
+}
+for name in ARITHMETIC:
+    KIND[name] = ARITH
+for suffix in ('', 'AI', 'AO'):
+    KIND['load' + suffix] = LOAD
+    KIND['cload' + suffix] = CLOAD
+    KIND['store' + suffix] = STORE
+    KIND['cstore' + suffix] = CSTORE
+
+
+def opcode_table():
+    """(kind, latency, arithmetic function) of every opcode id, None for
+    opcodes the machine does not know.
+    """
+    table = []
+    for name in OPCODES:
+        kind = KIND.get(name)
+        if kind is None:
+            table.append(None)
+        else:
+            table.append((kind, LATENCY.get(name, 1), ARITHMETIC.get(name)))
+    return table
+
+
+def issue(kind, a, b, d, c, ready, cycle) -> int:
+    """Earliest cycle from cycle on at which every source register of an
+    instruction is ready.
+    """
+    if kind == OUTPUT:
+        if not c & OP1_CONST:
+            cycle = max(cycle, ready[a])
+    elif kind == STORE or kind == CSTORE:
+        for reg, bit in ((a, OP1_CONST), (b, OP2_CONST), (d, DST_CONST)):
+            if reg != NONE and not c & bit:
+                cycle = max(cycle, ready[reg])
+    else:
+        if a != NONE and not c & OP1_CONST:
+            cycle = max(cycle, ready[a])
+        if b != NONE and not c & OP2_CONST:
+            cycle = max(cycle, ready[b])
+    return cycle
+
+
+def run(code, inputs=(), base=INPUT_BASE, memory_size=MEMORY_SIZE,
+        limit=LIMIT) -> Result:
+    """Executes ILOC code, given as Instructions or a Block, with inputs
+    stored as consecutive words from base. Returns the output values, the
+    number of instructions executed and the cycle count. Code with loops
+    raises a SimulatorError once it executed limit instructions.
+    """
+    block = Block.encode(code)
+    table = opcode_table()
+    regs = [0] * len(block.names)
+    ready = [0] * len(block.names)  # cycle a register can be read
+    memory = bytearray(memory_size)
+    stores = deque()                # (cycle it lands, address, bytes)
+    pending = {}                    # byte address -> cycle its store lands
+
+    def address(addr, size):
+        if addr < 0 or addr + size > memory_size:
+            raise SimulatorError(f"Invalid memory address {addr} accessed.")
+        return addr
+
+    def read(addr, size, cycle, interlock):
+        """Issue cycle and value of a read, which waits for the stores in
+        flight to its first interlock bytes. Other stores are only seen
+        once they have landed.
+        """
+        for byte in range(addr, addr + interlock):
+            cycle = max(cycle, pending.get(byte, 0))
+        while stores and stores[0][0] <= cycle:
+            _, at, data = stores.popleft()
+            memory[at:at + len(data)] = data
+        return cycle, int.from_bytes(memory[addr:addr + size], 'big', signed=True)
+
+    for i, j in enumerate(inputs):
+        addr = address(base + 4 * i, 4)
+        memory[addr:addr + 4] = (int(j) & 0xFFFFFFFF).to_bytes(4, 'big')
+
+    #labels are interned like registers, their ids locate them in the code
+    rows = list(block.rows())
+    labels = {a: j for j, (op, a, *_) in enumerate(rows) if op == LABEL}
+    def target(label, n):
+        if label not in labels:
+            raise SimulatorError(f"instruction {n}: unknown label.")
+        return labels[label]
+
+    outputs = []
+    cycle = last = 0
+    pc = executed = 0
+    while pc < len(rows):
+        op, a, b, d, c = rows[pc]
+        n = pc + 1
+        pc += 1
+        executed += 1
+        if executed > limit:
+            raise SimulatorError(f"gave up after {limit} instructions.")
+        entry = table[op]
+        if entry is None:
+            raise SimulatorError(f"instruction {n}: unknown opcode.")
+        kind, latency, fn = entry
+
+        cycle = issue(kind, a, b, d, c, ready, cycle + 1)
+        if kind == JUMP or kind == BRANCH:
+            if kind == JUMP:
+                pc = target(a, n)
+            else:
+                pc = target(b if regs[a] else d, n)
+            last = max(last, cycle)
+            continue
+        elif kind == ARITH:
+            value = wrap(fn(regs[a], b if c & OP2_CONST else regs[b]))
+        elif kind == LOADI:
+            value = a
+        elif kind == COPY:
+            value = regs[a]
+        elif kind == TOCHAR:
+            value = char(regs[a])
+        elif kind == LOAD or kind == CLOAD:
+            addr = regs[a]
+            if c & OP2_CONST:
+                addr += b
+            elif b != NONE:
+                addr += regs[b]
+            size = 4 if kind == LOAD else 1
+            cycle, value = read(address(addr, size), size, cycle, size)
+        elif kind == STORE or kind == CSTORE:
+            if b == NONE:
+                addr = regs[d]  # cstore parses like 'i2i r1 => r2'
+            elif c & DST_CONST:
+                addr = regs[b] + d
+            else:
+                addr = regs[b] + (regs[d] if d != NONE else 0)
+            size = 4 if kind == STORE else 1
+            addr = address(addr, size)
+            data = (regs[a] & (1 << 8 * size) - 1).to_bytes(size, 'big')
+            stores.append((cycle + latency, addr, data))
+            for byte in range(addr, addr + size):
+                pending[byte] = cycle + latency
+            last = max(last, cycle + latency - 1)
+            continue
+        elif kind == OUTPUT:
+            addr = a if c & OP1_CONST else regs[a]
+            if c & DST_CONST:
+                addr += d
+            #output only waits for stores to the address it prints
+            cycle, value = read(address(addr, 4), 4, cycle, 1)
+            outputs.append(value)
+            last = max(last, cycle)
+            continue
+        else:
+            last = max(last, cycle)
+            continue
+
+        #the write completing last decides the final value of a register
+        done = cycle + latency
+        if done >= ready[d]:
+            regs[d] = value
+            ready[d] = done
+        last = max(last, done - 1)
+
+    return Result(outputs, executed, last)
+
+
+def estimate_cycles(code) -> int:
+    """Cycle count of code under the simulator's timing model, without
+    inputs or running it. Values are only tracked while they are constants,
+    in registers or stored to constant addresses; a memory access whose
+    address is not constant is assumed to depend on every store in flight,
+    and every access on stores to addresses that are not. The estimate is
+    exact when all addresses are constant, as for spill code relative to
+    r0. Branches are not taken, code is estimated as if it ran straight
+    through.
+    """
+    block = Block.encode(code)
+    table = opcode_table()
+    regs = [0] * len(block.names)      # None once a value is unknown
+    ready = [0] * len(block.names)
+    pending = {}                        # byte address -> cycle its store lands
+    unknown = 0                         # last store to an unknown address
+    latest = 0                          # last store anywhere
+    words = {}                          # address -> constant word stored there
+
+    def wait(addr, interlock, cycle):
+        if addr is None:
+            return max(cycle, latest)
+        cycle = max(cycle, unknown)
+        for byte in range(addr, addr + interlock):
+            cycle = max(cycle, pending.get(byte, 0))
+        return cycle
+
+    def offset(base, value, const, bit):
+        if const & bit:
+            return None if base is None else base + value
+        if value == NONE:
+            return base
+        if base is None or regs[value] is None:
+            return None
+        return base + regs[value]
+
+    cycle = last = 0
+    for n, (op, a, b, d, c) in enumerate(block.rows(), 1):
+        entry = table[op]
+        if entry is None:
+            raise SimulatorError(f"instruction {n}: unknown opcode.")
+        kind, latency, fn = entry
+        cycle = issue(kind, a, b, d, c, ready, cycle + 1)
+
+        value = None
+        if kind == ARITH:
+            x, y = regs[a], b if c & OP2_CONST else regs[b]
+            if x is not None and y is not None and (fn is not divide or y):
+                value = wrap(fn(x, y))
+        elif kind == LOADI:
+            value = a
+        elif kind == COPY:
+            value = regs[a]
+        elif kind == TOCHAR:
+            value = None if regs[a] is None else char(regs[a])
+        elif kind == LOAD or kind == CLOAD:
+            size = 4 if kind == LOAD else 1
+            addr = offset(regs[a], b, c, OP2_CONST)
+            cycle = wait(addr, size, cycle)
+            if kind == LOAD:
+                value = words.get(addr)
+        elif kind == STORE or kind == CSTORE:
+            if b == NONE:
+                addr = regs[d]
+            else:
+                addr = offset(regs[b], d, c, DST_CONST)
+            done = cycle + latency
+            if addr is None:
+                unknown = done
+                words.clear()
+            else:
+                size = 4 if kind == STORE else 1
+                for byte in range(addr, addr + size):
+                    pending[byte] = done
+                for at in range(addr - 3, addr + size):
+                    words.pop(at, None)
+                if kind == STORE and regs[a] is not None:
+                    words[addr] = regs[a]
+            latest = done
+            last = max(last, done - 1)
+            continue
+        elif kind == OUTPUT:
+            addr = a if c & OP1_CONST else regs[a]
+            cycle = wait(offset(addr, d, c, DST_CONST), 1, cycle)
+            last = max(last, cycle)
+            continue
+        else:
+            last = max(last, cycle)
+            continue
+
+        done = cycle + latency
+        if done >= ready[d]:
+            regs[d] = value
+            ready[d] = done
+        last = max(last, done - 1)
+
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Executes ILOC code from a file or stdin.",
+        epilog="-i takes every number after it, so it goes after the file: "
+               "iloc_sim.py block.i -i 1024 1 1, or iloc_sim.py -i 1024 1 1 "
+               "< block.i"
+    )
+    parser.add_argument(
+        'filename', nargs='?', help="ILOC file, stdin if omitted"
+    )
+    parser.add_argument(
+        '-i', nargs='+', type=int, metavar=('BASE', 'VALUE'), default=[],
+        help="store the values as words starting at address BASE"
+    )
+    args = parser.parse_args()
+
+    import alloc
+    base, *inputs = args.i or [INPUT_BASE]
+    if args.filename:
+        code = alloc.iter_instructions(args.filename)
+    else:
+        code = alloc.parse_lines(sys.stdin, '<stdin>')
+
+    try:
+        print(run(code, inputs, base))
+    except SimulatorError as e:
+        print(f"Simulator Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,34 @@
 from os import sep, stat
-import platform
-import subprocess
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import random
 from typing import List
 import unittest
 import alloc
+import alloc_server
+import alloc_utils
+import batch
+import bench
+import iloc_cfg
+import iloc_sched
+import iloc_sim
+from alloc_cache import AllocationCache, CachedAlloc, allocator_modules
+from alloc_incremental import Edit, IncrementalAlloc
 from collections import namedtuple, defaultdict
-from alloc_utils import get_live_ranges, get_max_live, range_cmp
+from alloc_utils import (
+    get_live_ranges, get_max_live, range_cmp, NextUseHeap, Liveness, NEVER,
+    get_reg_count, get_vr_usage, isregister, spill_summary, AllocStats,
+    color_slots, InterferenceGraph, fit_spill_code
+)
 from functools import cmp_to_key
 
 
-COMMAND = './sim -i 1024'
 DIR = r'test_blocks'
 Test = namedtuple("Test", ["block_name", "instruction", "cmd_input", "expected"])
 
@@ -24,22 +43,11 @@ testcases = [
     (""   , ["-10"])
 ]
 
-if platform.system() == "Windows":
-    #make use of Windows Subsystem for Linux to execute ILOC simulator
-    COMMAND = f"wsl {COMMAND}" 
-
-
-def get_output(cmd_input, alloc_result):
-    cmd = f"{COMMAND} {cmd_input}"
-    input_txt = '\n'.join(str(i) for i in alloc_result).encode()
-    result = subprocess.run(cmd, input=input_txt, capture_output=True)
-
-    if result.returncode != 0:
-        err_msg = ''.join(result.stderr.decode())
-        raise ValueError(f"{cmd} failed with status code {result.returncode}."
-                         f"{err_msg}\n")
-
-    return result.stdout.decode().strip().split('\n')
+def get_output(cmd_input, alloc_result) -> iloc_sim.Result:
+    """Runs allocated code on the interpreter with cmd_input seeded at 1024,
+    like the simulator's -i 1024 flag.
+    """
+    return iloc_sim.run(alloc_result, cmd_input.split())
 
 
 def get_tests():
@@ -81,6 +89,181 @@ class TestUtils(unittest.TestCase):
         self.assertDictEqual(result, expected)
 
 
+    def test_parse_lines(self):
+        """parse_lines should split operands and strip comments"""
+        lines = [
+            "// header comment",
+            "\tloadI\t1024\t=> r0 // base",
+            "\tadd\tr1, r2\t=> r3",
+            "\tstoreAI\tr3\t=> r0, 4",
+            "\tstore\tr3\t=> r1",
+            "\toutputAI r0, 4",
+            "\toutput\t1024",
+        ]
+        expected = [
+            alloc.Instruction('loadI', '1024', dst='r0'),
+            alloc.Instruction('add', 'r1', 'r2', 'r3'),
+            alloc.Instruction('storeAI', 'r3', 'r0', '4'),
+            alloc.Instruction('store', 'r3', 'r1'),
+            alloc.Instruction('outputAI', 'r0', dst='4'),
+            alloc.Instruction('output', '1024'),
+        ]
+        self.assertEqual(list(alloc.parse_lines(lines)), expected)
+
+
+    def test_parse_branches(self):
+        lines = ["L1: nop", "L2: addI r1, 1 => r1", "cbr r1 -> L1, L2", "jumpI -> L2"]
+        expected = [
+            alloc.Instruction('label', 'L1'),
+            alloc.Instruction('label', 'L2'),
+            alloc.Instruction('addI', 'r1', '1', 'r1'),
+            alloc.Instruction('cbr', 'r1', 'L1', 'L2'),
+            alloc.Instruction('jumpI', 'L2'),
+        ]
+        code = list(alloc.parse_lines(lines))
+        self.assertEqual(code, expected)
+        self.assertEqual(list(alloc.parse_lines(map(str, code))), expected)
+        with self.assertRaisesRegex(ValueError, "<input>:1:"):
+            list(alloc.parse_lines(["cbr r1 -> L1"]))
+
+
+    def test_parse_lines_reports_line_number(self):
+        lines = ["\tloadI\t1024\t=> r0", "", "\tadd\tr1, \t=> r3"]
+        with self.assertRaisesRegex(ValueError, "<input>:3:"):
+            list(alloc.parse_lines(lines))
+
+
+    def test_read_block(self):
+        """read_block should encode files as parse_lines does"""
+        lines = [
+            "// header comment", "\tloadI\t1024\t=> r0 // base", "L1: nop",
+            "L2: addI r1, -1 => r1", "cbr r1 -> L1, L2", "nop", "",
+            "\tstoreAI\tr1\t=> r0, 4\r", "\toutput\t1024",
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [f"{DIR}/{name}" for name in sorted(os.listdir(DIR))]
+            paths.append(os.path.join(tmp, 'branches.i'))
+            with open(paths[-1], 'w') as f:
+                f.write('\n'.join(lines))
+            for path in paths:
+                block = alloc.read_block(path)
+                expected = alloc.Block.encode(alloc.iter_instructions(path))
+                self.assertEqual(block.names, expected.names)
+                self.assertEqual(block.decode(), expected.decode())
+
+            empty = os.path.join(tmp, 'empty.i')
+            open(empty, 'w').close()
+            self.assertEqual(len(alloc.read_block(empty)), 0)
+            with open(empty, 'w') as f:
+                f.write("loadI 1024 => r0\n\nadd r1, => r3\n")
+            with self.assertRaisesRegex(ValueError, f"{empty}:3: 'add r1, => r3'"):
+                alloc.read_block(empty)
+
+
+    def test_parsers_agree(self):
+        """parse_lines and parse_block share a tokenizer: same code, same errors"""
+        good = [
+            "L1: nop // comment", "L2: loadI 1 => r1", "jumpI -> L2", "nop",
+            "cbr r1 -> L1, L2", "storeAI r1 => r0, -4", "store r1 => r2",
+            "loadAO r1, r2 => r3", "output 1024", "outputAI r0, 4", "",
+        ]
+        sources = [good]
+        for name in sorted(os.listdir(DIR)):
+            with open(f"{DIR}/{name}") as f:
+                sources.append(f.read().splitlines())
+        for lines in sources:
+            expected = alloc.Block.encode(alloc.parse_lines(lines))
+            block = alloc.parse_block('\n'.join(lines))
+            self.assertEqual(block.names, expected.names)
+            self.assertEqual(block.decode(), expected.decode())
+
+        bad = [
+            "add r1, => r3", "add r1 r2 => r3", "a b: nop", "cbr r1 -> L1",
+            "jumpI r1 -> L1", "-> L1", "loadI => r1", "add r1, r2, r3, r4 => r5",
+            "L1: add r1 => ", "storeAI r1 => r0,, 4",
+        ]
+        for line in bad:
+            with self.assertRaises(ValueError) as parsed:
+                list(alloc.parse_lines(["nop", line]))
+            with self.assertRaises(ValueError) as encoded:
+                alloc.parse_block("nop\n" + line)
+            self.assertEqual(str(encoded.exception), str(parsed.exception))
+            self.assertIn("<input>:2:", str(parsed.exception))
+
+
+    def test_wide_constants(self):
+        """constants beyond 32 bits are kept, beyond 64 bits reported"""
+        lines = ["loadI 4294967296 => r1", "addI r1, -9223372036854775808 => r2",
+                 "store r2 => r1"]
+        expected = alloc.parse_lines(lines)
+        block = alloc.parse_block('\n'.join(lines))
+        self.assertEqual(block.decode(), list(expected))
+        self.assertEqual(alloc.Block.encode(block.decode()).decode(), block.decode())
+        result = alloc.BottomUpAlloc(block).allocate(3)
+        self.assertEqual(result[0].op1, '4294967296')
+        with self.assertRaisesRegex(ValueError, "<input>:2: constant 2"):
+            alloc.parse_block("loadI 1 => r1\nloadI 2" + "0" * 19 + " => r2")
+        with self.assertRaisesRegex(ValueError, "instruction 1: constant 2"):
+            alloc.Block.encode(alloc.parse_lines(["loadI 1 => r1", "loadI 2" + "0" * 19 + " => r2"]))
+
+
+    def test_block_round_trip(self):
+        """encoding to a Block and decoding should give back the same code"""
+        for t in get_tests():
+            block = alloc.Block.encode(t.instruction)
+            self.assertEqual(block.decode(), t.instruction)
+            self.assertEqual(block.names[block.bp], 'r0')
+
+
+    def test_next_use_heap_matches_max(self):
+        """NextUseHeap.top should pick the same register as a linear max"""
+        rnd = random.Random(0)
+        regs = [alloc.BottomUpAlloc.Register(j) for j in range(1, 17)]
+        heap = NextUseHeap(regs)
+        for _ in range(2000):
+            i = rnd.randrange(len(regs))
+            regs[i].next = rnd.choice([-1, float('inf'), rnd.randrange(50)])
+            heap.update(i)
+            self.assertIs(heap.top(), max(regs, key=lambda x: x.next))
+
+
+    def test_liveness_matches_utils(self):
+        """Liveness should agree with the per-purpose helpers"""
+        for t in get_tests():
+            block = alloc.Block.encode(t.instruction)
+            live = Liveness.of(block)
+            self.assertIs(live, Liveness.of(block))
+
+            count = get_reg_count(t.instruction)
+            ranges = get_live_ranges(t.instruction)
+            for vr, reg in block.ids.items():
+                self.assertEqual(live.count[reg], count[vr])
+                end = float('inf') if live.end[reg] == NEVER else live.end[reg]
+                self.assertEqual((live.start[reg], end), ranges[vr])
+
+            # next uses chain every occurrence of a register in order
+            usage = get_vr_usage(t.instruction)
+            for j, i in enumerate(t.instruction):
+                for field, vr in enumerate(i[1:]):
+                    if isregister(vr):
+                        self.assertEqual(usage[vr].pop(), j)
+                        expected = usage[vr][-1] if usage[vr] else NEVER
+                        self.assertEqual(live.next_use[3 * j + field], expected)
+
+
+    @unittest.skipIf(alloc_utils.np is None, "NumPy is not installed")
+    def test_vectorized_liveness(self):
+        blocks = [alloc.Block.encode(t.instruction) for t in get_tests()]
+        blocks.append(alloc.Block())
+        for ranges in bench.RANGES:
+            blocks.append(bench.make_block(3000, 64, ranges=ranges, constants=0.25))
+        for block in blocks:
+            scanned = Liveness(block, vectorized=False)
+            vectorized = Liveness(block, vectorized=True)
+            for field in ('count', 'start', 'end', 'last', 'next_use', 'pressure'):
+                self.assertEqual(getattr(vectorized, field), getattr(scanned, field))
+
+
     def test_max_live(self):
         input_pairs = [
             (0, 11), (1, 9), (2, 3), (3, 6), (4, 8),(5, 7), (6, 6), 
@@ -109,8 +292,7 @@ def print_stats(stats):
     for block in stats:
         print(block, end='\t')
         for res in stats[block]:
-            cycles = res.split()[-2]
-            print(cycles, end='\t')
+            print(res.cycles, end='\t')
         print("")
 
 class AllocatorTest(unittest.TestCase):
@@ -123,7 +305,7 @@ class AllocatorTest(unittest.TestCase):
                 result = allocator.allocate(k)
                 out = get_output(t.cmd_input, result)
                 self.assertEqual(
-                    t.expected, out[:-1],
+                    t.expected, [str(v) for v in out.outputs],
                     f"{t.block_name} failed with k = {k}"
                 )
 
@@ -136,7 +318,7 @@ class AllocatorTest(unittest.TestCase):
                 result = allocator.allocate(k)
                 out = get_output(t.cmd_input, result)
                 self.assertEqual(
-                    t.expected, out[:-1],
+                    t.expected, [str(v) for v in out.outputs],
                     f"{t.block_name} failed with k = {k}"
                 )
 
@@ -148,7 +330,7 @@ class AllocatorTest(unittest.TestCase):
                 result = allocator.allocate(k)
                 out = get_output(t.cmd_input, result)
                 self.assertEqual(
-                    t.expected, out[:-1],
+                    t.expected, [str(v) for v in out.outputs],
                     f"{t.block_name} failed with k = {k}"
                 )
 
@@ -160,6 +342,907 @@ class AllocatorTest(unittest.TestCase):
                 result = allocator.allocate(k)
                 out = get_output(t.cmd_input, result)
                 self.assertEqual(
-                    t.expected, out[:-1],
+                    t.expected, [str(v) for v in out.outputs],
                     f"{t.block_name} failed with k = {k}"
                 )
+
+
+class InterpreterTest(unittest.TestCase):
+
+    def run_lines(self, lines, inputs=()):
+        return iloc_sim.run(alloc.parse_lines(lines), inputs)
+
+
+    def test_unallocated_blocks(self):
+        for t in get_tests():
+            out = get_output(t.cmd_input, t.instruction)
+            self.assertEqual(t.expected, [str(v) for v in out.outputs])
+
+
+    def test_matches_simulator(self):
+        """outputs and cycle counts recorded from ./sim"""
+        cases = [
+            #a load waits for the store to an overlapping word
+            ([
+                "loadI 1 => r1", "loadI 1025 => r0", "store r1 => r0",
+                "loadI 1024 => r2", "load r2 => r3", "output 1025",
+                "output 1024",
+            ], [1, 0], 12),
+            #i2c truncates, c2i sign extends, the slower write of r9 wins
+            ([
+                "loadI 1024 => r0", "loadI 300 => r1", "i2c r1 => r2",
+                "store r2 => r0", "output 1024", "loadI -1 => r3",
+                "c2i r3 => r4", "store r4 => r0", "output 1024",
+                "loadI 1 => r5", "loadI 33 => r6", "lshift r5, r6 => r7",
+                "store r7 => r0", "output 1024", "loadI 7 => r8",
+                "cstore r8 => r0", "cload r0 => r9", "loadI 1 => r9",
+                "storeAI r9 => r0, 4", "output 1028",
+            ], [44, -1, 2, 7], 43),
+            #output does not wait for a store starting past its address
+            ([
+                "loadI 1025 => r1", "loadI -1 => r2", "store r2 => r1",
+                "output 1024",
+            ], [0], 7),
+        ]
+        for lines, outputs, cycles in cases:
+            result = self.run_lines(lines)
+            self.assertEqual(result.outputs, outputs)
+            self.assertEqual(result.cycles, cycles)
+
+
+    def test_estimate_cycles_matches_run(self):
+        for t in get_tests():
+            for Allocator in (alloc.SimpleAlloc, alloc.BottomUpAlloc):
+                result = Allocator(t.instruction).allocate(5)
+                self.assertEqual(
+                    iloc_sim.estimate_cycles(result),
+                    get_output(t.cmd_input, result).cycles
+                )
+
+
+    def test_invalid_address(self):
+        with self.assertRaisesRegex(iloc_sim.SimulatorError, "20000"):
+            self.run_lines(["loadI 20000 => r1", "load r1 => r2"])
+
+
+def reference_spills(live_ranges, k):
+    """Spilled registers of the textbook linear scan over live_ranges using
+    a plain list as active set, evicting the earliest inserted interval
+    among those ending last.
+    """
+    active, spilled = [], set()
+    for i in live_ranges:
+        active = [j for j in active if j.end >= i.start]
+        if len(active) < k:
+            active.append(i)
+            continue
+        spill = max(active, key=lambda j: j.end)
+        if spill.end > i.end:
+            active.remove(spill)
+            active.append(i)
+            spilled.add(spill.name)
+        else:
+            spilled.add(i.name)
+    return spilled
+
+
+class LinearScanStressTest(unittest.TestCase):
+
+    def check_allocation(self, allocator, k):
+        allocator.allocate(k)
+        spilled = {vr for vr, pos in enumerate(allocator.location) if pos is not None}
+        # the reference spills, then those making room for spill code
+        block = allocator.instructions
+        expected = reference_spills(allocator.live_ranges, k)
+        flags = [vr in expected for vr in range(len(block.names))]
+        rank = [-last for last in Liveness.of(block).last]
+        expected.update(fit_spill_code(block, flags, k, rank, allocator.constants))
+        self.assertEqual(spilled, expected)
+
+        # intervals sharing a physical register must not overlap
+        by_reg = defaultdict(list)
+        for i in allocator.live_ranges:
+            if i.name not in spilled:
+                by_reg[allocator.vr_to_reg[i.name]].append(i)
+        for intervals in by_reg.values():
+            for a, b in zip(intervals, intervals[1:]):
+                self.assertLess(a.end, b.start)
+
+
+    def test_matches_reference_on_test_blocks(self):
+        for t in get_tests():
+            for k in num_registers:
+                self.check_allocation(alloc.LinearScanAlloc(t.instruction), k)
+
+
+    def test_many_intervals(self):
+        block = bench.make_block(120000, 64)
+        for k in (8, 32):
+            allocator = alloc.LinearScanAlloc(block)
+            self.assertGreater(len(allocator.live_ranges), 100000)
+            self.check_allocation(allocator, k)
+
+
+class FitSpillCodeTest(unittest.TestCase):
+
+    def test_spills_value_live_across(self):
+        block = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "loadI 1 => r1", "loadI 2 => r2", "loadI 3 => r3",
+            "add r1, r2 => r4", "add r4, r3 => r5", "storeAI r5 => r0, 0",
+        ]))
+        r1, r2, r3 = (block.ids[name] for name in ('r1', 'r2', 'r3'))
+        rank = [0] * len(block.names)
+        for k, added in ((3, []), (2, [r3])):
+            spilled = [vr in (r1, r2) for vr in range(len(block.names))]
+            self.assertEqual(fit_spill_code(block, spilled, k, rank), added)
+            self.assertEqual(spilled[r3], bool(added))
+        with self.assertRaises(ValueError):
+            fit_spill_code(block, [vr in (r1, r2) for vr in range(len(block.names))], 1, rank)
+
+
+    def test_outputs_with_few_registers(self):
+        for t in get_tests():
+            for Allocator in (alloc.SimpleAlloc, alloc.TopDownAlloc, alloc.LinearScanAlloc):
+                for k in (2, 3, 4):
+                    result = Allocator(t.instruction).allocate(k)
+                    self.assertEqual(t.expected, [str(v) for v in get_output(t.cmd_input, result).outputs])
+
+
+    def test_spills_operands_at_two_registers(self):
+        # at add r1, r2 => r3 only its operands are left to spill
+        block = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "loadI 1 => r1", "loadI 2 => r2",
+            "add r1, r2 => r3", "add r1, r3 => r4", "add r2, r4 => r5",
+            "store r5 => r0", "output 1024",
+        ]))
+        blocks = [block] + [bench.make_block(80, 8, seed) for seed in range(4)]
+        for b in blocks:
+            expected = iloc_sim.run(b).outputs
+            for algorithm in alloc.ALLOCATORS:
+                result = alloc.make_allocator(algorithm, b).allocate(2)
+                self.assertEqual(iloc_sim.run(result).outputs, expected, algorithm)
+
+
+    def test_no_spills_at_max_pressure(self):
+        for t in get_tests():
+            block = alloc.Block.encode(t.instruction)
+            k = Liveness.of(block).max_pressure
+            for Allocator in (alloc.TopDownAlloc, alloc.LinearScanAlloc):
+                result = Allocator(block).allocate(k)
+                self.assertEqual(spill_summary(block, result), (0, 0, 0))
+
+
+class AllocateManyTest(unittest.TestCase):
+
+    def test_allocate_many_matches_allocate(self):
+        allocators = [
+            alloc.SimpleAlloc, alloc.TopDownAlloc, alloc.BottomUpAlloc,
+            alloc.LinearScanAlloc
+        ]
+        for t in get_tests():
+            for Allocator in allocators:
+                sweep = Allocator(t.instruction).allocate_many(num_registers)
+                self.assertEqual([s.k for s in sweep], num_registers)
+                for k, result, _ in sweep:
+                    expected = Allocator(t.instruction).allocate(k)
+                    self.assertEqual(result.decode(), expected.decode())
+
+
+    def test_register_range(self):
+        self.assertEqual(alloc.register_range('5'), range(5, 6))
+        self.assertEqual(alloc.register_range('2..32'), range(2, 33))
+        for text in ('1', '8..4', 'a..b'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                alloc.register_range(text)
+
+
+class BenchTest(unittest.TestCase):
+
+    def test_make_block(self):
+        for ranges in bench.RANGES:
+            block = bench.make_block(5000, 32, ranges=ranges, constants=0.25)
+            live = Liveness.of(block)
+            self.assertEqual(block.names[block.bp], 'r0')
+            self.assertAlmostEqual(sum(live.pressure) / len(block), 32, delta=8)
+            immediates = sum(1 for c in block.const[1:5001] if c)
+            self.assertAlmostEqual(immediates / 5000, 0.25, delta=0.05)
+
+        #with equal ranges every value is read for the last time pressure
+        #operations after its definition
+        block = bench.make_block(1000, 16, ranges='equal')
+        live = Liveness.of(block)
+        for vr in range(1, 900):
+            self.assertEqual(live.last[vr] - live.start[vr], 16)
+
+
+    def test_compare_flags_regressions(self):
+        record = {
+            'block': 'b', 'algorithm': 'BottomUpAlloc', 'k': 8, 'ms': 100.0,
+            'relative_ms': 4.0, 'peak_kib': 100, 'spill_instructions': 10,
+            'cycles': 50,
+        }
+        noisy = dict(record, ms=120.0, relative_ms=4.8, peak_kib=110)
+        self.assertEqual(bench.compare([noisy], [record]), [])
+
+        #a machine twice as slow times the reference twice as long too
+        slower = dict(record, ms=200.0)
+        self.assertEqual(bench.compare([slower], [record]), [])
+
+        worse = dict(record, cycles=51, ms=200.0, relative_ms=8.0)
+        self.assertEqual(len(bench.compare([worse], [record])), 2)
+
+
+class AllocStatsTest(unittest.TestCase):
+
+    def test_stats_describe_allocation(self):
+        block = alloc.Block.encode(alloc.read_instructions(f"{DIR}/block1.i"))
+        for Allocator in alloc.ALLOCATORS.values():
+            allocator = Allocator(block)
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                result = allocator.allocate(4)
+            self.assertEqual(out.getvalue(), '')
+
+            stats = allocator.stats
+            slots, loads, stores = spill_summary(block, result)
+            self.assertEqual((stats.algorithm, stats.k), (Allocator.__name__, 4))
+            self.assertEqual(stats.frame_size, 4 * slots)
+            self.assertEqual((stats.reloads, stats.spills), (loads, stores))
+            self.assertEqual(stats.max_live_before, Liveness.of(block).max_pressure)
+            self.assertLessEqual(stats.max_live_after, 5)
+            self.assertIn('analysis', stats.phases)
+            self.assertIsNone(stats.peak_kib)
+
+
+    def test_write_stats(self):
+        allocator = alloc.TopDownAlloc(alloc.read_instructions(f"{DIR}/block4.i"))
+        sweep = allocator.allocate_many([3, 4])
+        with tempfile.TemporaryDirectory() as tmp:
+            name = os.path.join(tmp, 'stats.json')
+            alloc.write_stats([s.stats for s in sweep], 1.5, name)
+            with open(name) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual([r['k'] for r in records], [3, 4])
+        self.assertEqual(records[0]['phases']['parse'], 1.5)
+        self.assertEqual(set(records[0]), set(AllocStats.FIELDS))
+
+
+class SpillSlotTest(unittest.TestCase):
+
+    def test_color_slots(self):
+        block = alloc.Block.encode(alloc.parse_lines(["storeAI r1 => r0, -8"]))
+        result = alloc.Block.encode(alloc.parse_lines([
+            "storeAI r1 => r0, -4", "storeAI r2 => r0, -12", "loadAI r0, -4 => r1",
+            "storeAI r1 => r0, -16", "loadAI r0, -12 => r2", "loadAI r0, -16 => r1",
+            "storeAI r1 => r0, -8",
+        ]))
+        self.assertEqual(color_slots(block, result), 12)
+        self.assertEqual([i.dst if i.opcode == 'storeAI' else i.op2 for i in result], [
+            '-4', '-12', '-4', '-4', '-12', '-4', '-8'
+        ])
+
+
+    def test_allocators_share_slots(self):
+        block = bench.make_block(2000, 32)
+        for Allocator in (
+            alloc.SimpleAlloc, alloc.TopDownAlloc, alloc.BottomUpAlloc,
+            alloc.LinearScanAlloc
+        ):
+            allocator = Allocator(block)
+            result = allocator.allocate(6)
+            stats = allocator.stats
+            self.assertLess(stats.frame_size, stats.frame_size_before // 4)
+            self.assertEqual(stats.frame_size, 4 * spill_summary(block, result)[0])
+        for t in get_tests():
+            result = alloc.TopDownAlloc(t.instruction).allocate(3)
+            self.assertEqual(t.expected, [str(v) for v in get_output(t.cmd_input, result).outputs])
+
+
+    def test_sweep_counts_spilled_values(self):
+        block = alloc.read_instructions(f"{DIR}/block4.i")
+        sweep = alloc.SimpleAlloc(block).allocate_many([3])
+        with tempfile.TemporaryDirectory() as tmp, \
+                contextlib.redirect_stdout(io.StringIO()) as out:
+            alloc.write_sweep(sweep, 'block4.i', tmp)
+        row = dict(zip(*(line.split('\t') for line in out.getvalue().splitlines())))
+        # every value SimpleAlloc spills is stored once, sharing few slots
+        self.assertEqual(row['|spilled|'], row['|stores|'])
+        self.assertLess(int(row['|frame|']), 4 * int(row['|spilled|']))
+
+
+class RedundantSpillTest(unittest.TestCase):
+
+    def test_remove_redundant_spill_code(self):
+        code = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "storeAI r1 => r0, -4", "loadAI r0, -4 => r1",
+            "loadAI r0, -4 => r2", "add r1, r2 => r1", "storeAI r2 => r0, -4",
+            "store r1 => r2", "loadAI r0, -4 => r2",
+        ]))
+        self.assertEqual(alloc.remove_redundant_spill_code(code), 3)
+        self.assertEqual([str(i) for i in code], [
+            "loadI\t1024\t=> r0", "storeAI\tr1\t=> r0, -4", "i2i\tr1\t=> r2",
+            "add\tr1, r2\t=> r1", "store\tr1\t=> r2", "loadAI\tr0, -4\t=> r2",
+        ])
+
+
+    def test_rewrite_in_place_refreshes_liveness(self):
+        code = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "storeAI r1 => r0, -4", "loadAI r0, -4 => r2",
+            "add r1, r2 => r3", "store r3 => r0",
+        ]))
+        r1 = code.ids['r1']
+        self.assertEqual(Liveness.of(code).count[r1], 2)
+        self.assertEqual(alloc.remove_redundant_spill_code(code), 1)
+        self.assertEqual(len(code), 5)  # the reload became an i2i r1 => r2
+        self.assertEqual(Liveness.of(code).count[r1], 3)
+
+
+    def test_clean_values_are_not_stored_again(self):
+        #every register of the block is defined once, so is stored at most once
+        block = bench.make_block(2000, 32)
+        for k in (4, 8):
+            result = alloc.BottomUpAlloc(block).allocate(k)
+            self.assertLessEqual(spill_summary(block, result)[2], len(block.names))
+        for t in get_tests():
+            for Allocator in (
+                alloc.SimpleAlloc, alloc.TopDownAlloc, alloc.BottomUpAlloc,
+                alloc.LinearScanAlloc
+            ):
+                result = Allocator(t.instruction).allocate(3)
+                self.assertEqual(t.expected, [str(v) for v in get_output(t.cmd_input, result).outputs])
+
+
+class RematerializationTest(unittest.TestCase):
+
+    def test_constants_are_not_spilled(self):
+        t = get_tests()[4]
+        block = alloc.Block.encode(t.instruction)
+        constants = alloc.constants(block)
+        self.assertEqual(constants[block.ids['r48']], 0)
+        self.assertEqual(constants[block.ids['r1']], 4)
+        for Allocator, k in ((alloc.BottomUpAlloc, 3), (alloc.LinearScanAlloc, 3)):
+            spilling = Allocator(block)
+            spilling.rematerialize = False
+            before = spilling.allocate(k)
+            after = Allocator(block).allocate(k)
+            self.assertEqual(t.expected, [str(v) for v in get_output(t.cmd_input, after).outputs])
+            self.assertLess(spill_summary(block, after)[2], spill_summary(block, before)[2])
+            self.assertLess(iloc_sim.estimate_cycles(after), iloc_sim.estimate_cycles(before))
+
+
+class SplittingLinearScanTest(unittest.TestCase):
+
+    def test_lifetime_holes(self):
+        block = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "loadI 1 => r1", "loadI 2 => r2", "add r1, r2 => r3",
+            "loadI 5 => r1", "add r1, r3 => r1", "storeAI r1 => r0, 0", "output 1024",
+        ]))
+        result = alloc.SplittingLinearScanAlloc(block).allocate(2)
+        self.assertEqual(spill_summary(block, result), (0, 0, 0))
+        self.assertEqual(iloc_sim.run(result).outputs, [8])
+
+
+    def test_outputs(self):
+        for t in get_tests():
+            for k in (2, 3, 5):
+                result = alloc.SplittingLinearScanAlloc(t.instruction).allocate(k)
+                self.assertEqual(t.expected, [str(v) for v in get_output(t.cmd_input, result).outputs])
+
+
+    def test_splits_spill_less_than_linear_scan(self):
+        block = bench.make_block(2000, 32, constants=0.2)
+        memory_size = block.op1[0] + 4
+        expected = iloc_sim.run(block, memory_size=memory_size).outputs
+        self.assertGreater(len(expected), 10)
+        for k in (4, 8, 16):
+            result = alloc.SplittingLinearScanAlloc(block).allocate(k)
+            linear = alloc.LinearScanAlloc(block).allocate(k)
+            self.assertEqual(iloc_sim.run(result, memory_size=memory_size).outputs, expected)
+            self.assertLess(sum(spill_summary(block, result)[1:]), sum(spill_summary(block, linear)[1:]))
+
+
+class GraphColoringTest(unittest.TestCase):
+
+    def test_interference_graph(self):
+        block = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "loadI 1 => r1", "loadI 2 => r2", "add r1, r2 => r3",
+            "mult r3, r1 => r4", "storeAI r4 => r0, 0",
+        ]))
+        graph = InterferenceGraph(block, {block.bp})
+        r1, r2, r3, r4 = (block.ids[f'r{j}'] for j in range(1, 5))
+        self.assertEqual(graph.edges, 2)
+        self.assertEqual(sorted(graph.neighbors(r1)), [r2, r3])
+        self.assertTrue(graph.interferes(r2, r1))
+        self.assertFalse(graph.interferes(r2, r3))
+        self.assertEqual(list(graph.neighbors(r4)), [])
+        self.assertNotIn(block.bp, graph.nodes)
+
+
+    def test_outputs(self):
+        for t in get_tests():
+            for k in (2, 3, 5):
+                result = alloc.GraphColoringAlloc(t.instruction).allocate(k)
+                self.assertEqual(t.expected, [str(v) for v in get_output(t.cmd_input, result).outputs])
+        with self.assertRaises(ValueError):
+            alloc.GraphColoringAlloc(t.instruction).allocate(1)
+
+
+    def test_spills_less_than_linear_scan(self):
+        block = bench.make_block(2000, 32, constants=0.2)
+        memory_size = block.op1[0] + 4
+        expected = iloc_sim.run(block, memory_size=memory_size).outputs
+        self.assertGreater(len(expected), 10)
+        for k in (4, 8):
+            allocator = alloc.GraphColoringAlloc(block)
+            result = allocator.allocate(k)
+            linear = alloc.LinearScanAlloc(block).allocate(k)
+            self.assertGreater(allocator.rounds, 1)
+            self.assertEqual(iloc_sim.run(result, memory_size=memory_size).outputs, expected)
+            self.assertLess(sum(spill_summary(block, result)[1:]), sum(spill_summary(block, linear)[1:]))
+            self.assertLess(iloc_sim.estimate_cycles(result), iloc_sim.estimate_cycles(linear))
+
+
+class ExactTest(unittest.TestCase):
+
+    def test_outputs(self):
+        for t in get_tests():
+            for k in (2, 3, 5):
+                exact = alloc.ExactAlloc(t.instruction)
+                result = exact.allocate(k)
+                self.assertTrue(exact.optimal)
+                self.assertEqual(t.expected, [str(v) for v in get_output(t.cmd_input, result).outputs])
+                for algorithm in 'bolg':
+                    heuristic = alloc.ALLOCATORS[algorithm](t.instruction).allocate(k)
+                    self.assertLessEqual(exact.cost, alloc.spill_cost(exact.instructions, heuristic))
+
+
+    def test_stores_cost_more_than_reloads(self):
+        #bottom-up stores both products, read after r1; evicting r1 instead,
+        #a constant, and storing only r3 saves a storeAI and a loadAI
+        block = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "loadI 28 => r1", "mult r1, r1 => r2", "mult r1, r1 => r3",
+            "add r1, r2 => r4", "add r4, r3 => r5", "add r3, r5 => r6", "store r6 => r0",
+            "output 1024",
+        ]))
+        exact = alloc.ExactAlloc(block)
+        result = exact.allocate(2)
+        self.assertEqual(iloc_sim.run(result).outputs, [28 * 28 * 3 + 28])
+        self.assertEqual(exact.cost, 11)
+        self.assertEqual(alloc.spill_cost(block, alloc.BottomUpAlloc(block).allocate(2)), 20)
+
+
+    def test_falls_back_to_bottom_up(self):
+        block = bench.make_block(300, 16, constants=0.2)
+        exact = alloc.ExactAlloc(block, budget=0)
+        result = exact.allocate(8)
+        self.assertFalse(exact.optimal)
+        self.assertEqual(result.decode(), alloc.BottomUpAlloc(block).allocate(8).decode())
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_outputs(self):
+        for t in get_tests():
+            for k in (3, 5):
+                for algorithm in 'stbolg':
+                    result = alloc.ALLOCATORS[algorithm](t.instruction).allocate(k)
+                    scheduled = iloc_sched.schedule(result)
+                    output = get_output(t.cmd_input, scheduled)
+                    self.assertEqual(t.expected, [str(v) for v in output.outputs])
+                    self.assertLessEqual(output.cycles, get_output(t.cmd_input, result).cycles)
+
+
+    def test_hides_load_latency(self):
+        block = bench.make_block(2000, 32, constants=0.2)
+        memory_size = block.op1[0] + 4
+        expected = iloc_sim.run(block, memory_size=memory_size).outputs
+        self.assertGreater(len(expected), 10)
+        result = alloc.BottomUpAlloc(block).allocate(8)
+        before = iloc_sim.run(result, memory_size=memory_size)
+        after = iloc_sim.run(iloc_sched.schedule(result), memory_size=memory_size)
+        self.assertEqual(before.outputs, expected)
+        self.assertEqual(after.outputs, expected)
+        self.assertLess(after.cycles, before.cycles * 0.9)
+
+
+    def test_dead_load_is_not_overtaken(self):
+        block = alloc.Block.encode(alloc.parse_lines([
+            "loadI 1024 => r0", "loadAI r0, 0 => r1", "loadI 3 => r1",
+            "storeAI r1 => r0, 4", "output 1028",
+        ]))
+        graph = iloc_sched.DependenceGraph(block, 0, len(block), iloc_sched.latencies())
+        order = graph.order()
+        self.assertEqual(order, [0, 1, None, None, None, None, 2, 3, 4])
+        scheduled = alloc.Block(list(block.names))
+        for j in order:
+            if j is None:
+                scheduled.add(alloc.Instruction('nop', None))
+            else:
+                scheduled.add(block[j])
+        self.assertEqual(iloc_sim.run(scheduled).outputs, [3])
+        self.assertEqual(list(alloc.parse_lines(str(i) for i in scheduled)), scheduled.decode())
+
+
+class PortfolioTest(unittest.TestCase):
+
+    def test_keeps_cheapest_result(self):
+        block = alloc.Block.encode(alloc.read_instructions(f"{DIR}/block1.i"))
+        portfolio = alloc.PortfolioAlloc(block)
+        result = portfolio.allocate(4)
+
+        cycles = {
+            Allocator.__name__: iloc_sim.estimate_cycles(Allocator(block).allocate(4))
+            for a, Allocator in alloc.ALLOCATORS.items() if a != 'p'
+        }
+        self.assertEqual(portfolio.winner, min(cycles, key=cycles.get))
+        self.assertEqual(iloc_sim.estimate_cycles(result), min(cycles.values()))
+        self.assertEqual(list(portfolio.outcomes), list(cycles))
+
+
+    def test_budget(self):
+        portfolio = alloc.PortfolioAlloc(
+            alloc.read_instructions(f"{DIR}/block1.i"), budget=0
+        )
+        with self.assertRaisesRegex(RuntimeError, "stopped after 0 s"):
+            portfolio.allocate(4)
+
+
+class CacheTest(unittest.TestCase):
+
+    def test_version_covers_allocator_modules(self):
+        names = {os.path.basename(p) for p in allocator_modules()}
+        for module in (alloc, alloc_utils, iloc_cfg, iloc_sched, iloc_sim):
+            self.assertIn(os.path.basename(module.__file__), names)
+        #the command line alone imports these
+        self.assertFalse(names & {'batch.py', 'alloc_cache.py'})
+
+
+    def test_hits_return_the_allocation(self):
+        block = alloc.Block.encode(alloc.read_instructions(f"{DIR}/block4.i"))
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AllocationCache(tmp)
+            for _ in range(2):
+                allocator = CachedAlloc(cache, 'b', block)
+                sweep = allocator.allocate_many([3, 5])
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            self.assertTrue(allocator.hit)
+            self.assertIsNone(allocator.allocator)
+
+            for k, result, stats in sweep:
+                expected = alloc.BottomUpAlloc(block).allocate(k)
+                self.assertEqual(list(result), list(expected))
+                self.assertEqual(stats.spills, spill_summary(block, expected)[2])
+            self.assertEqual(
+                list(cache.allocate(block, 5, 't')),
+                list(alloc.TopDownAlloc(block).allocate(5))
+            )
+
+
+    def test_evicts_least_recently_used(self):
+        blocks = [bench.make_block(200, 8, seed) for seed in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AllocationCache(tmp)
+            for b in blocks + [blocks[0], blocks[2]]:
+                cache.allocate(b, 4, 'o')
+            sizes = [
+                os.path.getsize(os.path.join(root, f))
+                for root, _, files in os.walk(tmp) for f in files if f != '.lock'
+            ]
+            cache.max_bytes = sum(sizes) - 1
+            cache.evict()
+
+            cache.hits = cache.misses = 0
+            for b in (blocks[0], blocks[2], blocks[1]):
+                cache.allocate(b, 4, 'o')
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+            self.assertEqual(len(sizes), 3)
+
+
+    def test_writes_evict_only_past_the_cap(self):
+        blocks = [bench.make_block(100, 8, seed) for seed in range(12)]
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AllocationCache(tmp)
+            cache.allocate(blocks[0], 4, 'b')
+            cache.max_bytes = 4 * cache.size
+            evictions = 0
+            for b in blocks[1:]:
+                cache.allocate(b, 4, 'b')
+                if cache.writes == 0:
+                    evictions += 1
+                on_disk = sum(
+                    os.path.getsize(os.path.join(root, f))
+                    for root, _, files in os.walk(tmp) for f in files if f != '.lock'
+                )
+                self.assertEqual(cache.size, on_disk)
+                self.assertLessEqual(on_disk, cache.max_bytes)
+            self.assertTrue(0 < evictions <= 5)
+
+
+    def test_corrupt_entry_is_a_miss(self):
+        block = alloc.Block.encode(alloc.read_instructions(f"{DIR}/block2.i"))
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AllocationCache(tmp)
+            allocator = CachedAlloc(cache, 's', block)
+            expected = list(allocator.allocate(4))
+            [path] = [
+                os.path.join(root, f)
+                for root, _, files in os.walk(tmp) for f in files if f != '.lock'
+            ]
+            with open(path, 'r+b') as f:
+                f.truncate(20)
+            self.assertEqual(list(allocator.allocate(4)), expected)
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+
+    def test_labels_are_part_of_the_key(self):
+        renamed = [line.replace('L1', 'LOOP').replace('L5', 'DONE') for line in LOOP]
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AllocationCache(tmp)
+            for lines in (LOOP, renamed):
+                block = alloc.Block.encode(alloc.parse_lines(lines))
+                result = cache.allocate(block, 4, 'b')
+                expected = alloc.make_allocator('b', block).allocate(4)
+                self.assertEqual(list(result), list(expected))
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+
+#counts the odd numbers up to n and adds up the even ones
+LOOP = [
+    "loadI 1024 => r0", "load r0 => r1", "loadI 0 => r2", "loadI 1 => r3",
+    "loadI 0 => r5",
+    "L1: cmp_LE r3, r1 => r4", "cbr r4 -> L2, L5",
+    "L2: andI r3, 1 => r6", "cbr r6 -> L3, L4",
+    "L3: addI r5, 1 => r5", "jumpI -> L6",
+    "L4: add r2, r3 => r2",
+    "L6: addI r3, 1 => r3", "jumpI -> L1",
+    "L5: storeAI r2 => r0, 0", "storeAI r5 => r0, 4", "output 1024",
+    "output 1028",
+]
+
+
+class GlobalAllocTest(unittest.TestCase):
+
+    def test_liveness(self):
+        cfg = iloc_cfg.CFG(alloc.parse_lines(LOOP))
+        self.assertEqual(cfg.labels, [None, 'L1', 'L2', 'L3', 'L4', 'L6', 'L5'])
+        self.assertEqual(cfg.succ, [[1], [2, 6], [3, 4], [5], [5], [1], []])
+        live_in, live_out = iloc_cfg.liveness(cfg)
+        def names(vector):
+            return {cfg.code.names[r] for r in iloc_cfg.bits(vector)}
+        self.assertEqual(names(live_in[1]), {'r0', 'r1', 'r2', 'r3', 'r5'})
+        self.assertEqual(names(live_out[3]), {'r0', 'r1', 'r2', 'r3', 'r5'})
+        self.assertEqual(names(live_in[6]), {'r0', 'r2', 'r5'})
+        self.assertEqual(live_out[6], 0)
+
+
+    def test_allocates_every_block(self):
+        code = list(alloc.parse_lines(LOOP))
+        self.assertEqual(iloc_sim.run(code, [10]).outputs, [30, 5])
+        for algorithm in 'stbo':
+            for k in (3, 5):
+                allocator = alloc.make_allocator(algorithm, code)
+                result = allocator.allocate(k)
+                self.assertIsInstance(allocator, iloc_cfg.GlobalAlloc)
+                self.assertEqual(iloc_sim.run(result, [10]).outputs, [30, 5])
+                self.assertLessEqual(len(result.names), k + 1 + 6)
+
+        expected = list(iloc_cfg.GlobalAlloc(code, 'b').allocate(3))
+        parallel = iloc_cfg.GlobalAlloc(code, 'b', jobs=2).allocate(3)
+        self.assertEqual(list(parallel), expected)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = AllocationCache(tmp)
+            for _ in range(2):
+                self.assertEqual(list(cache.allocate(code, 3, 'b')), expected)
+            self.assertEqual(cache.hits, 1)
+
+
+    def test_undefined_label(self):
+        with self.assertRaisesRegex(ValueError, "L9"):
+            iloc_cfg.CFG(alloc.parse_lines(["loadI 1 => r1", "jumpI -> L9"]))
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def test_allocate_matches_bottom_up(self):
+        for t in get_tests():
+            for k in (3, 5):
+                bottom_up = alloc.BottomUpAlloc(t.instruction)
+                bottom_up.rematerialize = False
+                self.assertEqual(
+                    list(IncrementalAlloc(t.instruction).allocate(k)),
+                    list(bottom_up.allocate(k))
+                )
+
+
+    def test_edits_keep_outputs(self):
+        for t in get_tests():
+            for k in (3, 5):
+                allocator = IncrementalAlloc(t.instruction)
+                allocator.allocate(k)
+                for p in range(1, len(t.instruction), 3):
+                    #a dead copy of a live value, then the original back
+                    src = alloc.Instruction('i2i', 'r0', None, 'r900')
+                    for j in range(p - 1, -1, -1):
+                        dst = t.instruction[j].dst
+                        if t.instruction[j].opcode != 'store' and dst and dst[0] == 'r':
+                            src = alloc.Instruction('i2i', dst, None, 'r900')
+                            break
+                    for script in ([Edit(p, p, [src])], [Edit(p, p + 1)]):
+                        out = get_output(t.cmd_input, allocator.edit(script))
+                        self.assertEqual(t.expected, [str(v) for v in out.outputs])
+                self.assertEqual(
+                    [str(i) for i in allocator.instructions],
+                    [str(i) for i in t.instruction]
+                )
+
+
+    def test_random_edits_keep_outputs(self):
+        """edits next to loads and constants, checked on generated blocks"""
+        swap = {'add': 'sub', 'sub': 'mult', 'mult': 'add',
+                'addI': 'subI', 'subI': 'multI', 'multI': 'addI'}
+        for seed in range(40):
+            rnd = random.Random(seed)
+            block = bench.make_block(200, 12, seed, constants=0.2)
+            memory_size = block.op1[0] + 4
+            allocator = IncrementalAlloc(block)
+            allocator.allocate(rnd.choice([3, 4, 6, 8]))
+            for step in range(10):
+                code = allocator.instructions.decode()
+                j = rnd.choice([
+                    j for j, i in enumerate(code) if j and i.opcode in swap.keys() | {'loadI'}
+                ])
+                i, c = code[j], str(rnd.randint(-20, 20))
+                #every edit keeps each value read, so no definition is dead
+                kind = rnd.randrange(3)
+                if kind == 0 and i.opcode == 'loadI':
+                    script = [Edit(j, j + 1, [i._replace(op1=c)])]
+                elif kind == 0:
+                    script = [Edit(j, j + 1, [i._replace(opcode=swap[i.opcode])])]
+                elif kind == 1:
+                    script = [Edit(j + 1, j + 1, [alloc.Instruction('multI', i.dst, c, i.dst)])]
+                else:
+                    tmp = f'r{1000 + step}'
+                    script = [Edit(j + 1, j + 1, [
+                        alloc.Instruction('loadI', c, None, tmp),
+                        alloc.Instruction('add', i.dst, tmp, i.dst),
+                    ])]
+                result = allocator.edit(script)
+                expected = iloc_sim.run(allocator.instructions, memory_size=memory_size)
+                self.assertEqual(
+                    iloc_sim.run(result, memory_size=memory_size).outputs,
+                    expected.outputs, f"seed {seed} step {step}"
+                )
+            #the whole block and code are patched in place to match the chunks
+            chunks = allocator.chunks
+            self.assertEqual(
+                allocator.instructions.decode(),
+                [i for c in chunks for i in c.block.decode()]
+            )
+            self.assertEqual(
+                list(result.rows()), [row for c in chunks for row in c.code.rows()]
+            )
+
+
+    def test_window_is_local(self):
+        block = bench.make_block(20000, 16)
+        allocator = IncrementalAlloc(block)
+        allocator.allocate(8)
+        instructions = block.decode()
+        allocator.edit([
+            Edit(5000, 5001, [instructions[5000]]), Edit(15000, 15000, [instructions[14999]])
+        ])
+        self.assertLess(allocator.window, 200)
+        self.assertEqual(len(allocator.instructions), len(block) + 1)
+        with self.assertRaisesRegex(ValueError, "overlaps"):
+            allocator.edit([Edit(3, 5), Edit(4, 6)])
+
+
+class ServerTest(unittest.TestCase):
+
+    def test_allocate_request(self):
+        with open(f"{DIR}/block4.i") as f:
+            code = f.read()
+        reply = alloc_server.allocate({'id': 3, 'code': code, 'k': 5, 'algorithm': 't'})
+        expected = alloc.TopDownAlloc(alloc.read_block(f"{DIR}/block4.i")).allocate(5)
+        self.assertEqual(reply['id'], 3)
+        self.assertEqual(reply['code'].split('\n'), [str(i) for i in expected])
+        self.assertEqual(set(reply['stats']), set(AllocStats.FIELDS))
+        self.assertIn('parse', reply['stats']['phases'])
+        with self.assertRaisesRegex(ValueError, "without k"):
+            alloc_server.allocate({'code': code, 'algorithm': 'b'})
+
+
+    def test_pipelined_requests_keep_their_order(self):
+        with open(f"{DIR}/block1.i") as f:
+            code = f.read()
+        requests = [{'id': i, 'code': code, 'k': k, 'algorithm': 'b'}
+                    for i, k in enumerate(range(3, 9))]
+        requests.insert(2, {'id': 'bad', 'code': 'add r1, => r2', 'k': 4, 'algorithm': 'b'})
+        lines = b''.join(json.dumps(r).encode() + b'\n' for r in requests) + b'{\n'
+
+        async def exchange(path):
+            async with alloc_server.AllocServer(jobs=1, max_pending=2) as server:
+                serving = asyncio.ensure_future(server.serve_unix(path))
+                while not os.path.exists(path):
+                    await asyncio.sleep(0.01)
+                reader, writer = await asyncio.open_unix_connection(path)
+                writer.write(lines)
+                writer.write_eof()
+                replies = [json.loads(line) async for line in reader]
+                writer.close()
+                serving.cancel()
+                return replies
+
+        with tempfile.TemporaryDirectory() as tmp:
+            replies = asyncio.run(exchange(os.path.join(tmp, 'alloc.sock')))
+        self.assertEqual([r['id'] for r in replies], [r['id'] for r in requests] + [None])
+        self.assertIn('error', replies[2])
+        self.assertIn('JSONDecodeError', replies[-1]['error'])
+        block = alloc.read_block(f"{DIR}/block1.i")
+        for request, reply in zip(requests, replies):
+            if request['id'] != 'bad':
+                expected = alloc.BottomUpAlloc(block).allocate(request['k'])
+                self.assertEqual(reply['code'].split('\n'), [str(i) for i in expected])
+
+
+    def test_worker_crash_keeps_the_connection(self):
+        with open(f"{DIR}/block1.i") as f:
+            code = f.read()
+
+        async def exchange(path):
+            async with alloc_server.AllocServer(jobs=1) as server:
+                serving = asyncio.ensure_future(server.serve_unix(path))
+                while not os.path.exists(path):
+                    await asyncio.sleep(0.01)
+                reader, writer = await asyncio.open_unix_connection(path)
+                async def request(id):
+                    request = {'id': id, 'code': code, 'k': 4, 'algorithm': 'b'}
+                    writer.write(json.dumps(request).encode() + b'\n')
+                    return json.loads(await reader.readline())
+
+                replies = [await request(0)]
+                for process in server.pool._processes.values():
+                    process.kill()
+                for id in range(1, 5):
+                    replies.append(await request(id))
+                    if 'code' in replies[-1]:
+                        break
+                writer.write_eof()
+                await reader.read() # until the server is done with it
+                writer.close()
+                serving.cancel()
+                return replies
+
+        with tempfile.TemporaryDirectory() as tmp:
+            replies = asyncio.run(exchange(os.path.join(tmp, 'alloc.sock')))
+        self.assertIn('code', replies[0])
+        self.assertIn('code', replies[-1])
+        for reply in replies[1:-1]:
+            self.assertIn('BrokenProcessPool', reply['error'])
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_batch_survives_failures(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, 'src')
+            shutil.copytree(DIR, src)
+            with open(os.path.join(src, 'bad.i'), 'w') as f:
+                f.write("add r1, => r2\n")
+            out = os.path.join(tmp, 'out')
+            with contextlib.redirect_stdout(io.StringIO()):
+                reports = batch.run_batch(src, range(5, 6), 'o', out, jobs=2)
+
+            self.assertEqual(
+                [os.path.basename(r.path) for r in reports],
+                ['bad.i'] + [f'block{b}.i' for b in range(len(testcases))]
+            )
+            self.assertIn('bad.i:1:', reports[0].error)
+            for r in reports[1:]:
+                self.assertIsNone(r.error)
+                name = os.path.join(out, os.path.basename(r.path))
+                with open(name) as f:
+                    expected = alloc.LinearScanAlloc(
+                        alloc.read_instructions(r.path)
+                    ).allocate(5)
+                    self.assertEqual(f.read().split('\n')[:-1], [str(i) for i in expected])